@@ -0,0 +1,1625 @@
+"""A small pure-Python AVM used as an offline stand-in for algod dryrun.
+
+It executes TEAL parsed by teal.py against an in-memory Ledger, with pooled
+opcode budgets, inner transactions, boxes and fee pooling.  Box access is
+limited to the group's box references and their 1024 byte I/O quota each, and
+inner transactions to 16 per application call of the group.  An application
+call carries at most 16 args of 2048 bytes in total and 8 foreign references
+(accounts, assets, applications and boxes, at most 4 of them accounts); an
+app is created with the pages its programs need and writes no more global or
+local state than its schema.  It does not try to be a full node: only what
+p3-contract.py (and its padding/OpUp calls) needs is modelled, and anything
+else, keccak256 included, fails loudly with an AVMError.
+"""
+
+import copy
+import hashlib
+
+import teal
+
+
+MAX_UINT64 = 2 ** 64 - 1
+MAX_BYTES = 4096
+APP_CALL_BUDGET = 700
+MIN_TXN_FEE = 1000
+MAX_GROUP_SIZE = 16
+MIN_BALANCE = 100000
+ASSET_MIN_BALANCE = 100000
+BOX_FLAT_MIN_BALANCE = 2500
+BOX_BYTE_MIN_BALANCE = 400
+MAX_BOX_SIZE = 32768
+# each box reference of a group adds this many bytes to the group's box I/O quota
+BOX_REFERENCE_QUOTA = 1024
+# inner transactions an application call may issue, pooled across the group
+MAX_INNER_TXNS = 16
+MAX_APP_ARGS = 16
+MAX_APP_ARGS_SIZE = 2048
+MAX_ACCOUNTS = 4
+# accounts, assets, applications and boxes a call may reference together
+MAX_FOREIGN_REFS = 8
+ZERO_ADDRESS = bytes(32)
+
+TYPE_ENUMS = {b"pay": 1, b"keyreg": 2, b"acfg": 3, b"axfer": 4, b"afrz": 5, b"appl": 6}
+TYPE_NAMES = {v: k for k, v in TYPE_ENUMS.items()}
+
+ARRAY_FIELDS = ("ApplicationArgs", "Accounts", "Assets", "Applications", "Logs")
+
+
+class AVMError(Exception):
+    def __init__(self, message, line=None):
+        super().__init__(message if line is None else "%s (line %d)" % (message, line))
+        self.line = line
+
+
+def app_address(app_id):
+    return hashlib.new("sha512_256", b"appID" + app_id.to_bytes(8, "big")).digest()
+
+
+def box_min_balance(name, size):
+    return BOX_FLAT_MIN_BALANCE + BOX_BYTE_MIN_BALANCE * (len(name) + size)
+
+
+class Account:
+    def __init__(self, balance=0):
+        self.balance = balance
+        self.assets = {}
+        self.local = {}
+        self.extra_min_balance = 0
+
+    def min_balance(self):
+        return MIN_BALANCE + ASSET_MIN_BALANCE * len(self.assets) + self.extra_min_balance
+
+
+class Application:
+    def __init__(self, app_id, creator, approval, clear, global_schema=(0, 0),
+                 local_schema=(0, 0)):
+        self.id = app_id
+        self.creator = creator
+        self.approval = approval
+        self.clear = clear
+        self.address = app_address(app_id)
+        self.globals = {}
+        self.boxes = {}
+        # (uints, byte slices) the app may keep globally and per opted-in account
+        self.global_schema = global_schema
+        self.local_schema = local_schema
+
+
+class Ledger:
+    """accounts, assets, applications and boxes that programs run against"""
+
+    def __init__(self, round=1000, timestamp=1700000000):
+        self.round = round
+        self.timestamp = timestamp
+        self.accounts = {}
+        self.assets = {}
+        self.apps = {}
+        self._next_id = 1000
+
+    def next_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def account(self, address):
+        if address not in self.accounts:
+            self.accounts[address] = Account()
+        return self.accounts[address]
+
+    def fund(self, address, amount):
+        self.account(address).balance += amount
+
+    def create_asset(self, creator, total=1, decimals=0, unit_name=b"", name=b"",
+                     url=b"", metadata_hash=b"", manager=ZERO_ADDRESS,
+                     reserve=ZERO_ADDRESS, freeze=ZERO_ADDRESS,
+                     clawback=ZERO_ADDRESS, default_frozen=0):
+        asset_id = self.next_id()
+        self.assets[asset_id] = {
+            "AssetTotal": total, "AssetDecimals": decimals,
+            "AssetDefaultFrozen": default_frozen, "AssetUnitName": unit_name,
+            "AssetName": name, "AssetURL": url,
+            "AssetMetadataHash": metadata_hash, "AssetManager": manager,
+            "AssetReserve": reserve, "AssetFreeze": freeze,
+            "AssetClawback": clawback, "AssetCreator": creator,
+        }
+        self.account(creator).assets[asset_id] = total
+        return asset_id
+
+    def opt_in_asset(self, address, asset_id):
+        self.account(address).assets.setdefault(asset_id, 0)
+
+    def create_app(self, creator, approval, clear=None, app_id=None, global_schema=(0, 0),
+                   local_schema=(0, 0)):
+        app_id = app_id or self.next_id()
+        app = Application(app_id, creator, approval, clear or teal.parse("#pragma version 8\nint 1"),
+                          global_schema, local_schema)
+        self.apps[app_id] = app
+        self.account(app.address)
+        return app
+
+    def box(self, app_id, name):
+        return self.apps[app_id].boxes.get(name)
+
+    def snapshot(self):
+        """copy of the mutable state; parsed programs are shared"""
+        other = copy.copy(self)
+        other.accounts = {}
+        for address, account in self.accounts.items():
+            clone = copy.copy(account)
+            clone.assets = dict(account.assets)
+            clone.local = {k: dict(v) for k, v in account.local.items()}
+            other.accounts[address] = clone
+        other.assets = {k: dict(v) for k, v in self.assets.items()}
+        other.apps = {}
+        for app_id, app in self.apps.items():
+            clone = copy.copy(app)
+            clone.globals = dict(app.globals)
+            clone.boxes = dict(app.boxes)
+            other.apps[app_id] = clone
+        return other
+
+
+def txn(type, sender, **fields):
+    """a transaction as a dict of TEAL field names, with sensible defaults"""
+    if isinstance(type, str):
+        type = type.encode()
+    t = {
+        "Sender": sender, "Fee": MIN_TXN_FEE, "FirstValid": 0, "LastValid": 0,
+        "Note": b"", "Lease": bytes(32), "Type": type, "TypeEnum": TYPE_ENUMS[type],
+        "Receiver": ZERO_ADDRESS, "Amount": 0, "CloseRemainderTo": ZERO_ADDRESS,
+        "RekeyTo": ZERO_ADDRESS, "XferAsset": 0, "AssetAmount": 0,
+        "AssetSender": ZERO_ADDRESS, "AssetReceiver": ZERO_ADDRESS,
+        "AssetCloseTo": ZERO_ADDRESS, "ApplicationID": 0, "OnCompletion": 0,
+        "ApplicationArgs": [], "Accounts": [], "Assets": [], "Applications": [],
+        "Boxes": [], "ConfigAsset": 0, "ConfigAssetTotal": 0,
+        "ConfigAssetDecimals": 0, "ConfigAssetDefaultFrozen": 0,
+        "ConfigAssetUnitName": b"", "ConfigAssetName": b"", "ConfigAssetURL": b"",
+        "ConfigAssetMetadataHash": b"", "ConfigAssetManager": ZERO_ADDRESS,
+        "ConfigAssetReserve": ZERO_ADDRESS, "ConfigAssetFreeze": ZERO_ADDRESS,
+        "ConfigAssetClawback": ZERO_ADDRESS, "ApprovalProgram": b"",
+        "ClearStateProgram": b"", "GlobalNumUint": 0, "GlobalNumByteSlice": 0,
+        "LocalNumUint": 0, "LocalNumByteSlice": 0, "ExtraProgramPages": 0,
+        "CreatedAssetID": 0, "CreatedApplicationID": 0, "Logs": [],
+    }
+    t.update(fields)
+    return t
+
+
+def payment(sender, receiver, amount, **fields):
+    return txn("pay", sender, Receiver=receiver, Amount=amount, **fields)
+
+
+def asset_transfer(sender, receiver, asset_id, amount, **fields):
+    return txn("axfer", sender, AssetReceiver=receiver, XferAsset=asset_id,
+               AssetAmount=amount, **fields)
+
+
+def app_call(sender, app_id, args=(), on_completion=0, **fields):
+    args = [a if isinstance(a, bytes) else a.encode() if isinstance(a, str)
+            else a.to_bytes(8, "big") for a in args]
+    return txn("appl", sender, ApplicationID=app_id, ApplicationArgs=args,
+               OnCompletion=on_completion, **fields)
+
+
+class CallTrace:
+    """what one application call did while it ran"""
+
+    def __init__(self, group_index, app_id):
+        self.group_index = group_index
+        self.app_id = app_id
+        self.cost = 0
+        self.steps = 0
+        self.inner_txns = []
+        self.boxes_read = set()
+        self.boxes_written = set()
+        self.logs = []
+
+    def to_dict(self):
+        return {
+            "group_index": self.group_index,
+            "app_id": self.app_id,
+            "opcode_cost": self.cost,
+            "inner_txns": len(self.inner_txns),
+            "inner_types": [t["Type"].decode() for t in self.inner_txns],
+            "boxes_read": sorted(b.hex() for b in self.boxes_read),
+            "boxes_written": sorted(b.hex() for b in self.boxes_written),
+        }
+
+
+class GroupResult:
+    def __init__(self, approved, error, calls, budget, fee_credit):
+        self.approved = approved
+        self.error = error
+        self.calls = calls
+        self.budget = budget
+        self.fee_credit = fee_credit
+
+    @property
+    def cost(self):
+        return sum(c.cost for c in self.calls)
+
+    @property
+    def inner_txns(self):
+        return sum(len(c.inner_txns) for c in self.calls)
+
+    @property
+    def boxes(self):
+        touched = set()
+        for c in self.calls:
+            touched |= c.boxes_read | c.boxes_written
+        return touched
+
+    def to_dict(self):
+        return {
+            "approved": self.approved,
+            "error": self.error,
+            "opcode_cost": self.cost,
+            "budget": self.budget,
+            "inner_txns": self.inner_txns,
+            "boxes_touched": len(self.boxes),
+            "calls": [c.to_dict() for c in self.calls],
+        }
+
+
+class _Pool:
+    def __init__(self, budget, fee_credit, box_refs=(), box_quota=0, inner_limit=0):
+        self.budget = budget
+        self.used = 0
+        self.fee_credit = fee_credit
+        # (app ID, name) of every box the group references, and the bytes they may move
+        self.box_refs = set(box_refs)
+        self.box_quota = box_quota
+        self.box_io = {}
+        self.inner_limit = inner_limit
+        self.inner_used = 0
+
+
+def _box_references(t):
+    """(app ID, name) of a call's box references; app index 0 is the called app"""
+    refs = []
+    for index, name in t["Boxes"]:
+        if index == 0:
+            app_id = t["ApplicationID"] or t["CreatedApplicationID"]
+        elif index <= len(t["Applications"]):
+            app_id = t["Applications"][index - 1]
+        else:
+            raise AVMError("box reference app index %d out of range" % index)
+        if name:
+            refs.append((app_id, name))
+    return refs
+
+
+def run_group(ledger, group):
+    """execute a transaction group; the ledger is only changed if it approves"""
+    working = ledger.snapshot()
+    app_calls = sum(1 for t in group if t["Type"] == b"appl")
+    paid = sum(t["Fee"] for t in group)
+    references = sum(len(t["Boxes"]) for t in group if t["Type"] == b"appl")
+    pool = _Pool(APP_CALL_BUDGET * app_calls, paid - MIN_TXN_FEE * len(group),
+                 box_quota=BOX_REFERENCE_QUOTA * references,
+                 inner_limit=MAX_INNER_TXNS * app_calls)
+    calls = []
+    try:
+        if len(group) > MAX_GROUP_SIZE:
+            raise AVMError("group of %d exceeds %d transactions" % (len(group), MAX_GROUP_SIZE))
+        if pool.fee_credit < 0:
+            raise AVMError("group underpays fees by %d" % -pool.fee_credit)
+        for index, t in enumerate(group):
+            t["GroupIndex"] = index
+            if t["Type"] == b"appl":
+                _check_call(t)
+            _apply(working, t)
+            if t["Type"] == b"appl":
+                pool.box_refs.update(_box_references(t))
+                trace = CallTrace(index, t["ApplicationID"] or t["CreatedApplicationID"])
+                calls.append(trace)
+                Evaluator(working, group, index, pool, trace).run()
+        _check_min_balances(working, group, calls)
+    except AVMError as e:
+        return GroupResult(False, str(e), calls, pool.budget, pool.fee_credit)
+    ledger.__dict__.update(working.__dict__)
+    return GroupResult(True, None, calls, pool.budget, pool.fee_credit)
+
+
+def _check_call(t):
+    """the arg and foreign reference limits of an application call"""
+    args = t["ApplicationArgs"]
+    if len(args) > MAX_APP_ARGS:
+        raise AVMError("%d application args exceed %d" % (len(args), MAX_APP_ARGS))
+    size = sum(len(a) for a in args)
+    if size > MAX_APP_ARGS_SIZE:
+        raise AVMError("application args of %d bytes exceed %d" % (size, MAX_APP_ARGS_SIZE))
+    if len(t["Accounts"]) > MAX_ACCOUNTS:
+        raise AVMError("%d foreign accounts exceed %d" % (len(t["Accounts"]), MAX_ACCOUNTS))
+    refs = len(t["Accounts"]) + len(t["Assets"]) + len(t["Applications"]) + len(t["Boxes"])
+    if refs > MAX_FOREIGN_REFS:
+        raise AVMError("%d foreign references exceed %d" % (refs, MAX_FOREIGN_REFS))
+
+
+def _program_size(program):
+    if isinstance(program, teal.Program):
+        return len(teal.assemble(program))
+    return len(program or b"")
+
+
+def _check_min_balances(ledger, group, calls):
+    addresses = {t["Sender"] for t in group}
+    addresses.update(ledger.apps[c.app_id].address for c in calls if c.app_id in ledger.apps)
+    for address in addresses:
+        account = ledger.account(address)
+        empty = account.balance == 0 and account.min_balance() == MIN_BALANCE
+        if not empty and account.balance < account.min_balance():
+            raise AVMError("account %s below min balance: %d < %d" % (
+                address.hex()[:8], account.balance, account.min_balance()))
+
+
+def _apply(ledger, t):
+    """move funds/assets for a transaction (before an app call's program runs)"""
+    sender = ledger.account(t["Sender"])
+    fee = t["Fee"]
+    if sender.balance < fee:
+        raise AVMError("sender cannot pay fee")
+    sender.balance -= fee
+    kind = t["Type"]
+    if kind == b"pay":
+        if sender.balance < t["Amount"]:
+            raise AVMError("overspend by %s" % t["Sender"].hex()[:8])
+        sender.balance -= t["Amount"]
+        ledger.account(t["Receiver"]).balance += t["Amount"]
+    elif kind == b"axfer":
+        asset_id = t["XferAsset"]
+        if asset_id not in ledger.assets:
+            raise AVMError("asset %d does not exist" % asset_id)
+        receiver = ledger.account(t["AssetReceiver"])
+        if t["AssetReceiver"] == t["Sender"] and t["AssetAmount"] == 0:
+            sender.assets.setdefault(asset_id, 0)
+            return
+        if asset_id not in sender.assets or asset_id not in receiver.assets:
+            raise AVMError("asset %d not opted in" % asset_id)
+        if sender.assets[asset_id] < t["AssetAmount"]:
+            raise AVMError("asset %d underflow" % asset_id)
+        sender.assets[asset_id] -= t["AssetAmount"]
+        receiver.assets[asset_id] += t["AssetAmount"]
+    elif kind == b"acfg":
+        if t["ConfigAsset"] == 0:
+            t["CreatedAssetID"] = ledger.create_asset(
+                t["Sender"], t["ConfigAssetTotal"], t["ConfigAssetDecimals"],
+                t["ConfigAssetUnitName"], t["ConfigAssetName"],
+                t["ConfigAssetURL"], t["ConfigAssetMetadataHash"],
+                t["ConfigAssetManager"], t["ConfigAssetReserve"],
+                t["ConfigAssetFreeze"], t["ConfigAssetClawback"],
+                t["ConfigAssetDefaultFrozen"])
+    elif kind == b"appl":
+        if t["ApplicationID"] == 0:
+            pages = t["ExtraProgramPages"]
+            if pages > teal.MAX_EXTRA_PAGES:
+                raise AVMError("%d extra program pages exceed %d" % (pages, teal.MAX_EXTRA_PAGES))
+            size = _program_size(t["ApprovalProgram"]) + _program_size(t["ClearStateProgram"])
+            if size > (1 + pages) * teal.PAGE_SIZE:
+                raise AVMError("programs of %d bytes exceed %d extra pages"
+                               % (size, pages))
+            program = t["ApprovalProgram"]
+            if not isinstance(program, teal.Program):
+                program = None
+            clear = t["ClearStateProgram"]
+            new = ledger.create_app(
+                t["Sender"], program, clear if isinstance(clear, teal.Program) else None,
+                global_schema=(t["GlobalNumUint"], t["GlobalNumByteSlice"]),
+                local_schema=(t["LocalNumUint"], t["LocalNumByteSlice"]))
+            t["CreatedApplicationID"] = new.id
+        elif t["ApplicationID"] not in ledger.apps:
+            raise AVMError("application %d does not exist" % t["ApplicationID"])
+        if t["OnCompletion"] == 1:
+            ledger.account(t["Sender"]).local.setdefault(t["ApplicationID"], {})
+    else:
+        raise AVMError("unsupported transaction type %r" % kind)
+
+
+class _Frame:
+    def __init__(self, return_to):
+        self.return_to = return_to
+        self.pointer = None
+        self.args = 0
+        self.returns = 0
+
+
+class Evaluator:
+    """runs one application call's approval program"""
+
+    def __init__(self, ledger, group, index, pool, trace):
+        self.ledger = ledger
+        self.group = group
+        self.index = index
+        self.txn = group[index]
+        self.pool = pool
+        self.trace = trace
+        self.app = ledger.apps[self.txn["ApplicationID"] or self.txn["CreatedApplicationID"]]
+        self.stack = []
+        self.scratch = [0] * 256
+        self.frames = []
+        self.inner = None
+        self.inner_group = []
+        self.last_inner_group = []
+        self.line = None
+
+    # -- helpers ---------------------------------------------------------
+
+    def fail(self, message):
+        raise AVMError(message, self.line)
+
+    def pop(self):
+        if not self.stack:
+            self.fail("stack underflow")
+        return self.stack.pop()
+
+    def pop_int(self):
+        v = self.pop()
+        if not isinstance(v, int):
+            self.fail("expected uint64, got bytes")
+        return v
+
+    def pop_bytes(self):
+        v = self.pop()
+        if not isinstance(v, bytes):
+            self.fail("expected bytes, got uint64")
+        return v
+
+    def push(self, v):
+        if isinstance(v, bool):
+            v = int(v)
+        if isinstance(v, int) and not 0 <= v <= MAX_UINT64:
+            self.fail("uint64 overflow")
+        if isinstance(v, bytes) and len(v) > MAX_BYTES:
+            self.fail("byte string longer than %d" % MAX_BYTES)
+        self.stack.append(v)
+
+    def txn_field(self, t, field, index=None):
+        if field == "NumAppArgs":
+            return len(t["ApplicationArgs"])
+        if field == "NumAccounts":
+            return len(t["Accounts"])
+        if field == "NumAssets":
+            return len(t["Assets"])
+        if field == "NumApplications":
+            return len(t["Applications"])
+        if field == "NumLogs":
+            return len(t["Logs"])
+        if field == "TxID":
+            return hashlib.sha512(repr(sorted((k, repr(v)) for k, v in t.items())).encode()).digest()[:32]
+        if field == "Accounts":
+            values = [t["Sender"]] + list(t["Accounts"])
+        elif field == "Applications":
+            values = [t["ApplicationID"]] + list(t["Applications"])
+        elif field in ARRAY_FIELDS:
+            values = t[field]
+        else:
+            if field not in t:
+                self.fail("unsupported transaction field %s" % field)
+            value = t[field]
+            return value if not isinstance(value, teal.Program) else b""
+        if index is None:
+            self.fail("%s needs an index" % field)
+        if index >= len(values):
+            self.fail("%s index %d out of range" % (field, index))
+        return values[index]
+
+    def global_field(self, field):
+        if field == "MinTxnFee":
+            return MIN_TXN_FEE
+        if field == "MinBalance":
+            return MIN_BALANCE
+        if field == "MaxTxnLife":
+            return 1000
+        if field == "ZeroAddress":
+            return ZERO_ADDRESS
+        if field == "GroupSize":
+            return len(self.group)
+        if field == "LogicSigVersion":
+            return 8
+        if field == "Round":
+            return self.ledger.round
+        if field == "LatestTimestamp":
+            return self.ledger.timestamp
+        if field == "CurrentApplicationID":
+            return self.app.id
+        if field == "CreatorAddress":
+            return self.app.creator
+        if field == "CurrentApplicationAddress":
+            return self.app.address
+        if field == "GroupID":
+            return hashlib.sha256(b"group" + bytes([len(self.group)])).digest()
+        if field == "OpcodeBudget":
+            return self.pool.budget - self.pool.used
+        if field in ("CallerApplicationID",):
+            return 0
+        if field == "CallerApplicationAddress":
+            return ZERO_ADDRESS
+        self.fail("unsupported global %s" % field)
+
+    def resolve_account(self, ref):
+        if isinstance(ref, int):
+            accounts = [self.txn["Sender"]] + list(self.txn["Accounts"])
+            if ref >= len(accounts):
+                self.fail("account index %d out of range" % ref)
+            return accounts[ref]
+        if len(ref) != 32:
+            self.fail("invalid address")
+        return ref
+
+    def resolve_asset(self, ref):
+        foreign = self.txn["Assets"]
+        if ref < len(foreign):
+            return foreign[ref]
+        return ref
+
+    def resolve_app(self, ref):
+        foreign = self.txn["Applications"]
+        if ref == 0 or ref == self.app.id:
+            return self.app.id
+        if ref <= len(foreign):
+            return foreign[ref - 1]
+        return ref
+
+    def box_name(self, name):
+        if not 1 <= len(name) <= 64:
+            self.fail("invalid box name length %d" % len(name))
+        return name
+
+    # -- main loop -------------------------------------------------------
+
+    def run(self):
+        program = self.app.approval
+        if program is None:
+            # programs deployed as raw bytecode (e.g. OpUp helpers) just approve
+            return
+        self.program = program
+        self.labels = program.labels
+        instructions = program.instructions
+        pc = 0
+        self.line = None
+        pool = self.pool
+        trace = self.trace
+        while True:
+            if pc >= len(instructions):
+                break
+            ins = instructions[pc]
+            self.line = ins.line
+            cost = ins.cost
+            pool.used += cost
+            trace.cost += cost
+            trace.steps += 1
+            if pool.used > pool.budget:
+                self.fail("dynamic cost budget exceeded (%d > %d)" % (pool.used, pool.budget))
+            handler = _HANDLERS.get(ins.op)
+            if handler is None:
+                self.fail("unsupported opcode %s" % ins.op)
+            result = handler(self, ins, pc)
+            if result is _RETURN:
+                break
+            pc = pc + 1 if result is None else result
+        if len(self.stack) != 1:
+            self.fail("stack must hold exactly one value at the end, has %d" % len(self.stack))
+        top = self.stack[0]
+        if not isinstance(top, int) or top == 0:
+            self.fail("rejected")
+
+    def jump(self, label):
+        return self.program.target(label)
+
+    # -- inner transactions --------------------------------------------
+
+    def begin_inner(self):
+        self.inner = txn("pay", self.app.address, Fee=None)
+
+    def submit_inner(self):
+        group = self.inner_group + [self.inner]
+        self.inner_group = []
+        self.inner = None
+        if len(group) > MAX_GROUP_SIZE:
+            self.fail("inner group of %d exceeds %d transactions" % (len(group), MAX_GROUP_SIZE))
+        self.pool.inner_used += len(group)
+        if self.pool.inner_used > self.pool.inner_limit:
+            self.fail("%d inner transactions exceed the group's %d"
+                      % (self.pool.inner_used, self.pool.inner_limit))
+        for t in group:
+            if t["Sender"] != self.app.address:
+                self.fail("inner transaction sender must be the application")
+            if t["Fee"] is None:
+                covered = min(self.pool.fee_credit, MIN_TXN_FEE)
+                self.pool.fee_credit -= covered
+                t["Fee"] = MIN_TXN_FEE - covered
+            else:
+                # an explicit fee below the minimum must be made up by the group's credit
+                self.pool.fee_credit += t["Fee"] - MIN_TXN_FEE
+                if self.pool.fee_credit < 0:
+                    self.fail("inner transaction fee %d is not covered by the group" % t["Fee"])
+            t["GroupIndex"] = len(self.trace.inner_txns)
+            try:
+                _apply(self.ledger, t)
+            except AVMError as e:
+                self.fail("inner %s failed: %s" % (t["Type"].decode(), e))
+            if t["Type"] == b"appl":
+                self.pool.budget += APP_CALL_BUDGET
+                target = self.ledger.apps[t["ApplicationID"] or t["CreatedApplicationID"]]
+                if target.approval is not None:
+                    sub = CallTrace(t["GroupIndex"], target.id)
+                    Evaluator(self.ledger, [t], 0, self.pool, sub).run()
+                if t["OnCompletion"] == 5:
+                    del self.ledger.apps[target.id]
+            self.trace.inner_txns.append(t)
+        self.last_inner_group = group
+
+
+_RETURN = object()
+_HANDLERS = {}
+
+
+def _op(*names):
+    def register(fn):
+        for name in names:
+            _HANDLERS[name] = fn
+        return fn
+    return register
+
+
+def _binary(fn):
+    def handler(ev, ins, pc):
+        b = ev.pop_int()
+        a = ev.pop_int()
+        ev.push(fn(ev, a, b))
+    return handler
+
+
+def _arith(op):
+    def fn(ev, a, b):
+        if op == "+":
+            return a + b
+        if op == "-":
+            if b > a:
+                ev.fail("- would result negative")
+            return a - b
+        if op == "*":
+            return a * b
+        if op in ("/", "%"):
+            if b == 0:
+                ev.fail("division by zero")
+            return a // b if op == "/" else a % b
+        if op == "<":
+            return a < b
+        if op == ">":
+            return a > b
+        if op == "<=":
+            return a <= b
+        if op == ">=":
+            return a >= b
+        if op == "&&":
+            return bool(a) and bool(b)
+        if op == "||":
+            return bool(a) or bool(b)
+        if op == "|":
+            return a | b
+        if op == "&":
+            return a & b
+        if op == "^":
+            return a ^ b
+        if op == "shl":
+            return (a << b) & MAX_UINT64
+        if op == "shr":
+            return a >> b
+        if op == "exp":
+            if a == 0 and b == 0:
+                ev.fail("0^0")
+            return a ** b
+    return fn
+
+
+for _name in ("+", "-", "*", "/", "%", "<", ">", "<=", ">=", "&&", "||",
+              "|", "&", "^", "shl", "shr", "exp"):
+    _HANDLERS[_name] = _binary(_arith(_name))
+
+
+@_op("==", "!=")
+def _eq(ev, ins, pc):
+    b = ev.pop()
+    a = ev.pop()
+    if type(a) is not type(b):
+        ev.fail("cannot compare uint64 to bytes")
+    ev.push((a == b) == (ins.op == "=="))
+
+
+@_op("!")
+def _not(ev, ins, pc):
+    ev.push(ev.pop_int() == 0)
+
+
+@_op("~")
+def _bitnot(ev, ins, pc):
+    ev.push(MAX_UINT64 ^ ev.pop_int())
+
+
+@_op("len")
+def _len(ev, ins, pc):
+    ev.push(len(ev.pop_bytes()))
+
+
+@_op("itob")
+def _itob(ev, ins, pc):
+    ev.push(ev.pop_int().to_bytes(8, "big"))
+
+
+@_op("btoi")
+def _btoi(ev, ins, pc):
+    b = ev.pop_bytes()
+    if len(b) > 8:
+        ev.fail("btoi arg too long")
+    ev.push(int.from_bytes(b, "big"))
+
+
+@_op("mulw")
+def _mulw(ev, ins, pc):
+    b = ev.pop_int()
+    a = ev.pop_int()
+    r = a * b
+    ev.push(r >> 64)
+    ev.push(r & MAX_UINT64)
+
+
+@_op("addw")
+def _addw(ev, ins, pc):
+    b = ev.pop_int()
+    a = ev.pop_int()
+    r = a + b
+    ev.push(r >> 64)
+    ev.push(r & MAX_UINT64)
+
+
+@_op("divw")
+def _divw(ev, ins, pc):
+    c = ev.pop_int()
+    b = ev.pop_int()
+    a = ev.pop_int()
+    if c == 0:
+        ev.fail("division by zero")
+    r = ((a << 64) | b) // c
+    ev.push(r)
+
+
+@_op("sqrt")
+def _sqrt(ev, ins, pc):
+    import math
+    ev.push(math.isqrt(ev.pop_int()))
+
+
+@_op("bitlen")
+def _bitlen(ev, ins, pc):
+    a = ev.pop()
+    ev.push(a.bit_length() if isinstance(a, int) else int.from_bytes(a, "big").bit_length())
+
+
+@_op("sha256", "sha512_256", "sha3_256")
+def _hash(ev, ins, pc):
+    data = ev.pop_bytes()
+    ev.push(hashlib.new(ins.op, data).digest())
+
+
+@_op("keccak256")
+def _keccak256(ev, ins, pc):
+    # hashlib's sha3_256 pads differently from Keccak-256 and has no keccak
+    ev.fail("keccak256 is not modelled")
+
+
+@_op("ed25519verify_bare")
+def _ed25519(ev, ins, pc):
+    key = ev.pop_bytes()
+    sig = ev.pop_bytes()
+    data = ev.pop_bytes()
+    ev.push(verify_ed25519(data, sig, key))
+
+
+def verify_ed25519(data, signature, public_key):
+    from nacl.exceptions import BadSignatureError
+    from nacl.signing import VerifyKey
+    if len(public_key) != 32 or len(signature) != 64:
+        return False
+    try:
+        VerifyKey(public_key).verify(data, signature)
+    except (BadSignatureError, ValueError):
+        return False
+    return True
+
+
+@_op("intcblock", "bytecblock")
+def _cblock(ev, ins, pc):
+    pass
+
+
+@_op("intc", "intc_0", "intc_1", "intc_2", "intc_3")
+def _intc(ev, ins, pc):
+    i = int(ins.args[0]) if ins.op == "intc" else int(ins.op[5:])
+    ev.push(ev.program.intc[i])
+
+
+@_op("bytec", "bytec_0", "bytec_1", "bytec_2", "bytec_3")
+def _bytec(ev, ins, pc):
+    i = int(ins.args[0]) if ins.op == "bytec" else int(ins.op[6:])
+    ev.push(ev.program.bytec[i])
+
+
+@_op("pushint", "int")
+def _pushint(ev, ins, pc):
+    ev.push(teal.parse_int(ins.args[0]))
+
+
+@_op("pushbytes", "byte")
+def _pushbytes(ev, ins, pc):
+    ev.push(teal.parse_bytes(*ins.args))
+
+
+@_op("addr")
+def _addr(ev, ins, pc):
+    ev.push(teal.decode_address(ins.args[0]))
+
+
+@_op("method")
+def _method(ev, ins, pc):
+    ev.push(teal.method_selector(teal.parse_bytes(ins.args[0]).decode()))
+
+
+@_op("pushints")
+def _pushints(ev, ins, pc):
+    for a in ins.args:
+        ev.push(teal.parse_int(a))
+
+
+@_op("pushbytess")
+def _pushbytess(ev, ins, pc):
+    for a in ins.args:
+        ev.push(teal.parse_bytes(a))
+
+
+@_op("txn")
+def _txn(ev, ins, pc):
+    ev.push(ev.txn_field(ev.txn, ins.args[0]))
+
+
+@_op("txna")
+def _txna(ev, ins, pc):
+    ev.push(ev.txn_field(ev.txn, ins.args[0], int(ins.args[1])))
+
+
+@_op("txnas")
+def _txnas(ev, ins, pc):
+    ev.push(ev.txn_field(ev.txn, ins.args[0], ev.pop_int()))
+
+
+def _group_txn(ev, i):
+    if i >= len(ev.group):
+        ev.fail("group index %d out of range" % i)
+    return ev.group[i]
+
+
+@_op("gtxn")
+def _gtxn(ev, ins, pc):
+    ev.push(ev.txn_field(_group_txn(ev, int(ins.args[0])), ins.args[1]))
+
+
+@_op("gtxna")
+def _gtxna(ev, ins, pc):
+    ev.push(ev.txn_field(_group_txn(ev, int(ins.args[0])), ins.args[1], int(ins.args[2])))
+
+
+@_op("gtxns")
+def _gtxns(ev, ins, pc):
+    ev.push(ev.txn_field(_group_txn(ev, ev.pop_int()), ins.args[0]))
+
+
+@_op("gtxnsa")
+def _gtxnsa(ev, ins, pc):
+    ev.push(ev.txn_field(_group_txn(ev, ev.pop_int()), ins.args[0], int(ins.args[1])))
+
+
+@_op("gtxnas")
+def _gtxnas(ev, ins, pc):
+    i = ev.pop_int()
+    ev.push(ev.txn_field(_group_txn(ev, int(ins.args[0])), ins.args[1], i))
+
+
+@_op("gtxnsas")
+def _gtxnsas(ev, ins, pc):
+    i = ev.pop_int()
+    ev.push(ev.txn_field(_group_txn(ev, ev.pop_int()), ins.args[0], i))
+
+
+@_op("global")
+def _global(ev, ins, pc):
+    ev.push(ev.global_field(ins.args[0]))
+
+
+@_op("load")
+def _load(ev, ins, pc):
+    ev.push(ev.scratch[int(ins.args[0])])
+
+
+@_op("store")
+def _store(ev, ins, pc):
+    ev.scratch[int(ins.args[0])] = ev.pop()
+
+
+@_op("loads")
+def _loads(ev, ins, pc):
+    ev.push(ev.scratch[ev.pop_int()])
+
+
+@_op("stores")
+def _stores(ev, ins, pc):
+    v = ev.pop()
+    ev.scratch[ev.pop_int()] = v
+
+
+@_op("bnz")
+def _bnz(ev, ins, pc):
+    if ev.pop_int() != 0:
+        return ev.jump(ins.args[0])
+
+
+@_op("bz")
+def _bz(ev, ins, pc):
+    if ev.pop_int() == 0:
+        return ev.jump(ins.args[0])
+
+
+@_op("b")
+def _b(ev, ins, pc):
+    return ev.jump(ins.args[0])
+
+
+@_op("switch")
+def _switch(ev, ins, pc):
+    i = ev.pop_int()
+    if i < len(ins.args):
+        return ev.jump(ins.args[i])
+
+
+@_op("match")
+def _match(ev, ins, pc):
+    n = len(ins.args)
+    value = ev.pop()
+    if len(ev.stack) < n:
+        ev.fail("stack underflow")
+    candidates = ev.stack[-n:] if n else []
+    del ev.stack[len(ev.stack) - n:]
+    for label, candidate in zip(ins.args, candidates):
+        if type(candidate) is type(value) and candidate == value:
+            return ev.jump(label)
+
+
+@_op("return")
+def _return(ev, ins, pc):
+    value = ev.pop()
+    ev.stack = [value]
+    return _RETURN
+
+
+@_op("err")
+def _err(ev, ins, pc):
+    ev.fail("err opcode executed")
+
+
+@_op("assert")
+def _assert(ev, ins, pc):
+    if ev.pop_int() == 0:
+        ev.fail("assert failed")
+
+
+@_op("pop")
+def _pop(ev, ins, pc):
+    ev.pop()
+
+
+@_op("popn")
+def _popn(ev, ins, pc):
+    for _ in range(int(ins.args[0])):
+        ev.pop()
+
+
+@_op("dup")
+def _dup(ev, ins, pc):
+    v = ev.pop()
+    ev.push(v)
+    ev.push(v)
+
+
+@_op("dupn")
+def _dupn(ev, ins, pc):
+    v = ev.pop()
+    for _ in range(int(ins.args[0]) + 1):
+        ev.push(v)
+
+
+@_op("dup2")
+def _dup2(ev, ins, pc):
+    b = ev.pop()
+    a = ev.pop()
+    for v in (a, b, a, b):
+        ev.push(v)
+
+
+@_op("dig")
+def _dig(ev, ins, pc):
+    n = int(ins.args[0])
+    if n >= len(ev.stack):
+        ev.fail("dig past stack")
+    ev.push(ev.stack[-1 - n])
+
+
+@_op("bury")
+def _bury(ev, ins, pc):
+    n = int(ins.args[0])
+    v = ev.pop()
+    if n == 0 or n > len(ev.stack):
+        ev.fail("bury past stack")
+    ev.stack[-n] = v
+
+
+@_op("swap")
+def _swap(ev, ins, pc):
+    b = ev.pop()
+    a = ev.pop()
+    ev.push(b)
+    ev.push(a)
+
+
+@_op("select")
+def _select(ev, ins, pc):
+    c = ev.pop_int()
+    b = ev.pop()
+    a = ev.pop()
+    ev.push(b if c else a)
+
+
+@_op("cover")
+def _cover(ev, ins, pc):
+    n = int(ins.args[0])
+    if n >= len(ev.stack):
+        ev.fail("cover past stack")
+    v = ev.stack.pop()
+    ev.stack.insert(len(ev.stack) - n, v)
+
+
+@_op("uncover")
+def _uncover(ev, ins, pc):
+    n = int(ins.args[0])
+    if n >= len(ev.stack):
+        ev.fail("uncover past stack")
+    v = ev.stack.pop(len(ev.stack) - 1 - n)
+    ev.stack.append(v)
+
+
+@_op("concat")
+def _concat(ev, ins, pc):
+    b = ev.pop_bytes()
+    a = ev.pop_bytes()
+    ev.push(a + b)
+
+
+def _slice(ev, data, start, end):
+    if start > end or end > len(data):
+        ev.fail("extraction out of range")
+    return data[start:end]
+
+
+@_op("substring")
+def _substring(ev, ins, pc):
+    data = ev.pop_bytes()
+    ev.push(_slice(ev, data, int(ins.args[0]), int(ins.args[1])))
+
+
+@_op("substring3")
+def _substring3(ev, ins, pc):
+    end = ev.pop_int()
+    start = ev.pop_int()
+    ev.push(_slice(ev, ev.pop_bytes(), start, end))
+
+
+@_op("extract")
+def _extract(ev, ins, pc):
+    data = ev.pop_bytes()
+    start, length = int(ins.args[0]), int(ins.args[1])
+    end = len(data) if length == 0 else start + length
+    ev.push(_slice(ev, data, start, end))
+
+
+@_op("extract3")
+def _extract3(ev, ins, pc):
+    length = ev.pop_int()
+    start = ev.pop_int()
+    ev.push(_slice(ev, ev.pop_bytes(), start, start + length))
+
+
+def _extract_uint(size):
+    def handler(ev, ins, pc):
+        start = ev.pop_int()
+        data = ev.pop_bytes()
+        ev.push(int.from_bytes(_slice(ev, data, start, start + size), "big"))
+    return handler
+
+
+_HANDLERS["extract_uint16"] = _extract_uint(2)
+_HANDLERS["extract_uint32"] = _extract_uint(4)
+_HANDLERS["extract_uint64"] = _extract_uint(8)
+
+
+def _replace(ev, data, start, value):
+    if start + len(value) > len(data):
+        ev.fail("replacement out of range")
+    return data[:start] + value + data[start + len(value):]
+
+
+@_op("replace2")
+def _replace2(ev, ins, pc):
+    value = ev.pop_bytes()
+    data = ev.pop_bytes()
+    ev.push(_replace(ev, data, int(ins.args[0]), value))
+
+
+@_op("replace3")
+def _replace3(ev, ins, pc):
+    value = ev.pop_bytes()
+    start = ev.pop_int()
+    data = ev.pop_bytes()
+    ev.push(_replace(ev, data, start, value))
+
+
+@_op("getbyte")
+def _getbyte(ev, ins, pc):
+    i = ev.pop_int()
+    data = ev.pop_bytes()
+    if i >= len(data):
+        ev.fail("getbyte out of range")
+    ev.push(data[i])
+
+
+@_op("setbyte")
+def _setbyte(ev, ins, pc):
+    value = ev.pop_int()
+    i = ev.pop_int()
+    data = ev.pop_bytes()
+    if i >= len(data) or value > 255:
+        ev.fail("setbyte out of range")
+    ev.push(data[:i] + bytes([value]) + data[i + 1:])
+
+
+@_op("getbit")
+def _getbit(ev, ins, pc):
+    i = ev.pop_int()
+    a = ev.pop()
+    if isinstance(a, int):
+        if i > 63:
+            ev.fail("getbit out of range")
+        ev.push((a >> i) & 1)
+    else:
+        if i >= len(a) * 8:
+            ev.fail("getbit out of range")
+        ev.push((a[i // 8] >> (7 - i % 8)) & 1)
+
+
+@_op("setbit")
+def _setbit(ev, ins, pc):
+    bit = ev.pop_int()
+    i = ev.pop_int()
+    a = ev.pop()
+    if bit > 1:
+        ev.fail("setbit value > 1")
+    if isinstance(a, int):
+        ev.push(a | (1 << i) if bit else a & ~(1 << i))
+    else:
+        data = bytearray(a)
+        mask = 1 << (7 - i % 8)
+        data[i // 8] = data[i // 8] | mask if bit else data[i // 8] & ~mask
+        ev.push(bytes(data))
+
+
+@_op("bzero")
+def _bzero(ev, ins, pc):
+    n = ev.pop_int()
+    if n > MAX_BYTES:
+        ev.fail("bzero too large")
+    ev.push(bytes(n))
+
+
+def _bigint(ev):
+    v = ev.pop_bytes()
+    if len(v) > 64:
+        ev.fail("byte math input longer than 64 bytes")
+    return int.from_bytes(v, "big")
+
+
+def _big_result(ev, v):
+    if v < 0:
+        ev.fail("byte math would result negative")
+    ev.push(v.to_bytes((v.bit_length() + 7) // 8, "big"))
+
+
+@_op("b+", "b-", "b*", "b/", "b%", "b|", "b&", "b^")
+def _bytemath(ev, ins, pc):
+    b = _bigint(ev)
+    a = _bigint(ev)
+    if ins.op in ("b/", "b%") and b == 0:
+        ev.fail("division by zero")
+    _big_result(ev, {
+        "b+": lambda: a + b, "b-": lambda: a - b, "b*": lambda: a * b,
+        "b/": lambda: a // b if b else 0, "b%": lambda: a % b if b else 0,
+        "b|": lambda: a | b, "b&": lambda: a & b, "b^": lambda: a ^ b,
+    }[ins.op]())
+
+
+@_op("b<", "b>", "b<=", "b>=", "b==", "b!=")
+def _bytecmp(ev, ins, pc):
+    b = _bigint(ev)
+    a = _bigint(ev)
+    ev.push({
+        "b<": a < b, "b>": a > b, "b<=": a <= b, "b>=": a >= b,
+        "b==": a == b, "b!=": a != b,
+    }[ins.op])
+
+
+@_op("callsub")
+def _callsub(ev, ins, pc):
+    if len(ev.frames) >= 1024:
+        ev.fail("callsub depth exceeded")
+    ev.frames.append(_Frame(pc + 1))
+    return ev.jump(ins.args[0])
+
+
+@_op("proto")
+def _proto(ev, ins, pc):
+    frame = ev.frames[-1] if ev.frames else ev.fail("proto outside subroutine")
+    frame.args = int(ins.args[0])
+    frame.returns = int(ins.args[1])
+    if len(ev.stack) < frame.args:
+        ev.fail("proto arguments missing")
+    frame.pointer = len(ev.stack)
+
+
+def _frame_slot(ev, ins):
+    frame = ev.frames[-1] if ev.frames else ev.fail("frame access outside subroutine")
+    if frame.pointer is None:
+        ev.fail("frame access without proto")
+    slot = frame.pointer + int(ins.args[0])
+    if not 0 <= slot < len(ev.stack) or slot < frame.pointer - frame.args:
+        ev.fail("frame access out of range")
+    return slot
+
+
+@_op("frame_dig")
+def _frame_dig(ev, ins, pc):
+    ev.push(ev.stack[_frame_slot(ev, ins)])
+
+
+@_op("frame_bury")
+def _frame_bury(ev, ins, pc):
+    v = ev.pop()
+    ev.stack[_frame_slot(ev, ins)] = v
+
+
+@_op("retsub")
+def _retsub(ev, ins, pc):
+    if not ev.frames:
+        ev.fail("retsub with empty call stack")
+    frame = ev.frames.pop()
+    if frame.pointer is not None:
+        if len(ev.stack) < frame.pointer + frame.returns:
+            ev.fail("retsub with too few return values")
+        returned = ev.stack[len(ev.stack) - frame.returns:] if frame.returns else []
+        del ev.stack[frame.pointer - frame.args:]
+        ev.stack.extend(returned)
+    return frame.return_to
+
+
+@_op("balance")
+def _balance(ev, ins, pc):
+    ev.push(ev.ledger.account(ev.resolve_account(ev.pop())).balance)
+
+
+@_op("min_balance")
+def _min_balance(ev, ins, pc):
+    ev.push(ev.ledger.account(ev.resolve_account(ev.pop())).min_balance())
+
+
+@_op("app_opted_in")
+def _app_opted_in(ev, ins, pc):
+    app_id = ev.resolve_app(ev.pop_int())
+    account = ev.ledger.account(ev.resolve_account(ev.pop()))
+    ev.push(app_id in account.local)
+
+
+@_op("app_local_get", "app_local_get_ex")
+def _app_local_get(ev, ins, pc):
+    key = ev.pop_bytes()
+    app_id = ev.resolve_app(ev.pop_int()) if ins.op == "app_local_get_ex" else ev.app.id
+    account = ev.ledger.account(ev.resolve_account(ev.pop()))
+    local = account.local.get(app_id)
+    exists = local is not None and key in local
+    value = local[key] if exists else 0
+    ev.push(value)
+    if ins.op == "app_local_get_ex":
+        ev.push(exists)
+
+
+@_op("app_local_put")
+def _app_local_put(ev, ins, pc):
+    value = ev.pop()
+    key = ev.pop_bytes()
+    account = ev.ledger.account(ev.resolve_account(ev.pop()))
+    if ev.app.id not in account.local:
+        ev.fail("account not opted in to application")
+    account.local[ev.app.id][key] = value
+    _check_schema(ev, account.local[ev.app.id], ev.app.local_schema, "local")
+
+
+@_op("app_local_del")
+def _app_local_del(ev, ins, pc):
+    key = ev.pop_bytes()
+    account = ev.ledger.account(ev.resolve_account(ev.pop()))
+    account.local.get(ev.app.id, {}).pop(key, None)
+
+
+@_op("app_global_get")
+def _app_global_get(ev, ins, pc):
+    ev.push(ev.app.globals.get(ev.pop_bytes(), 0))
+
+
+@_op("app_global_get_ex")
+def _app_global_get_ex(ev, ins, pc):
+    key = ev.pop_bytes()
+    app = ev.ledger.apps.get(ev.resolve_app(ev.pop_int()))
+    exists = app is not None and key in app.globals
+    ev.push(app.globals[key] if exists else 0)
+    ev.push(exists)
+
+
+@_op("app_global_put")
+def _app_global_put(ev, ins, pc):
+    value = ev.pop()
+    ev.app.globals[ev.pop_bytes()] = value
+    _check_schema(ev, ev.app.globals, ev.app.global_schema, "global")
+
+
+def _check_schema(ev, state, schema, kind):
+    uints = sum(1 for v in state.values() if isinstance(v, int))
+    if uints > schema[0]:
+        ev.fail("%s state of %d uints exceeds the schema's %d" % (kind, uints, schema[0]))
+    if len(state) - uints > schema[1]:
+        ev.fail("%s state of %d byte slices exceeds the schema's %d"
+                % (kind, len(state) - uints, schema[1]))
+
+
+@_op("app_global_del")
+def _app_global_del(ev, ins, pc):
+    ev.app.globals.pop(ev.pop_bytes(), None)
+
+
+@_op("asset_holding_get")
+def _asset_holding_get(ev, ins, pc):
+    asset_id = ev.resolve_asset(ev.pop_int())
+    account = ev.ledger.account(ev.resolve_account(ev.pop()))
+    exists = asset_id in account.assets
+    if ins.args[0] == "AssetBalance":
+        ev.push(account.assets.get(asset_id, 0))
+    else:
+        ev.push(0)
+    ev.push(exists)
+
+
+@_op("asset_params_get")
+def _asset_params_get(ev, ins, pc):
+    asset_id = ev.resolve_asset(ev.pop_int())
+    params = ev.ledger.assets.get(asset_id)
+    field = ins.args[0]
+    if params is None:
+        ev.push(0 if field in ("AssetTotal", "AssetDecimals", "AssetDefaultFrozen") else b"")
+        ev.push(0)
+    else:
+        ev.push(params[field])
+        ev.push(1)
+
+
+@_op("acct_params_get")
+def _acct_params_get(ev, ins, pc):
+    address = ev.resolve_account(ev.pop())
+    account = ev.ledger.accounts.get(address)
+    field = ins.args[0]
+    if account is None:
+        ev.push(ZERO_ADDRESS if field == "AcctAuthAddr" else 0)
+        ev.push(0)
+        return
+    values = {
+        "AcctBalance": account.balance,
+        "AcctMinBalance": account.min_balance(),
+        "AcctAuthAddr": ZERO_ADDRESS,
+        "AcctTotalAssets": len(account.assets),
+    }
+    if field not in values:
+        ev.fail("unsupported account field %s" % field)
+    ev.push(values[field])
+    ev.push(1)
+
+
+def _box_io(ev, name, size):
+    """count a box of size bytes against the group's I/O quota"""
+    io = ev.pool.box_io
+    key = (ev.app.id, name)
+    io[key] = max(io.get(key, 0), size)
+    total = sum(io.values())
+    if total > ev.pool.box_quota:
+        ev.fail("box I/O of %d bytes exceeds the quota of %d references (%d bytes)"
+                % (total, ev.pool.box_quota // BOX_REFERENCE_QUOTA, ev.pool.box_quota))
+
+
+def _box(ev, name, write=False):
+    name = ev.box_name(name)
+    if (ev.app.id, name) not in ev.pool.box_refs:
+        ev.fail("box %s is not referenced by the group" % name.hex())
+    (ev.trace.boxes_written if write else ev.trace.boxes_read).add(name)
+    current = ev.app.boxes.get(name)
+    _box_io(ev, name, len(current) if current is not None else 0)
+    return current
+
+
+def _set_box(ev, name, value):
+    boxes = ev.app.boxes
+    account = ev.ledger.account(ev.app.address)
+    if name in boxes:
+        account.extra_min_balance -= box_min_balance(name, len(boxes[name]))
+    if value is None:
+        boxes.pop(name, None)
+        return
+    if len(value) > MAX_BOX_SIZE:
+        ev.fail("box size %d exceeds %d" % (len(value), MAX_BOX_SIZE))
+    _box_io(ev, name, len(value))
+    boxes[name] = value
+    account.extra_min_balance += box_min_balance(name, len(value))
+
+
+@_op("box_create")
+def _box_create(ev, ins, pc):
+    size = ev.pop_int()
+    name = ev.pop_bytes()
+    current = _box(ev, name, write=True)
+    if current is not None:
+        if len(current) != size:
+            ev.fail("box %s exists with a different size" % name.hex())
+        ev.push(0)
+        return
+    _set_box(ev, name, bytes(size))
+    ev.push(1)
+
+
+@_op("box_put")
+def _box_put(ev, ins, pc):
+    value = ev.pop_bytes()
+    name = ev.pop_bytes()
+    current = _box(ev, name, write=True)
+    if current is not None and len(current) != len(value):
+        ev.fail("box_put size mismatch for %s" % name.hex())
+    _set_box(ev, name, value)
+
+
+@_op("box_get")
+def _box_get(ev, ins, pc):
+    current = _box(ev, ev.pop_bytes())
+    ev.push(current if current is not None else b"")
+    ev.push(current is not None)
+
+
+@_op("box_len")
+def _box_len(ev, ins, pc):
+    current = _box(ev, ev.pop_bytes())
+    ev.push(len(current) if current is not None else 0)
+    ev.push(current is not None)
+
+
+@_op("box_extract")
+def _box_extract(ev, ins, pc):
+    length = ev.pop_int()
+    start = ev.pop_int()
+    current = _box(ev, ev.pop_bytes())
+    if current is None:
+        ev.fail("no such box")
+    ev.push(_slice(ev, current, start, start + length))
+
+
+@_op("box_replace")
+def _box_replace(ev, ins, pc):
+    value = ev.pop_bytes()
+    start = ev.pop_int()
+    name = ev.pop_bytes()
+    current = _box(ev, name, write=True)
+    if current is None:
+        ev.fail("no such box")
+    _set_box(ev, name, _replace(ev, current, start, value))
+
+
+@_op("box_del")
+def _box_del(ev, ins, pc):
+    name = ev.pop_bytes()
+    current = _box(ev, name, write=True)
+    if current is not None:
+        _set_box(ev, name, None)
+    ev.push(current is not None)
+
+
+@_op("log")
+def _log(ev, ins, pc):
+    ev.trace.logs.append(ev.pop_bytes())
+
+
+@_op("itxn_begin")
+def _itxn_begin(ev, ins, pc):
+    if ev.inner is not None:
+        ev.fail("itxn_begin without itxn_submit")
+    ev.inner_group = []
+    ev.begin_inner()
+
+
+@_op("itxn_next")
+def _itxn_next(ev, ins, pc):
+    if ev.inner is None:
+        ev.fail("itxn_next without itxn_begin")
+    ev.inner_group.append(ev.inner)
+    ev.begin_inner()
+
+
+@_op("itxn_field")
+def _itxn_field(ev, ins, pc):
+    if ev.inner is None:
+        ev.fail("itxn_field without itxn_begin")
+    field = ins.args[0]
+    value = ev.pop()
+    t = ev.inner
+    if field == "TypeEnum":
+        t["Type"] = TYPE_NAMES[value]
+        t["TypeEnum"] = value
+    elif field == "Type":
+        t["Type"] = value
+        t["TypeEnum"] = TYPE_ENUMS[value]
+    elif field in ARRAY_FIELDS:
+        t[field] = t[field] + [value]
+    else:
+        t[field] = value
+
+
+@_op("itxn_submit")
+def _itxn_submit(ev, ins, pc):
+    if ev.inner is None:
+        ev.fail("itxn_submit without itxn_begin")
+    ev.submit_inner()
+
+
+@_op("itxn")
+def _itxn(ev, ins, pc):
+    if not ev.last_inner_group:
+        ev.fail("no inner transaction submitted")
+    ev.push(ev.txn_field(ev.last_inner_group[-1], ins.args[0]))
+
+
+@_op("itxna")
+def _itxna(ev, ins, pc):
+    if not ev.last_inner_group:
+        ev.fail("no inner transaction submitted")
+    ev.push(ev.txn_field(ev.last_inner_group[-1], ins.args[0], int(ins.args[1])))
+
+
+@_op("gitxn")
+def _gitxn(ev, ins, pc):
+    i = int(ins.args[0])
+    if i >= len(ev.last_inner_group):
+        ev.fail("inner group index out of range")
+    ev.push(ev.txn_field(ev.last_inner_group[i], ins.args[1]))
+
+
+@_op("gitxna")
+def _gitxna(ev, ins, pc):
+    i = int(ins.args[0])
+    if i >= len(ev.last_inner_group):
+        ev.fail("inner group index out of range")
+    ev.push(ev.txn_field(ev.last_inner_group[i], ins.args[1], int(ins.args[2])))
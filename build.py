@@ -0,0 +1,281 @@
+"""Incremental, cached build of p3-contract.py.
+
+Each build variant (a TEAL version and the budget table the order branches
+are compiled with) is keyed by a hash of the contract's sources, the budget
+table, the PyTeal version and the variant's settings.  A variant whose output
+directory already holds its key is left alone, and one built before is
+copied out of the cache; only new keys are compiled, each variant in its own
+process.  A build writes, per variant:
+
+    approval.teal, clear.teal   the TEAL, constants assembled as cost_report.py costs them
+    approval.tok, clear.tok     assembled bytecode
+    approval.map.json           pc -> TEAL line source map, plus the subroutine behind each block
+    contract.json               routes with their selectors and budgets, state schema, extra
+                                program pages, program hashes
+    manifest.json               the key and sources the variant was built from
+
+    python build.py
+    python build.py --variant v8 --variant v9:version=9 --variant lean:budgets=budgets-lean.json
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import importlib.metadata
+import json
+import os
+import shutil
+import sys
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONTRACT = os.path.join(HERE, "p3-contract.py")
+BUDGETS = os.path.join(HERE, "budgets.json")
+# everything the programs are compiled from; a change to any of them is a rebuild
+SOURCES = ["p3-contract.py", "teal.py", "numeric.py", "cost_report.py", "build.py", "client.py",
+           "fees.py"]
+OUTPUT = os.path.join(HERE, "build")
+CACHE = os.path.join(HERE, ".build-cache")
+ARTIFACTS = ["approval.teal", "clear.teal", "approval.tok", "clear.tok", "approval.map.json",
+             "contract.json"]
+MANIFEST = "manifest.json"
+TEAL_VERSION = 8
+
+_B64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+
+class Variant:
+    """one set of build settings, written to its own output directory"""
+
+    def __init__(self, name="default", version=TEAL_VERSION, budgets=BUDGETS):
+        self.name = name
+        self.version = int(version)
+        self.budgets = os.path.abspath(budgets)
+
+    @classmethod
+    def parse(cls, text):
+        """name or name:version=9,budgets=path"""
+        name, _, settings = text.partition(":")
+        kwargs = dict(s.split("=", 1) for s in settings.split(",") if s)
+        unknown = set(kwargs) - {"version", "budgets"}
+        if unknown:
+            raise ValueError("unknown variant settings %s" % ", ".join(sorted(unknown)))
+        return cls(name, **kwargs)
+
+    def settings(self):
+        return {"version": self.version, "budgets": self.budgets}
+
+
+def _digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def source_digests(sources=SOURCES):
+    return {name: _digest(os.path.join(HERE, name)) for name in sources}
+
+
+def build_key(variant, digests, pyteal):
+    """the cache key of a variant: its sources, budget table, settings and PyTeal"""
+    try:
+        budgets = _digest(variant.budgets)
+    except FileNotFoundError:
+        # Budget falls back to its flat request without a table
+        budgets = None
+    material = {"sources": digests, "budgets": budgets, "pyteal": pyteal,
+                "version": variant.version}
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+
+def _vlq(value):
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    out = ""
+    while True:
+        digit = value & 31
+        value >>= 5
+        out += _B64[digit | (32 if value else 0)]
+        if not value:
+            return out
+
+
+def source_map(program, teal_file="approval.teal"):
+    """a version 3 source map from bytecode offsets to TEAL lines, one segment per pc
+
+    pcs inside an instruction's immediates and the version byte map to nothing.
+    """
+    segments = [""] * (program.instructions[-1].pc + program.instructions[-1].size
+                       if program.instructions else 1)
+    line = 0
+    for ins in program.instructions:
+        segments[ins.pc] = "A" + "A" + _vlq(ins.line - 1 - line) + "A"
+        line = ins.line - 1
+    return {"version": 3, "sources": [teal_file], "names": [], "mappings": ";".join(segments)}
+
+
+def contract_description(namespace, variant, bytecode, clear_bytecode, pyteal):
+    import client
+    import fees
+    import teal
+
+    budgets = fees.load_budgets(variant.budgets) if os.path.exists(variant.budgets) else {}
+    schema = namespace["Schema"]
+    routes = []
+    for name in client.ROUTES:
+        entry = {"name": name, "selector": teal.method_selector(name).hex(),
+                 "on_completion": "NoOp"}
+        budget = {k: v for k, v in budgets.get("routes", {}).items()
+                  if k == name or k.startswith(name + "/")}
+        if budget:
+            entry["budgets"] = budget
+        routes.append(entry)
+    return {
+        "name": "perpetual3",
+        "teal_version": variant.version,
+        "pyteal": pyteal,
+        "routes": routes,
+        # calls without a selector: creation with no args, and opting in for a gate pass
+        "bare": [{"name": "create", "on_completion": "NoOp", "application_id": 0},
+                 {"name": "opt_in", "on_completion": "OptIn"}],
+        "schema": {
+            "global": {"num_byte_slice": schema.global_bytes, "num_uint": schema.global_ints},
+            "local": {"num_byte_slice": schema.local_bytes, "num_uint": schema.local_ints},
+        },
+        # pages beyond the first the app is created with; fails the build past 3
+        "extra_pages": teal.extra_pages(bytecode, clear_bytecode),
+        "programs": {
+            "approval": {"bytes": len(bytecode), "sha256": hashlib.sha256(bytecode).hexdigest()},
+            "clear": {"bytes": len(clear_bytecode),
+                      "sha256": hashlib.sha256(clear_bytecode).hexdigest()},
+        },
+    }
+
+
+def compile_variant(variant, pyteal):
+    """every artifact of a variant, by file name; runs in a worker process"""
+    import cost_report
+    import teal
+
+    namespace = cost_report.load_contract(CONTRACT)
+    approval = namespace["compile_approval"](version=variant.version, assembleConstants=True,
+                                             budgets=variant.budgets)
+    clear = namespace["compile_clear"](version=variant.version)
+    program = teal.parse(approval)
+    bytecode = teal.assemble(program)
+    clear_bytecode = teal.assemble(teal.parse(clear))
+    mapping = source_map(program)
+    mapping["blocks"] = cost_report.source_map(
+        program, cost_report.subroutine_sources(namespace, CONTRACT))
+    description = contract_description(namespace, variant, bytecode, clear_bytecode, pyteal)
+    return {
+        "approval.teal": approval.encode(),
+        "clear.teal": clear.encode(),
+        "approval.tok": bytecode,
+        "clear.tok": clear_bytecode,
+        "approval.map.json": (json.dumps(mapping, indent=2) + "\n").encode(),
+        "contract.json": (json.dumps(description, indent=2) + "\n").encode(),
+    }
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _complete(directory):
+    return all(os.path.exists(os.path.join(directory, name)) for name in ARTIFACTS)
+
+
+def _store(cache, key, artifacts):
+    """write artifacts to the cache entry for key, all at once"""
+    entry = os.path.join(cache, key)
+    tmp = "%s.tmp%d" % (entry, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    for name, data in artifacts.items():
+        with open(os.path.join(tmp, name), "wb") as f:
+            f.write(data)
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        # another build stored the same key first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return entry
+
+
+def _publish(entry, directory, manifest):
+    os.makedirs(directory, exist_ok=True)
+    for name in ARTIFACTS:
+        shutil.copyfile(os.path.join(entry, name), os.path.join(directory, name))
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        f.write(json.dumps(manifest, indent=2) + "\n")
+
+
+def build(variants, output=OUTPUT, cache=CACHE, workers=None, force=False):
+    """bring output/<variant name> up to date for every variant
+
+    returns per variant whether it was unchanged, copied from the cache or
+    built, and how long that took.
+    """
+    started = time.perf_counter()
+    pyteal = importlib.metadata.version("pyteal")
+    digests = source_digests()
+    results = {}
+    pending = {}
+    for variant in variants:
+        key = build_key(variant, digests, pyteal)
+        directory = os.path.join(output, variant.name)
+        manifest = {"key": key, "pyteal": pyteal, "sources": digests,
+                    "settings": variant.settings()}
+        entry = os.path.join(cache, key)
+        if not force and (_read_manifest(directory) or {}).get("key") == key \
+                and _complete(directory):
+            results[variant.name] = {"status": "unchanged", "key": key}
+        elif not force and _complete(entry):
+            _publish(entry, directory, manifest)
+            results[variant.name] = {"status": "cached", "key": key}
+        else:
+            pending[variant.name] = (variant, key, directory, manifest)
+
+    if pending:
+        compiled = {}
+        if len(pending) == 1 or workers == 1:
+            for name, (variant, _, _, _) in pending.items():
+                compiled[name] = compile_variant(variant, pyteal)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers or min(len(pending), os.cpu_count() or 1)) as pool:
+                futures = {name: pool.submit(compile_variant, variant, pyteal)
+                           for name, (variant, _, _, _) in pending.items()}
+                compiled = {name: future.result() for name, future in futures.items()}
+        for name, (variant, key, directory, manifest) in pending.items():
+            _publish(_store(cache, key, compiled[name]), directory, manifest)
+            results[name] = {"status": "built", "key": key}
+
+    return {"seconds": round(time.perf_counter() - started, 4), "variants": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--variant", action="append", type=Variant.parse,
+                        help="name[:version=N,budgets=path], repeatable (default: one "
+                             "variant named default)")
+    parser.add_argument("--output", default=OUTPUT)
+    parser.add_argument("--cache", default=CACHE)
+    parser.add_argument("--workers", type=int, help="build processes (default: one per variant)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if nothing changed")
+    args = parser.parse_args(argv)
+
+    variants = args.variant or [Variant()]
+    names = [v.name for v in variants]
+    if len(set(names)) != len(names):
+        parser.error("variant names must be unique")
+    print(json.dumps(build(variants, args.output, args.cache, args.workers, args.force),
+                     indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Offline builder for Merkle-committed merchant catalogs and oracle price tables.
+
+A merchant commits the root of a SHA-256 Merkle tree over its product
+messages (product_id||price||collection_type||collection_name, the same bytes
+customer_new_orderV2 verifies) with the catalog_commit route.  Orders then
+pass Itob(leaf index)||sibling hashes in place of the product signature.
+
+Leaves are sha256(0x00||message), inner nodes sha256(0x01||left||right) and
+odd levels are padded with 32 zero bytes, matching merkle_root() in
+p3-contract.py.
+
+The oracle uses the same tree over price||asset||amount||round tuples: it signs
+"oracle"||root||round once with oracle_attest, and orders in the following
+four rounds pass a path into that table in place of the oracle signature.
+
+An order_cart call carries one line item per application arg (cart_item) and
+a single oracle price over all of its item prices (cart_price_message).
+
+    python catalog.py build products.csv --proofs proofs.bin --version 2
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import mmap
+import struct
+import sys
+
+
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+EMPTY = bytes(32)
+
+PROOF_MAGIC = b"P3CATLG1"
+# magic(8) | count(8) | depth(1) | root(32), then one fixed-size proof per product
+PROOF_HEADER = struct.Struct(">8sQB32s")
+
+
+def itob(n):
+    return n.to_bytes(8, "big")
+
+
+def product_message(product_id, price, collection_type=b"false", collection_name=b""):
+    """the bytes a merchant signs or commits to for one product"""
+    return product_id + price + collection_type + collection_name
+
+
+def payment_type_message(asset, merchant_address):
+    """the bytes a merchant signs to accept payment in an asset; asset 0 is the L1 token"""
+    return (itob(asset) if asset else b"L1") + merchant_address
+
+
+def length_prefixed(field):
+    return len(field).to_bytes(2, "big") + field
+
+
+def cart_item(product_id, price, collection_type, collection_name, proof, gate_asset_index=0):
+    """one order_cart line item arg; proof is the product signature or catalog proof"""
+    return (bytes([gate_asset_index]) + length_prefixed(product_id) + length_prefixed(price)
+            + length_prefixed(collection_type) + length_prefixed(collection_name) + proof)
+
+
+def parse_cart_item(item):
+    """(gate asset index, product_id, price, collection_type, collection_name, proof)
+    of an order_cart line item arg"""
+    fields = [item[0]]
+    offset = 1
+    for _ in range(4):
+        length = int.from_bytes(item[offset:offset + 2], "big")
+        fields.append(item[offset + 2:offset + 2 + length])
+        offset += 2 + length
+    return tuple(fields) + (item[offset:],)
+
+
+def cart_price_message(prices, asset, amount, oracle_round):
+    """the oracle tuple for a cart: every item price, the payment asset and the total"""
+    return (b"cart" + b"".join(length_prefixed(p) for p in prices)
+            + (itob(asset) if asset else b"L1") + itob(amount) + itob(oracle_round))
+
+
+def commit_message(root, version):
+    """the bytes the merchant key signs for catalog_commit"""
+    return b"catalog" + root + itob(version)
+
+
+def price_message(price, asset, amount, oracle_round):
+    """the tuple the oracle signs or attests to; asset 0 is the L1 token"""
+    return price + (itob(asset) if asset else b"L1") + itob(amount) + itob(oracle_round)
+
+
+def attest_message(root, oracle_round):
+    """the bytes the oracle key signs for oracle_attest"""
+    return b"oracle" + root + itob(oracle_round)
+
+
+def leaf_hash(message):
+    return hashlib.sha256(LEAF_PREFIX + message).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+class Catalog:
+    """a Merkle tree over product messages, kept level by level for proofs"""
+
+    def __init__(self, messages):
+        sha256 = hashlib.sha256
+        level = [sha256(LEAF_PREFIX + m).digest() for m in messages]
+        if not level:
+            raise ValueError("a catalog needs at least one product")
+        self.levels = [level]
+        while len(level) > 1:
+            if len(level) % 2:
+                level.append(EMPTY)
+            level = [sha256(NODE_PREFIX + level[i] + level[i + 1]).digest()
+                     for i in range(0, len(level), 2)]
+            self.levels.append(level)
+        self.count = len(messages)
+
+    @property
+    def root(self):
+        return self.levels[-1][0]
+
+    @property
+    def depth(self):
+        return len(self.levels) - 1
+
+    @property
+    def proof_size(self):
+        return 8 + 32 * self.depth
+
+    def proof(self, index):
+        """Itob(index)||siblings from the leaf up, as the contract expects"""
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        siblings = []
+        position = index
+        for level in self.levels[:-1]:
+            sibling = position ^ 1
+            siblings.append(level[sibling] if sibling < len(level) else EMPTY)
+            position >>= 1
+        return itob(index) + b"".join(siblings)
+
+    def proofs(self):
+        for index in range(self.count):
+            yield self.proof(index)
+
+
+def verify(root, message, proof):
+    """check a proof the same way merkle_root() does on chain"""
+    if len(proof) < 8 or (len(proof) - 8) % 32:
+        return False
+    index = int.from_bytes(proof[:8], "big")
+    node = leaf_hash(message)
+    for offset in range(8, len(proof), 32):
+        sibling = proof[offset:offset + 32]
+        node = node_hash(sibling, node) if index & 1 else node_hash(node, sibling)
+        index >>= 1
+    return index == 0 and node == root
+
+
+def read_products(path):
+    """product messages from a CSV with product_id,price,collection_type,collection_name"""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            yield product_message(
+                row["product_id"].encode(), row["price"].encode(),
+                (row.get("collection_type") or "false").encode(),
+                (row.get("collection_name") or "").encode())
+
+
+def write_proofs(catalog, path):
+    with open(path, "wb") as f:
+        f.write(PROOF_HEADER.pack(PROOF_MAGIC, catalog.count, catalog.depth, catalog.root))
+        for proof in catalog.proofs():
+            f.write(proof)
+
+
+class ProofFile:
+    """memory-mapped reader for files written by write_proofs"""
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.depth, self.root = PROOF_HEADER.unpack_from(self._map)
+        if magic != PROOF_MAGIC:
+            raise ValueError("%s is not a catalog proof file" % path)
+        self.proof_size = 8 + 32 * self.depth
+
+    def proof(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        start = PROOF_HEADER.size + index * self.proof_size
+        return bytes(self._map[start:start + self.proof_size])
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="compute the root and proofs of a catalog CSV")
+    build.add_argument("products")
+    build.add_argument("--proofs", help="write fixed-size proofs to this file")
+    build.add_argument("--version", type=int, default=1,
+                       help="catalog version to commit (must increase per commit)")
+    build.add_argument("--signing-key",
+                       help="hex ed25519 seed of the merchant key to sign the commit with")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(list(read_products(args.products)))
+    if args.proofs:
+        write_proofs(catalog, args.proofs)
+    message = commit_message(catalog.root, args.version)
+    out = {
+        "root": catalog.root.hex(),
+        "products": catalog.count,
+        "depth": catalog.depth,
+        "proof_bytes": catalog.proof_size,
+        "version": args.version,
+        "commit_message": message.hex(),
+    }
+    if args.signing_key:
+        from nacl.signing import SigningKey
+        key = SigningKey(bytes.fromhex(args.signing_key))
+        out["merchant_pubkey"] = bytes(key.verify_key).hex()
+        out["commit_signature"] = key.sign(message).signature.hex()
+    print(json.dumps(out, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,339 @@
+"""Client helpers for the boxes p3-contract.py keeps state in.
+
+Box names, as the contract derives them:
+
+    collection record   Sha256(collection_name||merchant_pubkey||merchant_address||collection_type)
+    pre-mint pool       "pool"||collection record name
+    merchant rating     "rating"||Sha256(merchant_ID||store_address)
+    merchant catalog    merchant_pubkey
+    oracle price root   "oracle"||Itob(round % 8)
+
+box_names() lists the boxes an application call reads or writes, from its
+route and args, and fill_box_references() puts them in the call's box
+reference array, adding empty references until the call's I/O quota (1024
+bytes per reference) covers the sizes of the boxes it touches.
+
+BoxCache reads box contents through an algod client with an LRU cache whose
+entries expire after a TTL; prefetch() fetches every missing name of a batch
+concurrently.  Algod talks to a node's REST API and MemoryAlgod serves the
+boxes of an avm.Ledger the same way, for tests and dry runs:
+
+    cache = BoxCache(MemoryAlgod(ledger), app_id)
+    await cache.prefetch(collection_boxes(name, pubkey, merchant, b"phygital"))
+    fill_box_references(call, cache.sizes())
+"""
+
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import catalog
+import teal
+
+
+ROUTES = ["order_new", "order_cart", "order_review", "collection_init",
+          "phygital_product_widthdraw", "admin_init", "admin_optin_assets", "admin_sweep_fees",
+          "catalog_commit", "oracle_attest", "phygital_preminted_optin",
+          "phygital_preminted_withdraw_owner"]
+# route of each 4 byte selector in ApplicationArgs[0]
+SELECTORS = {teal.method_selector(name): name for name in ROUTES}
+
+PRODUCT_SIGNATURE = 64
+ORACLE_SIGNATURE = 64
+ORACLE_SLOTS = 8
+# box references one application call carries, each adding 1024 bytes of box I/O
+MAX_BOX_REFERENCES = 8
+BOX_REFERENCE_QUOTA = 1024
+# minimum balance of a box: flat, plus per byte of its name and value
+BOX_FLAT_MIN_BALANCE = 2500
+BOX_BYTE_MIN_BALANCE = 400
+# bytes of a collection record before its image URL
+COLLECTION_RECORD_HEADER = 65
+MIN_TXN_FEE = 1000
+
+
+def _sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+def collection_box(collection_name, merchant_pubkey, merchant_address, collection_type):
+    return _sha256(collection_name + merchant_pubkey + merchant_address + collection_type)
+
+
+def pool_box(collection_name, merchant_pubkey, merchant_address, collection_type):
+    return b"pool" + collection_box(collection_name, merchant_pubkey, merchant_address,
+                                    collection_type)
+
+
+def rating_box(merchant_id, store_address):
+    return b"rating" + _sha256(merchant_id + store_address)
+
+
+def catalog_box(merchant_pubkey):
+    return b"catalog" + merchant_pubkey
+
+
+def oracle_box(oracle_round):
+    return b"oracle" + (oracle_round % ORACLE_SLOTS).to_bytes(8, "big")
+
+
+def box_min_balance(name, size):
+    """what a box of size bytes named name adds to the app account's minimum balance"""
+    return BOX_FLAT_MIN_BALANCE + BOX_BYTE_MIN_BALANCE * (len(name) + size)
+
+
+def collection_init_payment(collection_name, merchant_pubkey, merchant_address,
+                            collection_type, image_url, exists=False):
+    """the payment collection_init keeps: its record box's minimum balance
+
+    nothing if the record exists already.  collection_init refunds anything
+    paid above this in an inner payment, which the call's fee has to cover
+    with one more MIN_TXN_FEE; paying exactly needs no refund.
+    """
+    if exists:
+        return 0
+    return box_min_balance(
+        collection_box(collection_name, merchant_pubkey, merchant_address, collection_type),
+        COLLECTION_RECORD_HEADER + len(image_url))
+
+
+def collection_boxes(collection_name, merchant_pubkey, merchant_address, collection_type):
+    """every box of a collection: its record and, for phygital collections, its pool"""
+    names = [collection_box(collection_name, merchant_pubkey, merchant_address,
+                            collection_type)]
+    if b"phygital" in collection_type:
+        names.append(pool_box(collection_name, merchant_pubkey, merchant_address,
+                              collection_type))
+    return names
+
+
+def merchant_boxes(merchant_pubkey, merchant_id=None, store_address=None):
+    """a merchant's catalog box and, given its store, its rating box"""
+    names = [catalog_box(merchant_pubkey)]
+    if store_address is not None:
+        names.append(rating_box(merchant_id or merchant_pubkey, store_address))
+    return names
+
+
+def _product_boxes(merchant_pubkey, merchant_address, collection_type, collection_name, proof):
+    names = []
+    if collection_type != b"false":
+        names += collection_boxes(collection_name, merchant_pubkey, merchant_address,
+                                  collection_type)
+    if len(proof) != PRODUCT_SIGNATURE:
+        names.append(catalog_box(merchant_pubkey))
+    return names
+
+
+def box_names(route, args, sender=None):
+    """the boxes a call to route with application args reads or writes, in order"""
+    names = []
+    if route == "order_new":
+        names += _product_boxes(args[1], args[9], args[10], args[11], args[4])
+        if len(args[7]) != ORACLE_SIGNATURE:
+            names.append(oracle_box(int.from_bytes(args[6], "big")))
+    elif route == "order_cart":
+        for item in args[7:]:
+            _, _, _, collection_type, collection_name, proof = catalog.parse_cart_item(item)
+            names += _product_boxes(args[1], args[2], collection_type, collection_name, proof)
+        if len(args[4]) != ORACLE_SIGNATURE:
+            names.append(oracle_box(int.from_bytes(args[3], "big")))
+    elif route == "collection_init":
+        names.append(collection_box(args[1], args[2], sender, args[9]))
+    elif route == "phygital_preminted_optin":
+        names += [collection_box(args[1], args[2], sender, args[3]),
+                  pool_box(args[1], args[2], sender, args[3])]
+    elif route == "phygital_preminted_withdraw_owner":
+        names.append(pool_box(args[1], args[2], args[3], args[4]))
+    elif route == "order_review":
+        names.append(rating_box(args[1], args[2]))
+    elif route == "catalog_commit":
+        names.append(catalog_box(args[1]))
+    elif route == "oracle_attest":
+        names.append(oracle_box(int.from_bytes(args[1], "big")))
+    return list(dict.fromkeys(names))
+
+
+def fill_box_references(call, sizes=None):
+    """set the Boxes of an application call dict (avm.app_call) from its route
+
+    sizes maps box names to their lengths, e.g. BoxCache.sizes(); boxes
+    larger than the quota of their own reference get empty references added.
+    """
+    args = call["ApplicationArgs"]
+    names = box_names(SELECTORS.get(args[0]) if args else None, args, call["Sender"])
+    refs = [(0, name) for name in names]
+    total = sum((sizes or {}).get(name, 0) for name in names)
+    while len(refs) * BOX_REFERENCE_QUOTA < total:
+        refs.append((0, b""))
+    if len(refs) > MAX_BOX_REFERENCES:
+        raise ValueError("call needs %d box references, at most %d fit"
+                         % (len(refs), MAX_BOX_REFERENCES))
+    call["Boxes"] = refs
+    return call
+
+
+def collection_record(value):
+    """the fields of a collection record box"""
+    return {
+        "minted": int.from_bytes(value[0:8], "big"),
+        "max_supply": int.from_bytes(value[8:16], "big"),
+        "first_valid": int.from_bytes(value[16:24], "big"),
+        "last_valid": int.from_bytes(value[24:32], "big"),
+        "gate_type": value[32],
+        "gate_id": value[33:65],
+        "image_url": value[65:],
+    }
+
+
+def pool_record(value):
+    """assigned and stocked counts and (asset ID, Sha256(owner)) slots of a pool box
+
+    the counts only grow: NFT n sits in slot n % len(slots), and a free slot
+    has asset ID 0.
+    """
+    return {
+        "assigned": int.from_bytes(value[0:8], "big"),
+        "stocked": int.from_bytes(value[8:16], "big"),
+        "slots": [(int.from_bytes(value[n:n + 8], "big"), value[n + 8:n + 40])
+                  for n in range(16, len(value), 40)],
+    }
+
+
+def rating_record(value):
+    """review count, star sum and reviews per star count of a rating box"""
+    words = [int.from_bytes(value[i:i + 8], "big") for i in range(0, len(value), 8)]
+    return {"count": words[0], "star_sum": words[1], "histogram": words[2:]}
+
+
+class BoxNotFound(KeyError):
+    pass
+
+
+class Algod:
+    """the box endpoint of an algod node's REST API"""
+
+    def __init__(self, url="http://localhost:4001", token="a" * 64, timeout=10):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _get(self, app_id, name):
+        query = urllib.parse.urlencode({"name": "b64:" + base64.b64encode(name).decode()})
+        request = urllib.request.Request(
+            "%s/v2/applications/%d/box?%s" % (self.url, app_id, query),
+            headers={"X-Algo-API-Token": self.token})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise BoxNotFound(name) from None
+            raise
+
+    async def application_box_by_name(self, app_id, name):
+        return await asyncio.to_thread(self._get, app_id, name)
+
+
+class MemoryAlgod:
+    """the box endpoint over an avm.Ledger, counting requests like a node would see them"""
+
+    def __init__(self, ledger, latency=0.0):
+        self.ledger = ledger
+        self.latency = latency
+        self.requests = 0
+
+    async def application_box_by_name(self, app_id, name):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        value = self.ledger.box(app_id, name)
+        if value is None:
+            raise BoxNotFound(name)
+        return {"name": base64.b64encode(name).decode(), "round": self.ledger.round,
+                "value": base64.b64encode(value).decode()}
+
+
+class BoxCache:
+    """an app's box contents, read through algod and kept for ttl seconds
+
+    missing boxes are cached as None, so a batch naming a box that doesn't
+    exist yet doesn't fetch it again until it expires.
+    """
+
+    def __init__(self, algod, app_id, capacity=4096, ttl=30.0, concurrency=16,
+                 clock=time.monotonic):
+        self.algod = algod
+        self.app_id = app_id
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        self.concurrency = concurrency
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if self.clock() >= expires:
+            del self.entries[name]
+            return False, None
+        self.entries.move_to_end(name)
+        return True, value
+
+    def _store(self, name, value):
+        self.entries[name] = (self.clock() + self.ttl, value)
+        self.entries.move_to_end(name)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    async def _fetch(self, name, semaphore):
+        async with semaphore:
+            try:
+                box = await self.algod.application_box_by_name(self.app_id, name)
+            except BoxNotFound:
+                return name, None
+        return name, base64.b64decode(box["value"])
+
+    async def prefetch(self, names):
+        """fetch every name not cached, concurrently, and return all of their values"""
+        values = {}
+        missing = []
+        for name in dict.fromkeys(names):
+            found, value = self._cached(name)
+            if found:
+                self.hits += 1
+                values[name] = value
+            else:
+                self.misses += 1
+                missing.append(name)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        for name, value in await asyncio.gather(*(self._fetch(n, semaphore) for n in missing)):
+            self._store(name, value)
+            values[name] = value
+        return values
+
+    async def get(self, name):
+        """the value of a box, None if it doesn't exist"""
+        return (await self.prefetch([name]))[name]
+
+    def invalidate(self, names=None):
+        """drop names, or everything, e.g. after a call that writes them"""
+        if names is None:
+            self.entries.clear()
+        for name in names or ():
+            self.entries.pop(name, None)
+
+    def sizes(self):
+        """lengths of the cached boxes that exist, for fill_box_references"""
+        return {name: len(value) for name, (_, value) in self.entries.items()
+                if value is not None}
@@ -0,0 +1,846 @@
+"""Static per-route cost report for approval_program() in p3-contract.py.
+
+The approval program is compiled with PyTeal, parsed back with teal.py and
+walked as a control flow graph.  Each route fixes the transaction fields its
+dispatch depends on (the selector in ApplicationArgs[0], the payment type of
+the merchant payment, the collection type, ...) and every branch whose
+condition is decided by those fields is pruned.  Whatever remains is costed
+worst case: the longest path through each subroutine, with a loop costed as
+its longest single iteration times ``loop_bound`` (or the route's bound for
+the subroutine it sits in) and recursion unrolled ``recursion_bound`` times.
+
+    python cost_report.py --output cost_report.json
+"""
+
+import argparse
+import inspect
+import json
+import math
+import os
+import re
+import runpy
+import sys
+from collections import Counter
+
+import fees
+import numeric
+import teal
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONTRACT = os.path.join(HERE, "p3-contract.py")
+
+TEAL_VERSION = 8
+APP_CALL_BUDGET = 700
+
+# how deep a recursive subroutine is unrolled, unless RECURSION_BOUNDS bounds
+# it by its TEAL label prefix.  numeric.decimal only calls the recursive itoa
+# below 10**ITOA_DIGITS, so it recurses for at most ITOA_DIGITS - 1 more digits
+RECURSION_BOUND = 20
+RECURSION_BOUNDS = {"itoa": numeric.ITOA_DIGITS - 1}
+# While loops iterate over Txn.assets, which holds at most 8 references
+LOOP_BOUND = 8
+MAX_GROUP_SIZE = 16
+
+PAYMENT_TYPES = {"pay": 1, "axfer": 4}
+COLLECTION_TYPES = ["phygital", "tokengate", "tokengatephygital", "false"]
+# a 2**17 leaf catalog covers 100k+ SKUs; its proofs are Itob(index)||17 hashes
+CATALOG_DEPTH = 17
+PRODUCT_PROOFS = {
+    "": 64,
+    "/catalog": 8 + 32 * CATALOG_DEPTH,
+}
+# an attested oracle price table of 1024 tuples
+PRICE_TABLE_DEPTH = 10
+ORACLE_PROOFS = {
+    "": 64,
+    "/attested": 8 + 32 * PRICE_TABLE_DEPTH,
+}
+
+# line items an order_cart route is costed for, up to the cart_max_items() of
+# the current budgets
+CART_ITEMS = [1, 2]
+# a call carries at most 16 application args of 2048 bytes in total and, in a
+# compact group, submits at most 16 inner transactions
+MAX_APP_ARGS = 16
+MAX_APP_ARGS_SIZE = 2048
+MAX_INNER_TXNS = 16
+# order_cart args before its first item, with a signed oracle price: selector,
+# merchant pubkey, merchant address, round, signature, payment type signature, layout
+CART_FIRST_ITEM = 7
+CART_BASE_ARGS_SIZE = 4 + 32 + 32 + 8 + 64 + 64 + 2
+# the smallest line item: gate asset index, four length prefixes, a one byte
+# product id and price, "false" without a collection name, and a signature
+CART_MIN_ITEM_SIZE = 1 + 8 + 1 + 1 + len("false") + 64
+# NFTs a phygital_preminted_optin route is costed for, up to PoolLayout.batch
+PREMINT_BATCHES = [1, 8]
+
+_CALL = {"txn ApplicationID": 1, "txn OnCompletion": 0}
+
+# tokengate orders reference their gate asset, or none to use the buyer's gate pass
+GATE_CHECKS = {"": 1, "/pass": 0}
+
+
+def _order_routes():
+    routes = {}
+    for payment, type_enum in PAYMENT_TYPES.items():
+        for collection_type in COLLECTION_TYPES:
+            gates = GATE_CHECKS if "tokengate" in collection_type else {"": None}
+            for gate_suffix, assets in gates.items():
+                for suffix, proof_length in PRODUCT_PROOFS.items():
+                    for oracle_suffix, oracle_length in ORACLE_PROOFS.items():
+                        name = "order_new/%s/%s%s%s%s" % (payment, collection_type, gate_suffix,
+                                                          suffix, oracle_suffix)
+                        routes[name] = dict(_CALL, **{
+                            "txna ApplicationArgs 0": teal.method_selector("order_new"),
+                            "gtxns TypeEnum": type_enum,
+                            "txna ApplicationArgs 10": collection_type.encode(),
+                            "len txna ApplicationArgs 4": proof_length,
+                            "len txna ApplicationArgs 7": oracle_length,
+                        })
+                        if assets is not None:
+                            routes[name]["txn NumAssets"] = assets
+    return routes
+
+
+def _cart_routes():
+    routes = {}
+    for payment, type_enum in PAYMENT_TYPES.items():
+        for items in CART_ITEMS:
+            for oracle_suffix, oracle_length in ORACLE_PROOFS.items():
+                name = "order_cart/%s/%d%s" % (payment, items, oracle_suffix)
+                routes[name] = dict(_CALL, **{
+                    "txna ApplicationArgs 0": teal.method_selector("order_cart"),
+                    "gtxns TypeEnum": type_enum,
+                    "len txna ApplicationArgs 4": oracle_length,
+                })
+    return routes
+
+
+ROUTES = dict(
+    {"create": {"txn ApplicationID": 0}},
+    **_order_routes(),
+    **_cart_routes(),
+    **{"phygital_preminted_optin/%d" % n: dict(_CALL, **{
+        "txna ApplicationArgs 0": teal.method_selector("phygital_preminted_optin")})
+       for n in PREMINT_BATCHES},
+    **{name: dict(_CALL, **{"txna ApplicationArgs 0": teal.method_selector(name)})
+       for name in ["order_review", "collection_init", "phygital_product_widthdraw",
+                    "admin_init", "admin_optin_assets", "admin_sweep_fees", "catalog_commit",
+                    "oracle_attest", "phygital_preminted_withdraw_owner"]}
+)
+
+# single-path routes besides the order branches that request their own budget
+BUDGETED_ROUTES = ("catalog_commit", "oracle_attest")
+
+# the OpUp loop of request_budget; each inner call it makes brings its own 700
+OPUP_SUBROUTINE = "requestbudget"
+OPUP_BUFFER = 10
+
+# per route loop bounds of the subroutines (by TEAL label prefix) whose loops
+# are not bounded by the foreign asset array.  "caller/callee" bounds a
+# subroutine's loops only where that caller calls it: merkle_root folds
+# catalog proofs for verify_product and price table proofs for
+# verify_oracle_price.
+CATALOG_PROOF = "verifyproduct/merkleroot"
+PRICE_TABLE_PROOF = "verifyoracleprice/merkleroot"
+LOOP_BOUNDS = {}
+for _name in ROUTES:
+    LOOP_BOUNDS[_name] = {OPUP_SUBROUTINE: 0}
+    if _name.startswith(("order_new/", "order_cart/")):
+        # an order checks the transactions between its call and its last
+        # payment, at most all but those two
+        LOOP_BOUNDS[_name]["ownpayments"] = MAX_GROUP_SIZE - 2
+    if _name.startswith("order_cart/"):
+        # cart items may carry catalog proofs of any depth
+        LOOP_BOUNDS[_name].update({CATALOG_PROOF: CATALOG_DEPTH,
+                                   "customerordercart": int(_name.split("/")[2])})
+    elif _name.startswith("phygital_preminted_optin/"):
+        LOOP_BOUNDS[_name]["phygitalpremintedoptin"] = int(_name.split("/")[1])
+    elif "/catalog" in _name:
+        LOOP_BOUNDS[_name][CATALOG_PROOF] = CATALOG_DEPTH
+    if _name.endswith("/attested"):
+        LOOP_BOUNDS[_name][PRICE_TABLE_PROOF] = PRICE_TABLE_DEPTH
+# collection_init and order_review check every transaction of their group
+LOOP_BOUNDS["collection_init"]["collectioninit"] = MAX_GROUP_SIZE
+LOOP_BOUNDS["order_review"]["customerrevieworder"] = MAX_GROUP_SIZE
+
+
+def load_contract(path=CONTRACT):
+    """execute p3-contract.py without its __main__ block and return its namespace"""
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    return runpy.run_path(path)
+
+
+def compile_approval(namespace, version=TEAL_VERSION):
+    return namespace["compile_approval"](version=version, assembleConstants=True)
+
+
+def subroutine_sources(namespace, path=CONTRACT):
+    """map TEAL subroutine label prefixes to the PyTeal function behind them"""
+    from pyteal import SubroutineFnWrapper
+    sources = {}
+    for value in namespace.values():
+        if not isinstance(value, SubroutineFnWrapper):
+            continue
+        impl = value.subroutine.implementation
+        try:
+            filename = inspect.getsourcefile(impl)
+            line = inspect.getsourcelines(impl)[1]
+        except (OSError, TypeError):
+            filename, line = path, 0
+        key = re.sub(r"[^A-Za-z0-9]", "", value.name())
+        sources[key] = {
+            "subroutine": value.name(),
+            "source": "%s:%d" % (os.path.relpath(filename, HERE), line),
+        }
+    approval = namespace.get("approval_program")
+    if approval is not None:
+        sources["main"] = {
+            "subroutine": "approval_program",
+            "source": "%s:%d" % (os.path.relpath(path, HERE),
+                                 inspect.getsourcelines(approval)[1]),
+        }
+    return sources
+
+
+def owner(label):
+    """subroutine label that a (possibly internal) TEAL label belongs to"""
+    if label.startswith("main"):
+        return "main"
+    return re.sub(r"_l\d+$", "", label)
+
+
+class _Unknown:
+    def __repr__(self):
+        return "?"
+
+
+class _Symbol(_Unknown):
+    """an unknown transaction field, remembered so len() can be assumed"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return isinstance(other, _Symbol) and other.key == self.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return "<%s>" % self.key
+
+
+UNKNOWN = _Unknown()
+
+
+def known(value):
+    return not isinstance(value, _Unknown)
+
+
+class RouteAnalysis:
+    """worst-case cost of a compiled program under one set of route assumptions"""
+
+    def __init__(self, program, assumptions, loop_bound=LOOP_BOUND,
+                 recursion_bound=RECURSION_BOUND, loop_bounds=None, recursion_bounds=None):
+        self.program = program
+        self.assumptions = assumptions
+        self.loop_bound = loop_bound
+        self.loop_bounds = loop_bounds or {}
+        self.recursion_bound = recursion_bound
+        self.recursion_bounds = RECURSION_BOUNDS if recursion_bounds is None else recursion_bounds
+        self.blocks = teal.basic_blocks(program)
+        self.block_at = {b.start: b for b in self.blocks}
+        self.slots = self._constant_slots()
+        self._edges = {}
+        self._memo = {}
+        self._active = []
+        self.reached = set()
+
+    # -- local constant evaluation -------------------------------------
+
+    def _fact(self, ins):
+        op, args = ins.op, ins.args
+        if op == "txn":
+            key = "txn %s" % args[0]
+        elif op == "txna":
+            key = "txna %s %s" % (args[0], args[1])
+        elif op == "gtxn":
+            key = "gtxn %s %s" % (args[0], args[1])
+        elif op == "gtxns":
+            key = "gtxns %s" % args[0]
+        elif op == "global":
+            key = "global %s" % args[0]
+        else:
+            return UNKNOWN
+        return self.assumptions.get(key, _Symbol(key))
+
+    def _evaluate(self, block, slots, frame=()):
+        """run a block over constants; return the final stack, scratch stores
+        and the stack at each callsub
+
+        frame holds the facts known about the arguments of the subroutine the
+        block belongs to; PyTeal never writes to them, so they stay valid for
+        the whole call.
+        """
+        program = self.program
+        stack = []
+        stores = []
+        calls = []
+
+        def pop():
+            return stack.pop() if stack else UNKNOWN
+
+        for ins in program.instructions[block.start:block.end]:
+            op, args = ins.op, ins.args
+            if op.startswith("intc_"):
+                stack.append(program.intc[int(op[5:])])
+            elif op == "intc":
+                stack.append(program.intc[int(args[0])])
+            elif op.startswith("bytec_"):
+                stack.append(program.bytec[int(op[6:])])
+            elif op == "bytec":
+                stack.append(program.bytec[int(args[0])])
+            elif op in ("pushint", "int"):
+                stack.append(teal.parse_int(args[0]))
+            elif op in ("pushbytes", "byte"):
+                stack.append(teal.parse_bytes(*args))
+            elif op in ("txn", "txna", "gtxn", "global"):
+                stack.append(self._fact(ins))
+            elif op == "gtxns":
+                pop()
+                stack.append(self._fact(ins))
+            elif op == "load":
+                stack.append(slots.get(int(args[0]), UNKNOWN))
+            elif op == "frame_dig":
+                i = int(args[0])
+                stack.append(frame[i] if -len(frame) <= i < 0 else UNKNOWN)
+            elif op == "proto":
+                continue
+            elif op == "store":
+                stores.append((int(args[0]), pop()))
+            elif op in ("==", "!=", "<", ">", "<=", ">=", "&&", "||"):
+                b, a = pop(), pop()
+                if not known(a) or not known(b):
+                    stack.append(UNKNOWN)
+                else:
+                    stack.append(int({
+                        "==": a == b, "!=": a != b, "<": a < b, ">": a > b,
+                        "<=": a <= b, ">=": a >= b,
+                        "&&": bool(a) and bool(b), "||": bool(a) or bool(b),
+                    }[op]))
+            elif op == "!":
+                a = pop()
+                stack.append(int(not a) if known(a) else UNKNOWN)
+            elif op == "btoi":
+                a = pop()
+                stack.append(int.from_bytes(a, "big") if known(a) and len(a) <= 8 else UNKNOWN)
+            elif op in ("+", "-", "*", "/", "%"):
+                b, a = pop(), pop()
+                if not known(a) or not known(b) or op in ("/", "%") and b == 0:
+                    stack.append(UNKNOWN)
+                else:
+                    value = {"+": lambda: a + b, "-": lambda: a - b, "*": lambda: a * b,
+                             "/": lambda: a // b, "%": lambda: a % b}[op]()
+                    stack.append(value if 0 <= value < 2 ** 64 else UNKNOWN)
+            elif op == "len":
+                a = pop()
+                if isinstance(a, _Symbol):
+                    stack.append(self.assumptions.get("len " + a.key, UNKNOWN))
+                else:
+                    stack.append(len(a) if known(a) else UNKNOWN)
+            elif op == "dup":
+                a = pop()
+                stack.extend([a, a])
+            elif op == "pop":
+                pop()
+            elif op == "swap":
+                b, a = pop(), pop()
+                stack.extend([b, a])
+            elif op in ("bnz", "bz", "switch", "match", "b", "return",
+                        "retsub", "callsub", "assert"):
+                if op == "callsub":
+                    calls.append(stack)
+                    stack = []
+                elif op == "assert":
+                    stack = stack[:-1]
+                continue
+            else:
+                stack = []
+        return stack, stores, calls
+
+    def _frame(self, callee, stack):
+        """argument facts of a callsub, from the caller's stack"""
+        proto = self.program.instructions[self.program.target(callee)]
+        if proto.op != "proto":
+            return ()
+        count = int(proto.args[0])
+        values = stack[len(stack) - count:] if count else []
+        return (UNKNOWN,) * (count - len(values)) + tuple(values)
+
+    def _constant_slots(self):
+        """scratch slots whose every store writes the same known value"""
+        slots = {}
+        for _ in range(4):
+            seen = {}
+            for block in self.blocks:
+                for slot, value in self._evaluate(block, slots)[1]:
+                    seen.setdefault(slot, []).append(value)
+            updated = {
+                slot: values[0] for slot, values in seen.items()
+                if known(values[0]) and all(known(v) and v == values[0] for v in values)
+            }
+            if updated == slots:
+                break
+            slots = updated
+        return slots
+
+    def edges(self, block, frame=()):
+        """successor blocks of a block once decided branches are pruned"""
+        key = (block.index, frame)
+        if key in self._edges:
+            return self._edges[key]
+        last = self.program.instructions[block.end - 1]
+        succ = block.successors
+        if last.op in ("bnz", "bz", "switch", "match"):
+            stack = self._evaluate(block, self.slots, frame)[0]
+            target = None
+            if last.op in ("bnz", "bz") and stack and known(stack[-1]):
+                taken = bool(stack[-1]) == (last.op == "bnz")
+                target = self.program.target(last.args[0]) if taken else block.end
+            elif last.op == "switch" and stack and known(stack[-1]):
+                i = stack[-1]
+                target = (self.program.target(last.args[i])
+                          if i < len(last.args) else block.end)
+            elif last.op == "match" and len(stack) > len(last.args):
+                value = stack[-1]
+                candidates = stack[-1 - len(last.args):-1]
+                if known(value) and all(known(c) for c in candidates):
+                    target = block.end
+                    for label, candidate in zip(last.args, candidates):
+                        if candidate == value:
+                            target = self.program.target(label)
+                            break
+            if target is not None:
+                succ = [self.block_at[target].index] if target in self.block_at else []
+        self._edges[key] = succ
+        return succ
+
+    # -- worst-case path search -----------------------------------------
+
+    def cost_until(self, callee_prefix, label="main", frame=()):
+        """worst-case cost from a label to the first call of a subroutine
+
+        None when the route never calls it.  The first call is looked for
+        depth first, descending into the subroutines on the way.
+        """
+        memo = {}
+
+        def walk(index):
+            if index in memo:
+                return memo[index]
+            memo[index] = None
+            block = self.blocks[index]
+            cost = 0
+            calls = iter(self._evaluate(block, self.slots, frame)[2])
+            for ins in self.program.instructions[block.start:block.end]:
+                if ins.op == "callsub":
+                    callee = ins.args[0]
+                    if callee.rsplit("_", 1)[0] == callee_prefix:
+                        memo[index] = cost
+                        return cost
+                    args = self._frame(callee, next(calls))
+                    inner = self.cost_until(callee_prefix, callee, args)
+                    if inner is not None:
+                        memo[index] = cost + ins.cost + inner
+                        return memo[index]
+                    summary = self.summarize(callee, self.recursion_bound, args)
+                    if summary is None:
+                        return None
+                    cost += summary[0]
+                cost += ins.cost
+            tails = [walk(w) for w in self.edges(block, frame)]
+            tails = [t for t in tails if t is not None]
+            memo[index] = cost + max(tails) if tails else None
+            return memo[index]
+
+        start = 0 if label == "main" else self.program.target(label)
+        return walk(self.block_at[start].index)
+
+    def _block_cost(self, block, depth, frame=()):
+        """(cost, inner txns, attribution) of one block including its callees"""
+        cost = 0
+        inner = 0
+        attribution = Counter()
+        mine = owner(block.label)
+        calls = iter(self._evaluate(block, self.slots, frame)[2])
+        for ins in self.program.instructions[block.start:block.end]:
+            self.reached.add(ins)
+            cost += ins.cost
+            attribution[mine] += ins.cost
+            if ins.op in ("itxn_begin", "itxn_next"):
+                inner += 1
+            if ins.op == "callsub":
+                callee = ins.args[0]
+                args = self._frame(callee, next(calls))
+                if callee in self._active:
+                    if depth == 0:
+                        return None
+                    summary = self.summarize(callee, depth - 1, args)
+                else:
+                    summary = self.summarize(
+                        callee, self.recursion_bounds.get(callee.rsplit("_", 1)[0], depth), args)
+                if summary is None:
+                    return None
+                cost += summary[0]
+                inner += summary[1]
+                attribution.update(summary[2])
+        return cost, inner, attribution
+
+    def summarize(self, label, depth=None, frame=()):
+        """worst case (cost, inner txns, attribution) from a label to its exit"""
+        if depth is None:
+            depth = self.recursion_bound
+        # loop bounds may depend on the caller, so summaries are kept per caller
+        key = (label, depth, frame, self._active[-1] if self._active else None)
+        if key in self._memo:
+            return self._memo[key]
+        self._active.append(label)
+        start = 0 if label == "main" else self.program.target(label)
+        result = self._longest(self.block_at[start].index, depth, frame)
+        self._active.pop()
+        self._memo[key] = result
+        return result
+
+    def _longest(self, entry, depth, frame=(), body=None):
+        """worst case (cost, inner txns, attribution) from entry to an exit
+
+        with body, the path is one iteration of the loop whose blocks body
+        holds and entry heads: it ends where an edge goes back to entry or
+        leaves the loop.
+        """
+        def successors(v):
+            return [w for w in self.edges(self.blocks[v], frame)
+                    if body is None or w in body and w != entry]
+
+        def ends(v):
+            last = self.program.instructions[self.blocks[v].end - 1].op
+            if last in ("return", "retsub"):
+                return True
+            edges = self.edges(self.blocks[v], frame)
+            if body is not None:
+                return any(w == entry or w not in body for w in edges)
+            return not edges and last != "err"
+
+        # strongly connected components of the pruned graph reachable from entry
+        order, low, index, stack, on_stack, sccs = {}, {}, [0], [], set(), []
+
+        def connect(v):
+            order[v] = low[v] = index[0]
+            index[0] += 1
+            stack.append(v)
+            on_stack.add(v)
+            for w in successors(v):
+                if w not in order:
+                    connect(w)
+                    low[v] = min(low[v], low[w])
+                elif w in on_stack:
+                    low[v] = min(low[v], order[w])
+            if low[v] == order[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    component.append(w)
+                    if w == v:
+                        break
+                sccs.append(component)
+
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 10000))
+        try:
+            connect(entry)
+        finally:
+            sys.setrecursionlimit(limit)
+
+        component_of = {}
+        for k, component in enumerate(sccs):
+            for v in component:
+                component_of[v] = k
+
+        # Tarjan emits components in reverse topological order, each with the
+        # block it was entered through last
+        best = {}
+        for k, component in enumerate(sccs):
+            head = component[-1]
+            if len(component) > 1 or head in successors(head):
+                # the longest single iteration, bound times, and the head's
+                # exit test once more
+                iteration = self._longest(head, depth, frame, set(component))
+                exit_test = self._block_cost(self.blocks[head], depth, frame)
+                if iteration is None or exit_test is None:
+                    continue
+                bound = self._loop_bound(self.blocks[head].label)
+                total = (iteration[0] * bound + exit_test[0],
+                         iteration[1] * bound + exit_test[1],
+                         Counter({s: c * bound for s, c in iteration[2].items()})
+                         + exit_test[2])
+            else:
+                total = self._block_cost(self.blocks[head], depth, frame)
+                if total is None:
+                    continue
+            exits = {component_of[w] for v in component
+                     for w in successors(v) if component_of[w] != k}
+            tail = None
+            for e in exits:
+                if e in best and (tail is None or best[e][0] > tail[0]):
+                    tail = best[e]
+            if tail is None and not any(ends(v) for v in component):
+                continue
+            if tail is None:
+                tail = (0, 0, Counter())
+            best[k] = (total[0] + tail[0], total[1] + tail[1], total[2] + tail[2])
+        return best.get(component_of[entry])
+
+    def _loop_bound(self, label):
+        """the bound of a loop headed by label, in the subroutine being summarized"""
+        name = owner(label).rsplit("_", 1)[0]
+        if len(self._active) > 1:
+            caller = owner(self._active[-2]).rsplit("_", 1)[0]
+            if "%s/%s" % (caller, name) in self.loop_bounds:
+                return self.loop_bounds["%s/%s" % (caller, name)]
+        return self.loop_bounds.get(name, self.loop_bound)
+
+
+def opup_costs(program):
+    """(entry, iteration) cost of the request_budget OpUp loop
+
+    entry runs from the callsub to the first budget read, iteration is one
+    pass through the loop including the inner app call it submits.
+    """
+    blocks = [b for b in teal.basic_blocks(program)
+              if owner(b.label).rsplit("_", 1)[0] == OPUP_SUBROUTINE]
+    if not blocks:
+        return None
+    entry = 1  # the callsub itself
+    for ins in program.instructions[blocks[0].start:]:
+        entry += ins.cost
+        if ins.op == "global" and ins.args[0] == "OpcodeBudget":
+            break
+    for block in blocks:
+        last = program.instructions[block.end - 1]
+        if last.op == "b" and program.target(last.args[0]) <= block.start:
+            start = program.target(last.args[0])
+            iteration = sum(ins.cost for ins in program.instructions[start:block.end])
+            return entry, iteration
+    return None
+
+
+def _per_item_budget(routes, route, items):
+    """base and per item budget of a route costed for several item counts
+
+    items maps a route name to its item count, or None for other routes.
+    """
+    by_items = {}
+    inner_by_items = {}
+    entries = []
+    for name, data in routes.items():
+        n = items(name)
+        if n is None or not data["reachable"]:
+            continue
+        by_items[n] = max(by_items.get(n, 0), data["opcode_cost"] - data["budget_entry"])
+        inner_by_items[n] = max(inner_by_items.get(n, 0), data["inner_txns"])
+        entries.append(data["budget_entry"])
+    if len(by_items) < 2:
+        return None
+    few, many = min(by_items), max(by_items)
+    per_item = math.ceil((by_items[many] - by_items[few]) / (many - few))
+    return {
+        "budget": by_items[few] - few * per_item,
+        "per_item": per_item,
+        "inner_txns_per_item": math.ceil(
+            (inner_by_items[many] - inner_by_items[few]) / (many - few)),
+        "entry": max(entries),
+    }
+
+
+def budgets(data):
+    """the budgets.json table p3-contract.py and fees.py read
+
+    every order branch asks for the worst case of its routes minus what was
+    spent before the request.  Carts and pre-mint batches ask for a per item
+    budget before each item and for the rest of the call after them; the
+    inner transactions an item submits draw on the fee credit before the
+    last request.
+    """
+    routes = data["routes"]
+    table = {}
+    for collection_type in COLLECTION_TYPES:
+        for gate_suffix in GATE_CHECKS:
+            names = [n for n in routes if n.startswith("order_new/")
+                     and n.split("/")[2] == collection_type
+                     and ("/pass" in n) == (gate_suffix == "/pass") and routes[n]["reachable"]]
+            if not names:
+                continue
+            table["order_new/" + collection_type + gate_suffix] = {
+                "budget": max(routes[n]["opcode_cost"] - routes[n]["budget_entry"]
+                              for n in names),
+                "entry": max(routes[n]["budget_entry"] for n in names),
+            }
+    per_item_routes = {
+        "order_cart": lambda name: (int(name.split("/")[2])
+                                    if name.startswith("order_cart/") else None),
+        "phygital_preminted_optin": lambda name: (
+            int(name.split("/")[1]) if name.startswith("phygital_preminted_optin/") else None),
+    }
+    for route in BUDGETED_ROUTES:
+        if routes.get(route, {}).get("reachable"):
+            table[route] = {
+                "budget": routes[route]["opcode_cost"] - routes[route]["budget_entry"],
+                "entry": routes[route]["budget_entry"],
+            }
+    for route, items in per_item_routes.items():
+        budget = _per_item_budget(routes, route, items)
+        if budget is not None:
+            table[route] = budget
+    entry, iteration = data["program"]["opup"]
+    result = {
+        "app_call_budget": APP_CALL_BUDGET,
+        "opup": {"buffer": OPUP_BUFFER, "entry": entry, "iteration": iteration},
+        "routes": table,
+    }
+    if "order_cart" in table:
+        table["order_cart"]["max_items"] = cart_max_items(result)
+    return result
+
+
+def cart_max_items(table):
+    """the most line items an order_cart call can carry under a budgets.json table
+
+    a cart of worst-case items has to get its budget from the OpUp calls and
+    mints of one compact group's 16 inner transactions, and even the smallest
+    items have to fit the call's args.  Catalog proven items are some 600
+    bytes each, so only (2048 - 206) // 613 = 3 of them fit with a signed
+    oracle price and 2 with an attested one.
+    """
+    n = 0
+    while (CART_FIRST_ITEM + n + 1 <= MAX_APP_ARGS
+           and CART_BASE_ARGS_SIZE + (n + 1) * CART_MIN_ITEM_SIZE <= MAX_APP_ARGS_SIZE
+           and fees.credit_txns(table, "order_cart", items=n + 1) <= MAX_INNER_TXNS):
+        n += 1
+    return n
+
+
+def _route_bytes(program, reached):
+    header = sum(ins.size for ins in program.instructions
+                 if ins.op in ("intcblock", "bytecblock"))
+    return 1 + header + sum(ins.size for ins in reached
+                            if ins.op not in ("intcblock", "bytecblock"))
+
+
+def source_map(program, sources):
+    """one entry per basic block naming the subroutine that emitted it"""
+    entries = []
+    for block in teal.basic_blocks(program):
+        instructions = program.instructions[block.start:block.end]
+        label = owner(block.label)
+        info = sources.get(label if label == "main" else label.rsplit("_", 1)[0], {})
+        entries.append({
+            "label": block.label,
+            "teal_lines": [instructions[0].line, instructions[-1].line],
+            "pc": [instructions[0].pc, instructions[-1].pc + instructions[-1].size],
+            "cost": sum(ins.cost for ins in instructions),
+            "bytes": sum(ins.size for ins in instructions),
+            "subroutine": info.get("subroutine", label),
+            "source": info.get("source"),
+        })
+    return entries
+
+
+def report(path=CONTRACT, routes=None, loop_bound=LOOP_BOUND,
+           recursion_bound=RECURSION_BOUND, version=TEAL_VERSION):
+    """build the JSON-serializable cost report for every route"""
+    namespace = load_contract(path)
+    source = compile_approval(namespace, version)
+    program = teal.parse(source)
+    bytecode = teal.assemble(program)
+    sources = subroutine_sources(namespace, path)
+
+    def name_of(label):
+        key = label if label == "main" else label.rsplit("_", 1)[0]
+        return sources.get(key, {}).get("subroutine", label)
+
+    result = {}
+    for name, assumptions in (routes or ROUTES).items():
+        analysis = RouteAnalysis(program, assumptions, loop_bound, recursion_bound,
+                                 LOOP_BOUNDS.get(name))
+        summary = analysis.summarize("main")
+        if summary is None:
+            result[name] = {"assumptions": _jsonable(assumptions), "reachable": False}
+            continue
+        cost, inner, attribution = summary
+        result[name] = {
+            "assumptions": _jsonable(assumptions),
+            "reachable": True,
+            "opcode_cost": cost,
+            "budget_entry": analysis.cost_until(OPUP_SUBROUTINE) or 0,
+            "inner_txns": inner,
+            "bytes": _route_bytes(program, analysis.reached),
+            "app_calls_for_budget": max(1, math.ceil(cost / APP_CALL_BUDGET)),
+            "subroutines": {
+                name_of(label): c for label, c in attribution.most_common()
+            },
+        }
+    return {
+        "program": {
+            "teal_version": program.version,
+            "bytes": len(bytecode),
+            "instructions": len(program.instructions),
+            "loop_bound": loop_bound,
+            "recursion_bound": recursion_bound,
+            "opup": opup_costs(program),
+        },
+        "routes": result,
+        "source_map": source_map(program, sources),
+    }
+
+
+def _jsonable(assumptions):
+    return {k: v.decode(errors="replace") if isinstance(v, bytes) else v
+            for k, v in assumptions.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contract", default=CONTRACT)
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    parser.add_argument("--loop-bound", type=int, default=LOOP_BOUND)
+    parser.add_argument("--recursion-bound", type=int, default=RECURSION_BOUND)
+    parser.add_argument("--route", action="append",
+                        help="only report these routes (repeatable)")
+    parser.add_argument("--budgets",
+                        help="write the per-branch budget table p3-contract.py builds with")
+    args = parser.parse_args(argv)
+
+    routes = ROUTES
+    if args.route:
+        routes = {name: ROUTES[name] for name in args.route}
+    data = report(args.contract, routes, args.loop_bound, args.recursion_bound)
+    if args.budgets:
+        with open(args.budgets, "w") as f:
+            f.write(json.dumps(budgets(data), indent=2) + "\n")
+        if not args.output:
+            return
+    text = json.dumps(data, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,837 @@
+"""Offline dryrun and benchmark harness for the compiled p3 contract.
+
+Runs approval.teal / clear.teal (as written by the __main__ block of
+p3-contract.py) on the pure-Python AVM in avm.py.  A Marketplace fixture
+deploys the app with an admin, an oracle, a merchant and a buyer, creates one
+collection per collection_type and builds the real 15 transaction checkout
+group: the order call at Gtxn[0], the merchant payment at Gtxn[9], the POS
+fee at Gtxn[14] and budget padding calls everywhere else.  With --compact the
+group is just the order call and the two payments, and the order call pays the
+fees.py estimate for the OpUp calls its branch makes to raise its own budget.
+
+    python dryrun.py checkout
+    python dryrun.py checkout --compact
+    python dryrun.py bench --orders 5000 --output bench.json
+    python dryrun.py bench --orders 5000 --baseline bench.json
+    python dryrun.py checks
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import avm
+import catalog
+import client
+import fees
+import optin
+import sweep
+import teal
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APPROVAL = os.path.join(HERE, "approval.teal")
+CLEAR = os.path.join(HERE, "clear.teal")
+
+COLLECTION_TYPES = ["phygital", "tokengate", "tokengatephygital", "false"]
+PAYMENT_TYPES = ["pay", "axfer"]
+POS_FEE = 5
+GROUP_SIZE = 15
+MERCHANT_PAYMENT_INDEX = 9
+POS_PAYMENT_INDEX = 14
+# payment offsets from the order call of a compact group: call | merchant | POS fee
+COMPACT_LAYOUT = b"\x01\x02"
+LEGACY_LAYOUT = bytes([MERCHANT_PAYMENT_INDEX, POS_PAYMENT_INDEX])
+CATALOG_SIZE = 100000
+# line items of the checkout carts, the order_cart max_items of budgets.json
+CART_ITEMS = 2
+# NFTs checkout pre-mints into the phygital pool, the most one call takes
+PREMINT_ITEMS = 8
+PRICE_TABLE_SIZE = 1024
+
+
+def build_programs(approval=APPROVAL, clear=CLEAR, contract=None):
+    """write approval.teal and clear.teal the same way p3-contract.py does"""
+    from pyteal import Mode, compileTeal
+
+    import cost_report
+    namespace = cost_report.load_contract(contract or cost_report.CONTRACT)
+    with open(approval, "w+") as f:
+        f.write(namespace["compile_approval"]())
+    with open(clear, "w+") as f:
+        f.write(compileTeal(namespace["clear_program"](), mode=Mode.Application, version=8))
+
+
+def load_programs(approval=APPROVAL, clear=CLEAR, rebuild=False):
+    """parsed (approval, clear) programs, compiling them first if needed"""
+    if rebuild or not (os.path.exists(approval) and os.path.exists(clear)):
+        build_programs(approval, clear)
+    with open(approval) as f:
+        approval_program = teal.parse(f.read())
+    with open(clear) as f:
+        clear_program = teal.parse(f.read())
+    return approval_program, clear_program
+
+
+def address(name):
+    return hashlib.sha256(b"address:" + name.encode()).digest()
+
+
+def signing_key(name):
+    from nacl.signing import SigningKey
+    return SigningKey(hashlib.sha256(b"key:" + name.encode()).digest())
+
+
+def sign(key, message):
+    return key.sign(message).signature
+
+
+def itob(n):
+    return n.to_bytes(8, "big")
+
+
+class Marketplace:
+    """a deployed contract with one merchant, one buyer and their collections"""
+
+    def __init__(self, approval, clear, pos_fee=POS_FEE, catalog_size=0, compact=False,
+                 budgets=fees.BUDGETS):
+        self.ledger = avm.Ledger()
+        self.pos_fee = pos_fee
+        self.compact = compact
+        self.budgets = fees.load_budgets(budgets)
+        self.admin = address("admin")
+        self.merchant = address("merchant")
+        self.buyer = address("buyer")
+        self.gate_creator = address("gate-creator")
+        self.oracle = address("oracle")
+        self.merchant_key = signing_key("merchant")
+        self.oracle_key = signing_key("oracle")
+        self.merchant_pubkey = bytes(self.merchant_key.verify_key)
+        for who in (self.admin, self.merchant, self.buyer, self.gate_creator, self.oracle):
+            self.ledger.fund(who, 10 ** 15)
+
+        # the schema of contract.json, posFees and oraclePubKey globally and a
+        # buyer's gate pass locally, and the extra pages the programs need
+        create = avm.app_call(self.admin, 0, ApprovalProgram=approval,
+                              ClearStateProgram=clear, GlobalNumByteSlice=2, LocalNumByteSlice=1,
+                              ExtraProgramPages=teal.extra_pages(teal.assemble(approval),
+                                                                 teal.assemble(clear)))
+        self._expect(avm.run_group(self.ledger, [create]), "create")
+        self.app = self.ledger.apps[create["CreatedApplicationID"]]
+        self.boxes = client.BoxCache(client.MemoryAlgod(self.ledger), self.app.id)
+        self.ledger.fund(self.app.address, 10 ** 9)
+        self.padding = self.ledger.create_app(
+            self.admin, teal.parse("#pragma version 8\nint 1"))
+
+        self.asa = self.ledger.create_asset(self.admin, total=10 ** 15, decimals=6,
+                                            unit_name=b"USDC", name=b"USD Coin")
+        for who in (self.merchant, self.buyer):
+            self.ledger.opt_in_asset(who, self.asa)
+        self.ledger.account(self.admin).assets[self.asa] -= 10 ** 14
+        self.ledger.account(self.buyer).assets[self.asa] += 10 ** 14
+        init = avm.app_call(self.admin, self.app.id,
+                            [teal.method_selector("admin_init"), itob(pos_fee),
+                             bytes(self.oracle_key.verify_key)],
+                            Assets=[self.asa])
+        self._expect(avm.run_group(self.ledger, [init]), "admin_init")
+
+        self.gate = self.ledger.create_asset(self.gate_creator, total=1,
+                                             unit_name=b"GATE", name=b"Member Pass")
+        self.ledger.opt_in_asset(self.buyer, self.gate)
+        self.ledger.account(self.gate_creator).assets[self.gate] = 0
+        self.ledger.account(self.buyer).assets[self.gate] = 1
+
+        self.collections = {}
+        for collection_type in COLLECTION_TYPES:
+            if collection_type != "false":
+                self.init_collection(collection_type)
+
+        self.catalog = None
+        if catalog_size:
+            self.commit_catalog(catalog_size)
+        self.price_table = None
+        self.price_index = {}
+
+    def _expect(self, result, what):
+        if not result.approved:
+            raise RuntimeError("%s rejected: %s" % (what, result.error))
+        return result
+
+    def collection_name(self, collection_type):
+        return ("%s collection" % collection_type).encode()
+
+    def collection_group(self, collection_type, max_supply=0, image_url=b"ipfs://p3/drop",
+                         requirement_type=b"NFT Ownership", requirement_id=None, overpay=0):
+        """a collection_init paying exactly its record's minimum balance
+
+        overpaid groups give the call one more fee for the refund.
+        """
+        name = self.collection_name(collection_type)
+        if requirement_id is None:
+            requirement_id = itob(self.gate)
+        args = [teal.method_selector("collection_init"), name, self.merchant_pubkey,
+                itob(max_supply), itob(0), itob(2 ** 40), image_url, requirement_type,
+                requirement_id, collection_type.encode()]
+        exists = self.ledger.box(self.app.id, client.collection_box(
+            name, self.merchant_pubkey, self.merchant, collection_type.encode())) is not None
+        amount = client.collection_init_payment(name, self.merchant_pubkey, self.merchant,
+                                                collection_type.encode(), image_url, exists)
+        fee = avm.MIN_TXN_FEE * (2 if overpay else 1)
+        return [self.box_call(self.merchant, args, Fee=fee), avm.payment(self.merchant, self.app.address, amount + overpay)]
+
+    def init_collection(self, collection_type, **kwargs):
+        group = self.collection_group(collection_type, **kwargs)
+        result = self._expect(avm.run_group(self.ledger, group), "collection_init")
+        self.collections[collection_type] = self.collection_name(collection_type)
+        return result
+
+    def catalog_product(self, index):
+        """(collection_type, product_id, price) of the index-th catalog product"""
+        collection_type = COLLECTION_TYPES[index % len(COLLECTION_TYPES)]
+        price = ("%d.%02d" % (1 + index % 997, index % 100)).encode()
+        return collection_type, ("sku-%d" % index).encode(), price
+
+    def product_message(self, collection_type, product_id, price):
+        name = self.collection_name(collection_type) if collection_type != "false" else b""
+        return catalog.product_message(product_id, price, collection_type.encode(), name)
+
+    def commit_catalog(self, size, version=1):
+        """build a catalog of size products and commit its root for the merchant"""
+        self.catalog = catalog.Catalog(
+            [self.product_message(*self.catalog_product(i)) for i in range(size)])
+        root = self.catalog.root
+        args = [teal.method_selector("catalog_commit"), self.merchant_pubkey, root, itob(version),
+                sign(self.merchant_key, catalog.commit_message(root, version))]
+        group = [
+            self.box_call(self.merchant, args),
+            avm.payment(self.merchant, self.app.address, 10 ** 6),
+        ]
+        group[0]["Fee"] = fees.group_fee(self.budgets, "catalog_commit", len(group))
+        return self._expect(avm.run_group(self.ledger, group), "catalog_commit")
+
+    def price_message(self, payment, price, total):
+        """the oracle tuple for paying total for a product priced at price this round"""
+        asset = 0 if payment == "pay" else self.asa
+        return catalog.price_message(price, asset, total, self.ledger.round)
+
+    def attest_prices(self, messages):
+        """have the oracle attest a table of price tuples for the current round"""
+        self.price_table = catalog.Catalog(list(messages))
+        self.price_index = {m: i for i, m in enumerate(messages)}
+        root = self.price_table.root
+        args = [teal.method_selector("oracle_attest"), itob(self.ledger.round), root,
+                sign(self.oracle_key, catalog.attest_message(root, self.ledger.round))]
+        group = [
+            self.box_call(self.oracle, args),
+            avm.payment(self.oracle, self.app.address, 10 ** 6),
+        ]
+        group[0]["Fee"] = fees.group_fee(self.budgets, "oracle_attest", len(group))
+        return self._expect(avm.run_group(self.ledger, group), "oracle_attest")
+
+    def catalog_order_group(self, index, payment="pay", total=1000000, attested=False):
+        """checkout group for a catalog product, proven by its Merkle path"""
+        collection_type, product_id, price = self.catalog_product(index)
+        return self.order_group(collection_type, payment, product_id, price, total,
+                                proof=self.catalog.proof(index), attested=attested)
+
+    def order_group(self, collection_type, payment="pay", product_id=b"sku-1",
+                    price=b"19.99", total=1000000, proof=None, attested=False, compact=None,
+                    gate_pass=False):
+        """the 15 transaction checkout group for one product
+
+        attested orders prove their price tuple against the table of the last
+        attest_prices() call instead of carrying an oracle signature, and
+        gate_pass orders leave out the gate asset to use the buyer's gate pass.
+        compact overrides the market's group layout for this one order.
+        """
+        compact = self.compact if compact is None else compact
+        name = self.collection_name(collection_type) if collection_type != "false" else b""
+        oracle_round = itob(self.ledger.round)
+        oracle_data = self.price_message(payment, price, total)
+        if attested:
+            oracle_proof = self.price_table.proof(self.price_index[oracle_data])
+        else:
+            oracle_proof = sign(self.oracle_key, oracle_data)
+        if proof is None:
+            proof = sign(self.merchant_key,
+                         self.product_message(collection_type, product_id, price))
+        args = [
+            teal.method_selector("order_new"), self.merchant_pubkey, product_id, price,
+            proof, self.merchant, oracle_round,
+            oracle_proof, self.payment_type_signature(payment),
+            self.merchant, collection_type.encode(), name,
+        ]
+        if compact:
+            args.append(COMPACT_LAYOUT)
+        route = "order_new/" + collection_type
+        assets = []
+        if "tokengate" in collection_type:
+            if gate_pass:
+                route += "/pass"
+            else:
+                assets.append(self.gate)
+        return self._checkout_group(avm.app_call(self.buyer, self.app.id, args, Assets=assets),
+                                    payment, total, route, compact=compact)
+
+    def payment_type_signature(self, payment):
+        asset = 0 if payment == "pay" else self.asa
+        return sign(self.merchant_key, catalog.payment_type_message(asset, self.merchant))
+
+    def _padding_call(self, n):
+        return avm.app_call(self.buyer, self.padding.id, [itob(n)])
+
+    def _checkout_group(self, call, payment, total, route, items=0, compact=None):
+        """an order call with its two payments and the budget its route needs
+
+        legacy groups are padded to 15 transactions; either way the order call
+        pays for the OpUp calls fees.py predicts for its route.
+        """
+        client.fill_box_references(call, self.box_sizes(call))
+        service_fee = total * self.pos_fee // 100
+        merchant_amount = total - service_fee
+        if payment == "pay":
+            merchant_payment = avm.payment(self.buyer, self.merchant, merchant_amount)
+            pos_payment = avm.payment(self.buyer, self.app.address, service_fee)
+        else:
+            merchant_payment = avm.asset_transfer(self.buyer, self.merchant, self.asa,
+                                                  merchant_amount)
+            pos_payment = avm.asset_transfer(self.buyer, self.app.address, self.asa,
+                                             service_fee)
+
+        if self.compact if compact is None else compact:
+            call["Fee"] = fees.group_fee(self.budgets, route, 1, items=items)
+            return [call, merchant_payment, pos_payment]
+        call["Fee"] = fees.group_fee(self.budgets, route, 1, app_calls=GROUP_SIZE - 2,
+                                     items=items)
+        group = [call]
+        while len(group) < GROUP_SIZE:
+            index = len(group)
+            if index == MERCHANT_PAYMENT_INDEX:
+                group.append(merchant_payment)
+            elif index == POS_PAYMENT_INDEX:
+                group.append(pos_payment)
+            else:
+                group.append(self._padding_call(index))
+        return group
+
+    def order(self, collection_type, payment="pay", **kwargs):
+        return avm.run_group(self.ledger, self.order_group(collection_type, payment, **kwargs))
+
+    def cart_price_message(self, payment, prices, total):
+        asset = 0 if payment == "pay" else self.asa
+        return catalog.cart_price_message(prices, asset, total, self.ledger.round)
+
+    def cart_group(self, items, payment="pay", total=1000000, attested=False):
+        """checkout group for a cart of (collection_type, product_id, price, proof) items
+
+        a proof of None signs the product with the merchant key.
+        """
+        args = [teal.method_selector("order_cart"), self.merchant_pubkey, self.merchant,
+                itob(self.ledger.round)]
+        oracle_data = self.cart_price_message(payment, [item[2] for item in items], total)
+        if attested:
+            args.append(self.price_table.proof(self.price_index[oracle_data]))
+        else:
+            args.append(sign(self.oracle_key, oracle_data))
+        args.append(self.payment_type_signature(payment))
+        args.append(COMPACT_LAYOUT if self.compact else LEGACY_LAYOUT)
+        assets = []
+        for collection_type, product_id, price, proof in items:
+            name = self.collection_name(collection_type) if collection_type != "false" else b""
+            if proof is None:
+                proof = sign(self.merchant_key,
+                             self.product_message(collection_type, product_id, price))
+            if "tokengate" in collection_type and not assets:
+                assets.append(self.gate)
+            args.append(catalog.cart_item(product_id, price, collection_type.encode(),
+                                          name, proof))
+        return self._checkout_group(avm.app_call(self.buyer, self.app.id, args, Assets=assets),
+                                    payment, total, "order_cart", len(items))
+
+    def rating_name(self):
+        return client.rating_box(self.merchant_pubkey, self.merchant)
+
+    def review_group(self, stars, text=b"great product", order=None):
+        """a review of the merchant, paying for its rating box if it is the first
+
+        the review is sent with the buyer's order of the merchant, a compact
+        order_new of an unrestricted product unless order is given.
+        """
+        args = [teal.method_selector("order_review"), self.merchant_pubkey, self.merchant,
+                text, b"*" * stars]
+        note = b"review_customer_order_" + self.merchant_pubkey + self.merchant
+        group = [self.box_call(self.buyer, args, Note=note)]
+        if self.ledger.box(self.app.id, self.rating_name()) is None:
+            group.append(avm.payment(self.buyer, self.app.address,
+                                     avm.box_min_balance(self.rating_name(), 64)))
+        return group + (order or self.order_group("false", compact=True))
+
+    def rating(self):
+        """(count, star sum, reviews per star count) of the merchant's rating box"""
+        rating = client.rating_record(self.ledger.box(self.app.id, self.rating_name()))
+        return rating["count"], rating["star_sum"], rating["histogram"]
+
+    def opt_in(self, who):
+        """opt an account in to the app, which lets it hold a gate pass"""
+        call = avm.app_call(who, self.app.id, on_completion=1)
+        return self._expect(avm.run_group(self.ledger, [call]), "opt-in")
+
+    def optin_groups(self, assets):
+        """the admin's groups opting the app in to assets, as optin.plan() pages them"""
+        held = self.ledger.account(self.app.address).assets
+        return [[avm.app_call(self.admin, self.app.id, [teal.method_selector("admin_optin_assets")],
+                              Assets=call["assets"], Fee=call["fee"]) for call in group]
+                for group in optin.plan(assets, held)["groups"]]
+
+    def sweep_groups(self, treasury, reserve=0):
+        """the admin's groups sweeping the app's fees to treasury, as sweep.plan() pages them"""
+        app = self.ledger.account(self.app.address)
+        created = [a for a, params in self.ledger.assets.items()
+                   if params["AssetCreator"] == self.app.address]
+        plan = sweep.plan(app.assets, created, app.balance - app.min_balance(), reserve,
+                          self.ledger.account(treasury).assets)
+        groups = []
+        for group in plan["groups"]:
+            calls = []
+            for call in group:
+                args = [teal.method_selector("admin_sweep_fees")]
+                if call["reserve"] is not None:
+                    args.append(itob(call["reserve"]))
+                calls.append(avm.app_call(self.admin, self.app.id, args, Accounts=[treasury],
+                                          Assets=call["assets"], Fee=call["fee"]))
+            groups.append(calls)
+        return groups
+
+    def box_sizes(self, call):
+        """lengths of the existing boxes a call touches, read through the box cache"""
+        route = client.SELECTORS.get(call["ApplicationArgs"][0])
+        names = client.box_names(route, call["ApplicationArgs"], call["Sender"])
+        # every group may have written them since they were cached
+        self.boxes.invalidate(names)
+        asyncio.run(self.boxes.prefetch(names))
+        sizes = self.boxes.sizes()
+        return {name: sizes[name] for name in names if name in sizes}
+
+    def box_call(self, sender, args, **fields):
+        """a call to the app with references to the boxes its route touches"""
+        call = avm.app_call(sender, self.app.id, args, **fields)
+        return client.fill_box_references(call, self.box_sizes(call))
+
+    def pool_name(self, collection_type):
+        return client.pool_box(self.collection_name(collection_type), self.merchant_pubkey,
+                               self.merchant, collection_type.encode())
+
+    def premint_group(self, collection_type, count, capacity=64):
+        """the merchant's group pre-minting count NFTs of a collection into its pool"""
+        route = "phygital_preminted_optin"
+        args = [teal.method_selector(route), self.collection_name(collection_type),
+                self.merchant_pubkey, collection_type.encode(), itob(count), itob(capacity)]
+        amount = count * (avm.ASSET_MIN_BALANCE + avm.MIN_TXN_FEE)
+        pool = self.pool_name(collection_type)
+        sizes = {}
+        if self.ledger.box(self.app.id, pool) is None:
+            amount += avm.box_min_balance(pool, 16 + 40 * capacity)
+            # the call creates the pool, so its I/O quota has to cover it
+            sizes[pool] = 16 + 40 * capacity
+        call = avm.app_call(self.merchant, self.app.id, args)
+        group = [
+            client.fill_box_references(call, {**self.box_sizes(call), **sizes}),
+            avm.payment(self.merchant, self.app.address, amount),
+        ]
+        group[0]["Fee"] = fees.group_fee(self.budgets, route, len(group), items=count)
+        return group
+
+    def pool_slots(self, collection_type):
+        """(asset ID, Sha256(owner)) of every slot of a collection's pool, 0 if free"""
+        pool = self.ledger.box(self.app.id, self.pool_name(collection_type))
+        return client.pool_record(pool)["slots"]
+
+    def claim_group(self, collection_type, slot, claimer=None):
+        """the buyer's group opting in to and claiming the pre-minted NFT in slot"""
+        claimer = claimer or self.buyer
+        asset, _ = self.pool_slots(collection_type)[slot]
+        args = [teal.method_selector("phygital_preminted_withdraw_owner"),
+                self.collection_name(collection_type), self.merchant_pubkey, self.merchant,
+                collection_type.encode(), itob(slot)]
+        call = avm.app_call(claimer, self.app.id, args, Assets=[asset], Fee=2 * avm.MIN_TXN_FEE)
+        return [
+            avm.asset_transfer(claimer, claimer, asset, 0),
+            client.fill_box_references(call, self.box_sizes(call)),
+        ]
+
+
+def _order_summary(result, group):
+    call = result.calls[0] if result.calls else None
+    return {
+        "approved": result.approved,
+        "error": result.error,
+        "opcode_cost": call.cost if call else 0,
+        "group_size": len(group),
+        "group_fees": sum(t["Fee"] for t in group),
+        "group_budget": result.budget,
+        "inner_txns": call and len(call.inner_txns),
+        "opup_calls": call and sum(1 for t in call.inner_txns if t["Type"] == b"appl"),
+        "boxes_touched": len(result.boxes),
+    }
+
+
+def _fill_price_table(market, messages, size):
+    """pad the tuples orders will prove up to a realistic table size"""
+    messages = list(dict.fromkeys(messages))
+    n = 0
+    while len(messages) < size:
+        messages.append(market.price_message("pay", ("%d.00" % n).encode(), 10 ** 6 + n))
+        n += 1
+    return messages
+
+
+def checkout(approval, clear, catalog_size=CATALOG_SIZE, price_table_size=PRICE_TABLE_SIZE,
+             compact=False):
+    """run one checkout per payment type, collection type, product and price proof kind"""
+    market = Marketplace(approval, clear, catalog_size=catalog_size, compact=compact)
+    orders = []
+    for payment in PAYMENT_TYPES:
+        for n, collection_type in enumerate(COLLECTION_TYPES):
+            route = "order_new/%s/%s" % (payment, collection_type)
+            orders.append((route, collection_type, payment, None))
+            if market.catalog:
+                # the last catalog product of this collection type has the longest path
+                index = catalog_size - 1 - (catalog_size - 1 - n) % len(COLLECTION_TYPES)
+                orders.append((route + "/catalog", collection_type, payment, index))
+
+    carts = []
+    for payment in PAYMENT_TYPES:
+        if market.catalog:
+            # catalog proofs of the deepest products, cycling through the collection types
+            for n in range(1, CART_ITEMS + 1):
+                items = [market.catalog_product(i) + (market.catalog.proof(i),)
+                         for i in range(catalog_size - n, catalog_size)]
+                carts.append(("order_cart/%s/%d/catalog" % (payment, n), payment, items))
+        for n in range(1, CART_ITEMS + 1):
+            items = [(COLLECTION_TYPES[i % len(COLLECTION_TYPES)], b"sku-%d" % i, b"19.99", None)
+                     for i in range(n)]
+            carts.append(("order_cart/%s/%d" % (payment, n), payment, items))
+
+    def run(collection_type, payment, index, attested=False):
+        if index is None:
+            group = market.order_group(collection_type, payment, attested=attested)
+        else:
+            group = market.catalog_order_group(index, payment, attested=attested)
+        return _order_summary(avm.run_group(market.ledger, group), group)
+
+    def run_cart(payment, items, attested=False):
+        group = market.cart_group(items, payment, attested=attested)
+        return _order_summary(avm.run_group(market.ledger, group), group)
+
+    report = {}
+    for route, collection_type, payment, index in orders:
+        report[route] = run(collection_type, payment, index)
+    for route, payment, items in carts:
+        report[route] = run_cart(payment, items)
+    if price_table_size:
+        prices = [market.catalog_product(index)[2] if index is not None else b"19.99"
+                  for _, _, _, index in orders]
+        market.attest_prices(_fill_price_table(market, [
+            market.price_message(payment, price, 1000000)
+            for (_, _, payment, _), price in zip(orders, prices)] + [
+            market.cart_price_message(payment, [item[2] for item in items], 1000000)
+            for _, payment, items in carts], price_table_size))
+        for route, collection_type, payment, index in orders:
+            report[route + "/attested"] = run(collection_type, payment, index, attested=True)
+        for route, payment, items in carts:
+            report[route + "/attested"] = run_cart(payment, items, attested=True)
+
+    def record(route, group):
+        report[route] = _order_summary(avm.run_group(market.ledger, group), group)
+
+    # opt the app in to a page of new payment ASAs, skipping the one it holds
+    assets = [market.asa] + [market.ledger.create_asset(market.admin, total=10 ** 15,
+                                                        unit_name=b"ASA%d" % n)
+                             for n in range(optin.MAX_CALL_ASSETS)]
+    for group in market.optin_groups(assets):
+        record("admin_optin_assets/%d" % len(group[0]["Assets"]), group)
+
+    # stock the phygital collection's pool, then sell and claim its first NFT
+    record("phygital_preminted_optin/%d" % PREMINT_ITEMS,
+           market.premint_group("phygital", PREMINT_ITEMS))
+    record("order_new/pay/phygital/preminted", market.order_group("phygital", "pay"))
+    record("phygital_preminted_withdraw_owner", market.claim_group("phygital", 0))
+    # a full pool stocks again once a claim frees one of its slots
+    market._expect(avm.run_group(market.ledger, market.premint_group(
+        "tokengatephygital", PREMINT_ITEMS, capacity=PREMINT_ITEMS)), "pre-mint")
+    market._expect(market.order("tokengatephygital", "pay"), "pooled order")
+    market._expect(avm.run_group(market.ledger, market.claim_group("tokengatephygital", 0)),
+                   "claim")
+    record("phygital_preminted_optin/recycled", market.premint_group("tokengatephygital", 1))
+
+    record("order_review/first", market.review_group(5))
+    record("order_review", market.review_group(4))
+
+    # once opted in, the buyer's tokengate order writes a gate pass the next one uses
+    market.opt_in(market.buyer)
+    record("order_new/pay/tokengate/gatepass/first", market.order_group("tokengate", "pay"))
+    record("order_new/pay/tokengate/pass",
+           market.order_group("tokengate", "pay", gate_pass=True))
+
+    # collection_init keeps its record's minimum balance and refunds the rest
+    record("collection_init/refund", market.collection_group("false", overpay=10 ** 6))
+
+    # fees in every payment ASA so far go to a treasury in one full page and
+    # the rest, the pool's NFTs stay, and 1 ALGO is left above the minimum balance
+    for asset in assets[1:]:
+        market.ledger.account(market.admin).assets[asset] -= 500
+        market.ledger.account(market.app.address).assets[asset] += 500
+    treasury = address("treasury")
+    for asset in assets:
+        market.ledger.opt_in_asset(treasury, asset)
+    for group in market.sweep_groups(treasury, reserve=10 ** 6):
+        record("admin_sweep_fees/%d" % len(group[0]["Assets"]), group)
+    return report
+
+
+def benchmark(approval, clear, orders=1000, seed=0, catalog_size=CATALOG_SIZE,
+              price_table_size=PRICE_TABLE_SIZE, compact=False):
+    """replay generated orders on one marketplace and aggregate their costs
+
+    with a price table, half of the orders prove their price against one
+    oracle attestation for the round instead of an oracle signature.  With a
+    catalog, one order in five is a cart of catalog products.
+    """
+    rng = random.Random(seed)
+    market = Marketplace(approval, clear, catalog_size=catalog_size, compact=compact)
+    specs = []
+    carts = []
+    for n in range(orders):
+        payment = rng.choice(PAYMENT_TYPES)
+        total = rng.randint(10 ** 4, 10 ** 8)
+        attested = bool(price_table_size) and rng.random() < 0.5
+        if market.catalog and rng.random() < 0.2:
+            items = [market.catalog_product(i) + (market.catalog.proof(i),)
+                     for i in (rng.randrange(catalog_size)
+                               for _ in range(rng.randint(1, CART_ITEMS)))]
+            route = "order_cart/%s/%d/catalog" % (payment, len(items))
+            carts.append((route + ("/attested" if attested else ""),
+                          dict(items=items, payment=payment, total=total, attested=attested)))
+            continue
+        if market.catalog and rng.random() < 0.5:
+            index = rng.randrange(catalog_size)
+            collection_type, product_id, price = market.catalog_product(index)
+            proof = market.catalog.proof(index)
+            suffix = "/catalog"
+        else:
+            collection_type = rng.choice(COLLECTION_TYPES)
+            price = ("%d.%02d" % (rng.randint(1, 999), rng.randint(0, 99))).encode()
+            product_id = ("sku-%d" % rng.randint(1, 10 ** 6)).encode()
+            proof = None
+            suffix = ""
+        if attested:
+            suffix += "/attested"
+        specs.append(("order_new/%s/%s%s" % (payment, collection_type, suffix),
+                      dict(collection_type=collection_type, payment=payment,
+                           product_id=product_id, price=price, total=total,
+                           proof=proof, attested=attested)))
+    if price_table_size:
+        market.attest_prices(_fill_price_table(market, [
+            market.price_message(spec["payment"], spec["price"], spec["total"])
+            for _, spec in specs if spec["attested"]] + [
+            market.cart_price_message(cart["payment"], [item[2] for item in cart["items"]],
+                                      cart["total"])
+            for _, cart in carts if cart["attested"]], price_table_size))
+    builds = [(route, market.order_group, spec) for route, spec in specs]
+    builds += [(route, market.cart_group, cart) for route, cart in carts]
+    rng.shuffle(builds)
+
+    costs = {}
+    failures = {}
+    elapsed = 0.0
+    for route, build, kwargs in builds:
+        group = build(**kwargs)
+        started = time.perf_counter()
+        result = avm.run_group(market.ledger, group)
+        elapsed += time.perf_counter() - started
+        if not result.approved:
+            failures.setdefault(route, []).append(result.error)
+            continue
+        call = result.calls[0]
+        costs.setdefault(route, []).append((call.cost, len(call.inner_txns), len(result.boxes),
+                                            len(group), sum(t["Fee"] for t in group)))
+
+    routes = {}
+    for route in sorted(set(costs) | set(failures)):
+        samples = costs.get(route, [])
+        opcodes = [s[0] for s in samples]
+        routes[route] = {
+            "orders": len(samples),
+            "failed": len(failures.get(route, [])),
+            "opcode_cost": {
+                "min": min(opcodes, default=0),
+                "mean": round(statistics.fmean(opcodes), 1) if opcodes else 0,
+                "max": max(opcodes, default=0),
+            },
+            "inner_txns_max": max((s[1] for s in samples), default=0),
+            "boxes_touched_max": max((s[2] for s in samples), default=0),
+            "group_size_max": max((s[3] for s in samples), default=0),
+            "group_fees_mean": round(statistics.fmean(s[4] for s in samples), 1) if samples else 0,
+        }
+        if route in failures:
+            routes[route]["first_error"] = failures[route][0]
+    return {
+        "orders": orders,
+        "seed": seed,
+        "seconds": round(elapsed, 3),
+        "orders_per_second": round(orders / elapsed, 1) if elapsed else None,
+        "compact": compact,
+        "routes": routes,
+    }
+
+
+def checks(approval, clear, compact=False):
+    """groups the contract must approve or reject, each with what it did
+
+    a check fails if the group's outcome, or the balance change it makes,
+    isn't the expected one.
+    """
+    market = Marketplace(approval, clear, compact=compact)
+    report = {}
+
+    def check(name, group, approve, balance=None, who=None):
+        before = market.ledger.account(who).balance if who else None
+        result = avm.run_group(market.ledger, group)
+        entry = {"expected": approve, "approved": result.approved, "error": result.error}
+        if who:
+            entry["balance_change"] = market.ledger.account(who).balance - before
+        entry["ok"] = result.approved == approve and (
+            balance is None or entry["balance_change"] == balance)
+        report[name] = entry
+
+    def fee(group):
+        return -sum(t["Fee"] for t in group if t["Sender"] == market.merchant)
+
+    # two new collections in one group, each paid by the transaction after its call
+    group = market.collection_group("false") + market.collection_group("drop")
+    check("collection_init/two", group, True)
+
+    # initialising again refunds the whole payment; the merchant only pays fees
+    group = market.collection_group("false", overpay=10 ** 6)
+    check("collection_init/refund", group, True, fee(group), market.merchant)
+
+    # re-init calls sharing one overpayment would each refund it
+    group = market.collection_group("false", overpay=10 ** 6)
+    group += [market.collection_group("false", overpay=1)[0] for _ in range(3)]
+    check("collection_init/drain", group, False)
+
+    # a pre-mint can't count a collection_init's payment as its own
+    group = market.collection_group("drop", overpay=10 ** 6)
+    group.append(market.premint_group("phygital", 1)[0])
+    check("collection_init/shared_payment", group, False)
+
+    # a review counts only alongside the reviewer's order, and only once
+    check("order_review/no_order", market.review_group(5)[:-3], False)
+    group = market.review_group(5)
+    group.insert(-3, market.review_group(1, text=b"and again")[0])
+    check("order_review/two", group, False)
+    check("order_review", market.review_group(5), True)
+
+    # two orders of one group can't both be paid by the same two payments
+    first = market.order_group("false", compact=True)[0]
+    first["ApplicationArgs"][-1] = b"\x02\x03"
+    check("order_new/shared_payments",
+          [first] + market.order_group("false", product_id=b"sku-2", compact=True), False)
+
+    # an order without its gate asset needs the buyer's gate pass
+    check("order_new/tokengate/no_pass", market.order_group("tokengate", gate_pass=True), False)
+
+    # a cart of more items than fit one group's inner transactions
+    items = [("false", b"sku-%d" % i, b"19.99", None) for i in range(CART_ITEMS + 1)]
+    check("order_cart/too_many_items", market.cart_group(items), False)
+
+    # a pooled order whose box references don't cover the pool's size
+    market._expect(avm.run_group(market.ledger, market.premint_group("phygital", 1)),
+                   "pre-mint")
+    group = market.order_group("phygital")
+    client.fill_box_references(group[0])
+    check("order_new/phygital/box_quota", group, False)
+    check("order_new/phygital/preminted", market.order_group("phygital"), True)
+    return report
+
+
+def regressions(current, baseline, tolerance=0.0):
+    """routes whose worst-case or mean opcode cost grew beyond tolerance"""
+    found = []
+    for route, stats in current["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if before is None:
+            continue
+        for key in ("mean", "max"):
+            old, new = before["opcode_cost"][key], stats["opcode_cost"][key]
+            if new > old * (1 + tolerance):
+                found.append("%s %s opcode cost %s -> %s" % (route, key, old, new))
+        if stats["failed"] > before.get("failed", 0):
+            found.append("%s failures %d -> %d" % (route, before.get("failed", 0), stats["failed"]))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--approval", default=APPROVAL)
+    parser.add_argument("--clear", default=CLEAR)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompile p3-contract.py before running")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("checkout", help="dry run one checkout per route")
+    bench = sub.add_parser("bench", help="replay generated orders")
+    bench.add_argument("--orders", type=int, default=1000)
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--baseline", help="fail if costs regressed against this report")
+    bench.add_argument("--tolerance", type=float, default=0.0)
+    for p in sub.choices.values():
+        p.add_argument("--output", help="write the JSON report here")
+        p.add_argument("--catalog-size", type=int, default=CATALOG_SIZE,
+                       help="products in the committed merchant catalog (0 to skip)")
+        p.add_argument("--price-table-size", type=int, default=PRICE_TABLE_SIZE,
+                       help="tuples in the oracle's attested price table (0 to skip)")
+        p.add_argument("--compact", action="store_true",
+                       help="build compact groups instead of the 15 transaction layout")
+    verify = sub.add_parser("checks", help="run groups the contract must approve or reject")
+    verify.add_argument("--output", help="write the JSON report here")
+    verify.add_argument("--compact", action="store_true",
+                        help="build compact groups instead of the 15 transaction layout")
+    args = parser.parse_args(argv)
+
+    approval, clear = load_programs(args.approval, args.clear, args.rebuild)
+    if args.command == "checks":
+        data = checks(approval, clear, args.compact)
+    elif args.command == "checkout":
+        data = checkout(approval, clear, args.catalog_size, args.price_table_size, args.compact)
+    else:
+        data = benchmark(approval, clear, args.orders, args.seed, args.catalog_size,
+                         args.price_table_size, args.compact)
+    text = json.dumps(data, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.command == "bench" and args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(data, json.load(f), args.tolerance)
+        for line in found:
+            print("regression: %s" % line, file=sys.stderr)
+        return 1 if found else 0
+    if args.command == "checks":
+        failed = [name for name, entry in data.items() if not entry["ok"]]
+        for name in failed:
+            print("check failed: %s" % name, file=sys.stderr)
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Client-side fee estimator for order calls that request their own budget.
+
+order_new starts with request_budget(), which makes OpUp inner app calls paid
+from the group's fee credit until the opcode budget covers the branch's entry
+in budgets.json (written by cost_report.py --budgets).  order_cart requests a
+per item budget before each item and the rest of the cart after them, and
+phygital_preminted_optin does the same per NFT of its batch.  The client
+attaches that many extra minimum fees to the group, plus one for every inner
+transaction of an item, which takes its fee from the same credit before the
+last request.  For these per item routes, whose items may cost less than
+their budget, it is an upper bound:
+
+    python fees.py order_new/false --group-size 3
+    python fees.py order_cart --items 2 --group-size 3
+    python fees.py phygital_preminted_optin --items 8 --group-size 2
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUDGETS = os.path.join(HERE, "budgets.json")
+
+MIN_TXN_FEE = 1000
+# routes that request a budget per item (cart line item, pre-minted NFT)
+PER_ITEM_ROUTES = ("order_cart", "phygital_preminted_optin")
+# what p3-contract.py asks for when budgets.json has no entry for a branch
+FALLBACK_BUDGET = 10000
+
+
+def load_budgets(path=BUDGETS):
+    with open(path) as f:
+        return json.load(f)
+
+
+def budget_requests(budgets, route, items=0):
+    """the opcode budgets a route requests, in the order it requests them"""
+    entry = budgets["routes"].get(route, {})
+    budget = entry.get("budget", FALLBACK_BUDGET)
+    if route in PER_ITEM_ROUTES:
+        return [entry.get("per_item", FALLBACK_BUDGET)] * items + [budget]
+    return [budget]
+
+
+def required_budget(budgets, route, items=0):
+    """the opcode budget a route uses at most"""
+    return sum(budget_requests(budgets, route, items))
+
+
+def opup_calls(budgets, route, app_calls=1, items=0, spent=0):
+    """inner app calls request_budget makes for a route
+
+    app_calls is the number of app calls in the outer group and spent the
+    budget earlier calls of the group use up before the order call runs.
+    Every request is assumed to be used up in full before the next one.
+    """
+    opup = budgets["opup"]
+    per_call = budgets["app_call_budget"]
+    available = (per_call * app_calls - spent
+                 - budgets["routes"].get(route, {}).get("entry", 0))
+    calls = 0
+    for budget in budget_requests(budgets, route, items):
+        available -= opup["entry"]
+        needed = budget + opup["buffer"]
+        if available < needed:
+            more = math.ceil((needed - available) / (per_call - opup["iteration"]))
+            calls += more
+            available += more * (per_call - opup["iteration"])
+        available -= budget
+    return calls
+
+
+def credit_txns(budgets, route, app_calls=1, items=0, spent=0):
+    """inner transactions of a route that take their fee from the group's credit"""
+    calls = opup_calls(budgets, route, app_calls, items, spent)
+    if route in PER_ITEM_ROUTES and calls:
+        # the items mint before the last request
+        calls += budgets["routes"].get(route, {}).get("inner_txns_per_item", 1) * items
+    return calls
+
+
+def group_fee(budgets, route, group_size, app_calls=1, items=0, spent=0,
+              min_fee=MIN_TXN_FEE):
+    """total fee to attach to a checkout group so every OpUp call is covered"""
+    return (group_size + credit_txns(budgets, route, app_calls, items, spent)) * min_fee
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("route", help="order_new/<collection_type>, order_cart or "
+                                      "phygital_preminted_optin")
+    parser.add_argument("--budgets", default=BUDGETS)
+    parser.add_argument("--group-size", type=int, default=3,
+                        help="transactions in the group, payments included")
+    parser.add_argument("--app-calls", type=int, default=1,
+                        help="app calls in the group, the order call included")
+    parser.add_argument("--items", type=int, default=0,
+                        help="line items of an order_cart, NFTs of a pre-mint batch")
+    args = parser.parse_args(argv)
+
+    budgets = load_budgets(args.budgets)
+    calls = opup_calls(budgets, args.route, args.app_calls, args.items)
+    print(json.dumps({
+        "route": args.route,
+        "required_budget": required_budget(budgets, args.route, args.items),
+        "opup_calls": calls,
+        "fee": group_fee(budgets, args.route, args.group_size, args.app_calls, args.items),
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,462 @@
+"""Streaming indexer for the p3 app's orders, collections, mints and reviews.
+
+Reads blocks from local fixtures that stand in for algod, as one msgpack
+object per block (.msgpack) or one JSON object per line (.jsonl, bytes base64
+encoded), in algod's block encoding:
+
+    {"rnd": round, "txns": [{"txn": {"type": "appl", "snd": ..., "apid": ...,
+                                     "apaa": [...], "apas": [...], "note": ...,
+                                     "grp": ...},
+                             "caid": created asset, "dt": {"itx": [inner txns]}}]}
+
+and decodes the calls to one app: order_new and order_cart orders with the
+merchant payment of their group, collection_init, the NFTs minted by orders
+and pre-mints, phygital withdrawals and order_review reviews.  The rows go
+to SQLite tables indexed by merchant and collection.
+
+Blocks stream through an asyncio pipeline: a reader thread decodes batches of
+blocks into a bounded queue and the writer commits each batch's rows together
+with a checkpoint (last round, file offset), so memory stays bounded by the
+queue and an interrupted backfill resumes where its last commit ended:
+
+    python indexer.py fixture blocks.msgpack --app-id 1001 --blocks 10000
+    python indexer.py ingest blocks.msgpack --app-id 1001 --db index.sqlite
+    python indexer.py query --db index.sqlite orders <merchant address hex>
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import msgpack
+
+import catalog
+import client
+import teal
+
+
+# order_new args; the merchant payment is Gtxn[9] unless arg 12 declares a layout
+ORDER_MERCHANT_PUBKEY = 1
+ORDER_PRODUCT_ID = 2
+ORDER_PRICE = 3
+ORDER_MERCHANT = 9
+ORDER_COLLECTION_TYPE = 10
+ORDER_COLLECTION_NAME = 11
+ORDER_LAYOUT = 12
+LEGACY_MERCHANT_PAYMENT = 9
+# order_cart args, as CartLayout in p3-contract.py
+CART_MERCHANT_PUBKEY = 1
+CART_MERCHANT = 2
+CART_LAYOUT = 6
+CART_FIRST_ITEM = 7
+
+# fields of algod's block encoding that hold bytes, base64 encoded in JSON
+BYTES_FIELDS = {"snd", "rcv", "arcv", "note", "grp", "apaa", "an", "un", "au", "am"}
+
+BATCH_BLOCKS = 1000
+QUEUE_BATCHES = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    round INTEGER, route TEXT, buyer BLOB, merchant BLOB, merchant_pubkey BLOB,
+    product_id BLOB, price BLOB, collection_type BLOB, collection_name BLOB,
+    asset INTEGER, amount INTEGER);
+CREATE INDEX IF NOT EXISTS orders_merchant ON orders (merchant, round);
+CREATE TABLE IF NOT EXISTS collections (
+    round INTEGER, box BLOB, merchant BLOB, merchant_pubkey BLOB, name BLOB,
+    collection_type BLOB, max_supply INTEGER, requirement_type BLOB);
+CREATE INDEX IF NOT EXISTS collections_merchant ON collections (merchant, name);
+CREATE TABLE IF NOT EXISTS mints (
+    round INTEGER, route TEXT, merchant BLOB, collection_name BLOB, asset INTEGER,
+    asset_name BLOB);
+CREATE INDEX IF NOT EXISTS mints_collection ON mints (merchant, collection_name);
+CREATE TABLE IF NOT EXISTS withdrawals (
+    round INTEGER, route TEXT, receiver BLOB, asset INTEGER);
+CREATE INDEX IF NOT EXISTS withdrawals_asset ON withdrawals (asset);
+CREATE TABLE IF NOT EXISTS reviews (
+    round INTEGER, reviewer BLOB, merchant_id BLOB, store BLOB, stars INTEGER, text BLOB);
+CREATE INDEX IF NOT EXISTS reviews_merchant ON reviews (merchant_id, store);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    source TEXT PRIMARY KEY, round INTEGER, offset INTEGER);
+"""
+
+COLUMNS = {
+    "orders": 11,
+    "collections": 8,
+    "mints": 6,
+    "withdrawals": 4,
+    "reviews": 6,
+}
+
+
+def _from_json(value, key=None):
+    if isinstance(value, dict):
+        return {k: _from_json(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_from_json(v, key) for v in value]
+    if key in BYTES_FIELDS and isinstance(value, str):
+        return base64.b64decode(value)
+    return value
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return {k: _to_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_json(v) for v in value]
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    return value
+
+
+def iter_blocks(path, offset=0):
+    """(block, offset after it) of every block in a fixture, from a byte offset"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        if path.endswith(".jsonl"):
+            for line in iter(f.readline, b""):
+                if line.strip():
+                    yield _from_json(json.loads(line)), f.tell()
+        else:
+            unpacker = msgpack.Unpacker(f, raw=False, strict_map_key=False)
+            for block in unpacker:
+                yield block, offset + unpacker.tell()
+
+
+def write_blocks(path, blocks):
+    """write blocks as a fixture, msgpack or JSON lines by the file extension"""
+    with open(path, "wb") as f:
+        for block in blocks:
+            if path.endswith(".jsonl"):
+                f.write(json.dumps(_to_json(block)).encode() + b"\n")
+            else:
+                f.write(msgpack.packb(block, use_bin_type=True))
+
+
+def _take(reader, n):
+    chunk = []
+    for item in reader:
+        chunk.append(item)
+        if len(chunk) == n:
+            break
+    return chunk
+
+
+async def stream_blocks(path, offset=0, batch=BATCH_BLOCKS):
+    """async generator of (blocks, offset after them), decoded off the event loop"""
+    reader = iter_blocks(path, offset)
+    while True:
+        chunk = await asyncio.to_thread(_take, reader, batch)
+        if not chunk:
+            return
+        yield [block for block, _ in chunk], chunk[-1][1]
+
+
+def _arg(args, index):
+    return args[index] if index < len(args) else b""
+
+
+def _payment(group, call_index, layout_arg, legacy_index):
+    """(asset, amount) of the merchant payment an order call's group carries"""
+    if layout_arg:
+        index = call_index + layout_arg[0]
+    else:
+        index = legacy_index
+    if index >= len(group):
+        return 0, 0
+    payment = group[index]["txn"]
+    if payment.get("type") == "axfer":
+        return payment.get("xaid", 0), payment.get("aamt", 0)
+    return 0, payment.get("amt", 0)
+
+
+def _cart_items(args):
+    """(product_id, price, collection_type, collection_name) of each cart line item"""
+    for item in args[CART_FIRST_ITEM:]:
+        yield catalog.parse_cart_item(item)[1:5]
+
+
+def _mints(rnd, route, merchant, stib):
+    for inner in stib.get("dt", {}).get("itx", []):
+        txn = inner["txn"]
+        if txn.get("type") == "acfg" and not txn.get("caid") and inner.get("caid"):
+            name = txn.get("apar", {}).get("an", b"")
+            yield ("mints", (rnd, route, merchant, name.rsplit(b" #", 1)[0],
+                             inner["caid"], name))
+
+
+def decode_call(rnd, group, position, app_id):
+    """(table, row) of everything one top-level app call in a group is indexed under"""
+    stib = group[position]
+    txn = stib["txn"]
+    if txn.get("type") != "appl" or txn.get("apid") != app_id or not txn.get("apaa"):
+        return
+    args = txn["apaa"]
+    route = client.SELECTORS.get(args[0])
+    sender = txn.get("snd", b"")
+    if route == "order_new":
+        merchant = _arg(args, ORDER_MERCHANT)
+        asset, amount = _payment(group, position, _arg(args, ORDER_LAYOUT),
+                                 LEGACY_MERCHANT_PAYMENT)
+        yield ("orders", (rnd, route, sender, merchant, _arg(args, ORDER_MERCHANT_PUBKEY),
+                          _arg(args, ORDER_PRODUCT_ID), _arg(args, ORDER_PRICE),
+                          _arg(args, ORDER_COLLECTION_TYPE), _arg(args, ORDER_COLLECTION_NAME),
+                          asset, amount))
+        yield from _mints(rnd, route, merchant, stib)
+    elif route == "order_cart":
+        merchant = _arg(args, CART_MERCHANT)
+        asset, amount = _payment(group, position, _arg(args, CART_LAYOUT),
+                                 LEGACY_MERCHANT_PAYMENT)
+        # the group's payment covers the whole cart; it is kept on the first item
+        for n, (product_id, price, collection_type, name) in enumerate(_cart_items(args)):
+            yield ("orders", (rnd, route, sender, merchant, _arg(args, CART_MERCHANT_PUBKEY),
+                              product_id, price, collection_type, name,
+                              asset, amount if n == 0 else 0))
+        yield from _mints(rnd, route, merchant, stib)
+    elif route == "collection_init":
+        name, pubkey, collection_type = args[1], args[2], _arg(args, 9)
+        box = client.collection_box(name, pubkey, sender, collection_type)
+        yield ("collections", (rnd, box, sender, pubkey, name, collection_type,
+                               int.from_bytes(args[3], "big"), _arg(args, 7)))
+    elif route == "phygital_preminted_optin":
+        yield from _mints(rnd, route, sender, stib)
+    elif route in ("phygital_product_widthdraw", "phygital_preminted_withdraw_owner"):
+        assets = txn.get("apas") or [0]
+        yield ("withdrawals", (rnd, route, sender, assets[0]))
+    elif route == "order_review":
+        # the app checks the group's first note is review_customer_order_<merchant>
+        yield ("reviews", (rnd, sender, args[1], args[2], len(_arg(args, 4)), _arg(args, 3)))
+
+
+def decode_block(block, app_id):
+    """(table, row) of every call to app_id in a block, in block order"""
+    rnd = block.get("rnd", 0)
+    txns = block.get("txns", [])
+    start = 0
+    while start < len(txns):
+        # groups are contiguous runs of the same group ID
+        grp = txns[start]["txn"].get("grp")
+        end = start + 1
+        while grp and end < len(txns) and txns[end]["txn"].get("grp") == grp:
+            end += 1
+        group = txns[start:end]
+        for position in range(len(group)):
+            yield from decode_call(rnd, group, position, app_id)
+        start = end
+
+
+class Index:
+    """SQLite tables of one app's decoded calls, with per source checkpoints"""
+
+    def __init__(self, path=":memory:"):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def checkpoint(self, source):
+        """(round, offset) the last commit for source ended at"""
+        row = self.db.execute("SELECT round, offset FROM checkpoints WHERE source = ?",
+                              (source,)).fetchone()
+        return row or (0, 0)
+
+    def write(self, rows, source, rnd, offset):
+        """commit rows and the checkpoint after them in one transaction"""
+        tables = {}
+        for table, row in rows:
+            tables.setdefault(table, []).append(row)
+        with self.db:
+            for table, values in tables.items():
+                self.db.executemany("INSERT INTO %s VALUES (%s)" % (
+                    table, ", ".join("?" * COLUMNS[table])), values)
+            self.db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                            (source, rnd, offset))
+
+    def _rows(self, query, params):
+        cursor = self.db.execute(query, params)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def orders(self, merchant, limit=100):
+        """the latest orders paid to a merchant address"""
+        return self._rows("SELECT * FROM orders WHERE merchant = ? ORDER BY round DESC LIMIT ?",
+                          (merchant, limit))
+
+    def collections(self, merchant):
+        return self._rows("SELECT * FROM collections WHERE merchant = ? ORDER BY round",
+                          (merchant,))
+
+    def mints(self, merchant, collection_name):
+        """NFTs minted for a merchant's collection, on order or pre-minted"""
+        return self._rows("SELECT * FROM mints WHERE merchant = ? AND collection_name = ? "
+                          "ORDER BY round, asset", (merchant, collection_name))
+
+    def withdrawals(self, asset):
+        return self._rows("SELECT * FROM withdrawals WHERE asset = ?", (asset,))
+
+    def reviews(self, merchant_id, store, limit=100):
+        return self._rows("SELECT * FROM reviews WHERE merchant_id = ? AND store = ? "
+                          "ORDER BY round DESC LIMIT ?", (merchant_id, store, limit))
+
+    def rating(self, merchant_id, store):
+        """review count, star sum and reviews per star count, like the rating box"""
+        histogram = [0] * 6
+        for stars, n in self.db.execute(
+                "SELECT stars, COUNT(*) FROM reviews WHERE merchant_id = ? AND store = ? "
+                "GROUP BY stars", (merchant_id, store)):
+            histogram[stars] = n
+        return {"count": sum(histogram),
+                "star_sum": sum(stars * n for stars, n in enumerate(histogram)),
+                "histogram": histogram}
+
+
+def _decode_batch(blocks, app_id, after):
+    rows = []
+    for block in blocks:
+        if block.get("rnd", 0) > after:
+            rows.extend(decode_block(block, app_id))
+    return rows
+
+
+async def ingest(index, path, app_id, batch=BATCH_BLOCKS, queue_batches=QUEUE_BATCHES):
+    """index the calls to app_id in a fixture, resuming from its checkpoint"""
+    source = os.path.abspath(path)
+    after, offset = index.checkpoint(source)
+    queue = asyncio.Queue(queue_batches)
+    stats = {"blocks": 0, "rows": 0, "resumed_at": after}
+
+    async def produce():
+        try:
+            async for blocks, end in stream_blocks(path, offset, batch):
+                await queue.put((blocks, end))
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    while (item := await queue.get()) is not None:
+        blocks, end = item
+        rows = await asyncio.to_thread(_decode_batch, blocks, app_id, after)
+        last = max(after, blocks[-1].get("rnd", 0))
+        await asyncio.to_thread(index.write, rows, source, last, end)
+        stats["blocks"] += len(blocks)
+        stats["rows"] += len(rows)
+    await producer
+    return stats
+
+
+def synthetic_blocks(app_id, blocks, txns_per_block=1000, seed=0, first_round=1):
+    """generated blocks of compact checkouts, collections and reviews to app_id"""
+    rng = random.Random(seed)
+    merchants = [hashlib.sha256(b"merchant:%d" % n).digest() for n in range(64)]
+    buyers = [hashlib.sha256(b"buyer:%d" % n).digest() for n in range(1024)]
+    pubkey = hashlib.sha256(b"merchant key").digest()
+    next_asset = 10 ** 6
+    for rnd in range(first_round, first_round + blocks):
+        txns = []
+        while len(txns) < txns_per_block:
+            merchant = rng.choice(merchants)
+            buyer = rng.choice(buyers)
+            grp = rng.randbytes(32)
+            kind = rng.random()
+            if kind < 0.8:
+                collection_type = rng.choice([b"phygital", b"tokengate", b"false"])
+                name = b"" if collection_type == b"false" else b"drop %d" % (merchant[0] % 4)
+                args = [teal.method_selector("order_new"), pubkey, b"sku-%d" % rng.randrange(10 ** 5),
+                        b"%d.99" % rng.randrange(100), bytes(64), merchant, catalog.itob(rnd),
+                        bytes(64), bytes(64), merchant, collection_type, name, b"\x01\x02"]
+                call = {"txn": {"type": "appl", "snd": buyer, "apid": app_id, "apaa": args,
+                                "grp": grp}}
+                if collection_type == b"phygital":
+                    next_asset += 1
+                    call["dt"] = {"itx": [{"txn": {"type": "acfg", "apar": {
+                        "an": name + b" #%d" % next_asset}}, "caid": next_asset}]}
+                amount = rng.randrange(10 ** 4, 10 ** 8)
+                txns += [call,
+                         {"txn": {"type": "pay", "snd": buyer, "rcv": merchant, "amt": amount,
+                                  "grp": grp}},
+                         {"txn": {"type": "pay", "snd": buyer, "amt": amount // 20,
+                                  "grp": grp}}]
+            elif kind < 0.99:
+                stars = rng.randrange(6)
+                note = b"review_customer_order_" + pubkey + merchant
+                txns.append({"txn": {"type": "appl", "snd": buyer, "apid": app_id,
+                                     "note": note, "apaa": [
+                                         teal.method_selector("order_review"), pubkey, merchant,
+                                         b"review", b"*" * stars]}})
+            else:
+                txns.append({"txn": {"type": "appl", "snd": merchant, "apid": app_id, "apaa": [
+                    teal.method_selector("collection_init"), b"drop %d" % (merchant[0] % 4),
+                    pubkey, catalog.itob(0), catalog.itob(0), catalog.itob(2 ** 40),
+                    b"ipfs://drop", b"NFT Ownership", catalog.itob(1), b"phygital"]}})
+        yield {"rnd": rnd, "txns": txns}
+
+
+def _printable(value):
+    if isinstance(value, bytes):
+        try:
+            text = value.decode()
+            if text.isprintable():
+                return text
+        except UnicodeDecodeError:
+            pass
+        return value.hex()
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    fixture = sub.add_parser("fixture", help="write generated blocks")
+    fixture.add_argument("path", help=".msgpack or .jsonl")
+    fixture.add_argument("--app-id", type=int, required=True)
+    fixture.add_argument("--blocks", type=int, default=1000)
+    fixture.add_argument("--txns-per-block", type=int, default=1000)
+    fixture.add_argument("--seed", type=int, default=0)
+    ingest_parser = sub.add_parser("ingest", help="index a fixture, resuming from its checkpoint")
+    ingest_parser.add_argument("path", help=".msgpack or .jsonl")
+    ingest_parser.add_argument("--app-id", type=int, required=True)
+    ingest_parser.add_argument("--db", required=True)
+    ingest_parser.add_argument("--batch", type=int, default=BATCH_BLOCKS,
+                               help="blocks per commit")
+    query = sub.add_parser("query", help="print indexed rows as JSON")
+    query.add_argument("--db", required=True)
+    query.add_argument("table", choices=["orders", "collections", "mints", "reviews", "rating"])
+    query.add_argument("keys", nargs="+",
+                       help="merchant address hex; mints add the collection name, "
+                            "reviews and rating take merchant ID hex and store address hex")
+    args = parser.parse_args(argv)
+
+    if args.command == "fixture":
+        write_blocks(args.path, synthetic_blocks(args.app_id, args.blocks,
+                                                 args.txns_per_block, args.seed))
+        return 0
+    if args.command == "ingest":
+        started = time.perf_counter()
+        stats = asyncio.run(ingest(Index(args.db), args.path, args.app_id, args.batch))
+        stats["seconds"] = round(time.perf_counter() - started, 3)
+        print(json.dumps(stats, indent=2))
+        return 0
+
+    index = Index(args.db)
+    keys = [bytes.fromhex(k) for k in args.keys[:1]] + args.keys[1:]
+    if args.table == "mints":
+        rows = index.mints(keys[0], keys[1].encode())
+    elif args.table in ("reviews", "rating"):
+        rows = getattr(index, args.table)(keys[0], bytes.fromhex(keys[1]))
+    else:
+        rows = getattr(index, args.table)(keys[0])
+    if isinstance(rows, list):
+        rows = [{k: _printable(v) for k, v in row.items()} for row in rows]
+    print(json.dumps(rows, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Decimal encoding of uint64 values for p3-contract.py.
+
+uint64_to_decimal() formats a uint64 as its ASCII decimal string without
+recursion or loops: the value is cut into ten two digit pairs, each pair is
+looked up in a 200 byte table, and the leading zeros are dropped using the
+digit count from bitlen and a table of powers of ten.  Every value, from 0 to
+2**64 - 1, costs the same number of opcodes.
+
+The recursive itoa() costs about 30 opcodes a digit instead, less than
+uint64_to_decimal up to ITOA_DIGITS digits, and most collections never mint
+that many NFTs; decimal() picks whichever is cheaper for the value.
+
+Running the module compares the opcode cost of a mint's two serial number
+fields, encoded twice with the recursive itoa as phygital_mint used to, or once
+with uint64_to_decimal or decimal, on the AVM in avm.py for counters of 1 to
+20 digits:
+
+    python numeric.py
+"""
+
+import argparse
+import json
+import sys
+
+from pyteal import *
+
+
+MAX_DIGITS = 20
+# values below 10**ITOA_DIGITS are cheaper to encode with itoa()
+ITOA_DIGITS = 4
+DIGIT_PAIRS = "".join("%02d" % n for n in range(100)).encode()
+# 10**0 .. 10**19 as 8 byte big endian words
+POWERS_OF_TEN = b"".join((10 ** k).to_bytes(8, "big") for k in range(MAX_DIGITS))
+
+
+def digit_count(n):
+    """number of decimal digits of a uint64 expression, at least 1
+
+    floor(bitlen * log10(2)) is either the digit count or one short of it;
+    comparing with the next power of ten settles which.
+    """
+    estimate = ShiftRight(BitLen(n) * Int(1233), Int(12))
+    return (estimate
+            + (n >= ExtractUint64(Bytes(POWERS_OF_TEN), estimate * Int(8)))
+            + Not(n))
+
+
+def _digit_pair(n, pair):
+    """the two ASCII digits of 10**(2*pair) and 10**(2*pair+1) in n"""
+    if pair:
+        n = n / Int(10 ** (2 * pair))
+    return Extract(Bytes(DIGIT_PAIRS), n % Int(100) * Int(2), Int(2))
+
+
+@Subroutine(TealType.bytes)
+def uint64_to_decimal(n):
+    """uint64_to_decimal converts an integer to the ascii byte string it represents"""
+    digits = ScratchVar(TealType.uint64)
+
+    return Seq(
+        digits.store(digit_count(n)),
+        Extract(
+            Concat(*[_digit_pair(n, pair) for pair in reversed(range(MAX_DIGITS // 2))]),
+            Int(MAX_DIGITS) - digits.load(),
+            digits.load(),
+        ),
+    )
+
+
+@Subroutine(TealType.bytes)
+def _int_to_ascii(arg):
+    return Extract(Bytes("0123456789"), arg, Int(1))
+
+
+@Subroutine(TealType.bytes)
+def itoa(i):
+    """itoa converts an integer to the ascii byte string it represents, one digit per call"""
+    return If(
+        i == Int(0),
+        Bytes("0"),
+        Concat(
+            If(i / Int(10) > Int(0), itoa(i / Int(10)), Bytes("")),
+            _int_to_ascii(i % Int(10)),
+        ),
+    )
+
+
+def decimal(n):
+    """the ascii decimal string of a uint64 expression, with itoa below ITOA_DIGITS digits"""
+    return If(n < Int(10 ** ITOA_DIGITS)).Then(itoa(n)).Else(uint64_to_decimal(n))
+
+
+def _mint_fields_program(encode, reuse):
+    """an approval program logging the unit and asset name suffixes of a mint
+
+    the serial number is Btoi(ApplicationArgs[0]); with reuse it is encoded
+    once for both fields, otherwise once per field as phygital_mint used to.
+    """
+    serial = ScratchVar(TealType.bytes)
+    n = Btoi(Txn.application_args[0])
+    if reuse:
+        fields = [serial.store(encode(n)), Log(Concat(Bytes("PHY"), serial.load())),
+                  Log(Concat(Bytes(" #"), serial.load()))]
+    else:
+        fields = [Log(Concat(Bytes("PHY"), encode(n))), Log(Concat(Bytes(" #"), encode(n)))]
+    return compileTeal(Seq(*fields, Approve()), mode=Mode.Application, version=8)
+
+
+def benchmark(digits=range(1, MAX_DIGITS + 1)):
+    """opcode cost of one mint's serial number fields per encoder and digit count"""
+    import avm
+    import teal
+
+    ledger = avm.Ledger()
+    caller = b"\x01" * 32
+    ledger.fund(caller, 10 ** 9)
+    programs = {
+        "recursive_itoa": _mint_fields_program(itoa, reuse=False),
+        "uint64_to_decimal": _mint_fields_program(uint64_to_decimal, reuse=True),
+        "decimal": _mint_fields_program(decimal, reuse=True),
+    }
+    apps = {name: ledger.create_app(caller, teal.parse(program))
+            for name, program in programs.items()}
+    # two recursive 20 digit encodes need more than one app call's budget
+    padding = ledger.create_app(caller, teal.parse("#pragma version 8\nint 1"))
+
+    rows = []
+    for n in digits:
+        # the largest counter with n digits takes the most work in either encoder
+        value = min(10 ** n - 1, 2 ** 64 - 1)
+        row = {"digits": n, "value": value}
+        for name, app in apps.items():
+            result = avm.run_group(ledger, [avm.app_call(caller, app.id, [value])]
+                                   + [avm.app_call(caller, padding.id)] * 2)
+            if not result.approved:
+                raise RuntimeError("%s failed for %d: %s" % (name, value, result.error))
+            serial = str(value).encode()
+            if result.calls[0].logs != [b"PHY" + serial, b" #" + serial]:
+                raise RuntimeError("%s encoded %d as %r" % (name, value, result.calls[0].logs))
+            row[name] = result.calls[0].cost
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write the JSON rows here instead of stdout")
+    args = parser.parse_args(argv)
+
+    rows = benchmark()
+    out = json.dumps(rows, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
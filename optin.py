@@ -0,0 +1,75 @@
+"""Off-chain planner for the admin_optin_assets route of p3-contract.py.
+
+admin_optin_assets opts the app account in to every foreign asset of the call
+it doesn't hold yet, submitting all of the opt-ins as one inner group.  A call
+carries at most 8 foreign assets and a group at most 16 calls, so a long list
+of payment ASAs is paged across calls.  plan() drops the assets the app
+already holds and duplicates, then cuts the rest into the fewest calls and
+groups; each call pays its own fee plus one per opt-in so the app account
+never pays for its inner transactions:
+
+    python optin.py 31566704 312769 386192725 --held 312769
+    python optin.py --assets-file assets.txt --output plan.json
+"""
+
+import argparse
+import json
+import sys
+
+
+MIN_TXN_FEE = 1000
+# asset holdings raise the app account's minimum balance by this much each
+ASSET_MIN_BALANCE = 100000
+# foreign assets of one application call, the inner group of its opt-ins included
+MAX_CALL_ASSETS = 8
+MAX_GROUP_SIZE = 16
+
+
+def pages(assets, held=(), per_call=MAX_CALL_ASSETS):
+    """the foreign asset arrays of the calls opting in to assets, in order"""
+    held = set(held)
+    todo = [a for a in dict.fromkeys(assets) if a not in held]
+    return [todo[i:i + per_call] for i in range(0, len(todo), per_call)]
+
+
+def plan(assets, held=(), per_call=MAX_CALL_ASSETS, group_size=MAX_GROUP_SIZE,
+         min_fee=MIN_TXN_FEE):
+    """groups of admin_optin_assets calls, with the fee and assets of each call"""
+    calls = [{"assets": page, "fee": (1 + len(page)) * min_fee}
+             for page in pages(assets, held, per_call)]
+    groups = [calls[i:i + group_size] for i in range(0, len(calls), group_size)]
+    opted_in = sum(len(call["assets"]) for call in calls)
+    return {
+        "calls": len(calls),
+        "opt_ins": opted_in,
+        "fees": sum(call["fee"] for call in calls),
+        # what the admin funds the app account with before the first group
+        "min_balance": opted_in * ASSET_MIN_BALANCE,
+        "groups": groups,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("assets", nargs="*", type=int, help="asset IDs to opt in to")
+    parser.add_argument("--assets-file", help="more asset IDs, one per line")
+    parser.add_argument("--held", nargs="*", type=int, default=[],
+                        help="asset IDs the app account already holds")
+    parser.add_argument("--output", help="write the JSON plan here instead of stdout")
+    args = parser.parse_args(argv)
+
+    assets = list(args.assets)
+    if args.assets_file:
+        with open(args.assets_file) as f:
+            assets += [int(line) for line in f if line.strip()]
+    out = json.dumps(plan(assets, args.held), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
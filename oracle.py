@@ -0,0 +1,240 @@
+"""Oracle price-signing service that precomputes the signatures of a round window.
+
+order_new takes oracle data price||asset or "L1"||Itob(total)||Itob(round),
+signed by the oracle key, from any of the last 5 rounds (oracle_round in
+[round - 4, round]).  Instead of signing each checkout on demand, the service
+signs every live (price, asset) pair once per round as the round clock
+ticks, keeps the rounds still inside the window and drops older ones, so a
+quote is a dict lookup.  The total is the price converted at the asset's
+rate, in its base units per 1.00 of price.
+
+Quotes are served in-process (OracleService.quote) or over an asyncio TCP
+server speaking JSON lines; metrics() reports signing throughput and quote
+latency.  RoundClock simulates the chain's rounds, stepped by hand or on a
+timer:
+
+    python oracle.py serve --signing-key <hex seed> --rate 0=500000 --rate 31566704=1000000 \\
+        --prices 19.99 5.00 --round-seconds 2.8 --port 8470
+    python oracle.py bench --pairs 10000 --rounds 10
+"""
+
+import argparse
+import asyncio
+import collections
+import decimal
+import json
+import sys
+import time
+
+import catalog
+import signer
+
+
+# rounds after oracle_round in which order_new still accepts it
+WINDOW = 4
+LATENCY_SAMPLES = 4096
+PORT = 8470
+
+
+class RoundClock:
+    """a simulated round counter that wakes waiters as rounds pass"""
+
+    def __init__(self, start=1, round_seconds=None):
+        self.round = start
+        self.round_seconds = round_seconds
+        self._changed = asyncio.Condition()
+
+    async def advance(self, rounds=1):
+        async with self._changed:
+            self.round += rounds
+            self._changed.notify_all()
+
+    async def wait_past(self, rnd):
+        """wait for a round after rnd and return the current round"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.round > rnd)
+            return self.round
+
+    async def run(self):
+        """advance one round every round_seconds until cancelled"""
+        while True:
+            await asyncio.sleep(self.round_seconds)
+            await self.advance()
+
+
+def price_total(price, rate):
+    """base units of an asset for a price string at rate base units per 1.00"""
+    return int(decimal.Decimal(price.decode()) * rate)
+
+
+class OracleService:
+    """signed oracle data for every (price, asset) pair of the rounds in the window
+
+    changes to rates and prices are signed from the next round on.
+    """
+
+    def __init__(self, seed, clock, rates=None, prices=(), workers=1, window=WINDOW):
+        self.seed = seed
+        self.clock = clock
+        self.window = window
+        self.workers = workers
+        self.rates = dict(rates or {})
+        self.prices = list(dict.fromkeys(prices))
+        # round -> (price, asset) -> (total, oracle data, signature)
+        self.rounds = collections.OrderedDict()
+        self.signed = 0
+        self.signing_seconds = 0.0
+        self.evicted = 0
+        self.hits = 0
+        self.misses = 0
+        self._latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def pairs(self):
+        return [(price, asset) for price in self.prices for asset in self.rates]
+
+    async def precompute(self, rnd):
+        """sign every live pair for rnd, off the event loop, and drop rounds out of the window"""
+        pairs = self.pairs()
+        quotes = []
+        for price, asset in pairs:
+            total = price_total(price, self.rates[asset])
+            quotes.append((total, catalog.price_message(price, asset, total, rnd)))
+        started = time.perf_counter()
+        signatures = await asyncio.to_thread(signer.sign_messages, self.seed,
+                                             [data for _, data in quotes], self.workers)
+        self.signing_seconds += time.perf_counter() - started
+        self.signed += len(signatures)
+        self.rounds[rnd] = {pair: (total, data, signature) for pair, (total, data), signature
+                            in zip(pairs, quotes, signatures)}
+        self.evict(self.clock.round)
+
+    def evict(self, current):
+        """drop the rounds order_new no longer accepts"""
+        for rnd in [r for r in self.rounds if r < current - self.window]:
+            del self.rounds[rnd]
+            self.evicted += 1
+
+    async def run(self):
+        """precompute each round as the clock reaches it until cancelled"""
+        rnd = self.clock.round
+        await self.precompute(rnd)
+        while True:
+            rnd = await self.clock.wait_past(rnd)
+            await self.precompute(rnd)
+
+    def quote(self, price, asset):
+        """(round, total, oracle data, signature) of the newest signed round, None if absent"""
+        started = time.perf_counter_ns()
+        for rnd in reversed(self.rounds):
+            if rnd < self.clock.round - self.window:
+                break
+            entry = self.rounds[rnd].get((price, asset))
+            if entry is not None:
+                self.hits += 1
+                self._latencies.append(time.perf_counter_ns() - started)
+                return (rnd,) + entry
+        self.misses += 1
+        self._latencies.append(time.perf_counter_ns() - started)
+        return None
+
+    def metrics(self):
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, p * len(latencies) // 100)] / 1000, 3)
+
+        return {
+            "round": self.clock.round,
+            "rounds_cached": list(self.rounds),
+            "pairs": len(self.prices) * len(self.rates),
+            "signed": self.signed,
+            "signatures_per_second": round(self.signed / self.signing_seconds, 1)
+            if self.signing_seconds else None,
+            "evicted_rounds": self.evicted,
+            "quotes": self.hits + self.misses,
+            "misses": self.misses,
+            "quote_us_p50": percentile(50),
+            "quote_us_p99": percentile(99),
+        }
+
+    async def handle(self, reader, writer):
+        """JSON lines: {"price": "19.99", "asset": 0} or {"metrics": true} per request"""
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                if request.get("metrics"):
+                    response = self.metrics()
+                else:
+                    found = self.quote(request["price"].encode(), request.get("asset", 0))
+                    response = {"error": "no signed quote"} if found is None else {
+                        "round": found[0], "total": found[1], "oracle_data": found[2].hex(),
+                        "signature": found[3].hex()}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=PORT):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def bench(pairs, rounds, quotes_per_round=10000, workers=1):
+    """precompute rounds of pairs on a hand-stepped clock and time quotes between them"""
+    seed = bytes(32)
+    clock = RoundClock()
+    prices = [("%d.%02d" % (1 + n // 100, n % 100)).encode() for n in range(pairs // 2)]
+    service = OracleService(seed, clock, {0: 500000, 31566704: 1000000}, prices, workers)
+    await service.precompute(clock.round)
+    for _ in range(rounds):
+        await clock.advance()
+        await service.precompute(clock.round)
+        for n in range(quotes_per_round):
+            service.quote(prices[n % len(prices)], 0 if n % 2 else 31566704)
+    return service.metrics()
+
+
+def _rate(text):
+    asset, rate = text.split("=")
+    return int(asset), decimal.Decimal(rate)
+
+
+async def _serve(args):
+    clock = RoundClock(args.start_round, args.round_seconds)
+    service = OracleService(bytes.fromhex(args.signing_key), clock, dict(args.rate),
+                            [p.encode() for p in args.prices], args.workers)
+    server = await service.serve(args.host, args.port)
+    async with server:
+        await asyncio.gather(clock.run(), service.run(), server.serve_forever())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="serve quotes on a simulated round clock")
+    serve.add_argument("--signing-key", required=True, help="hex ed25519 seed of the oracle key")
+    serve.add_argument("--rate", type=_rate, action="append", default=[],
+                       help="asset=base units per 1.00 of price, asset 0 for the L1 token")
+    serve.add_argument("--prices", nargs="+", required=True)
+    serve.add_argument("--start-round", type=int, default=1)
+    serve.add_argument("--round-seconds", type=float, default=2.8)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=PORT)
+    serve.add_argument("--workers", type=int, default=1, help="signing processes")
+    bench_parser = sub.add_parser("bench", help="precompute and quote on a stepped clock")
+    bench_parser.add_argument("--pairs", type=int, default=10000)
+    bench_parser.add_argument("--rounds", type=int, default=10)
+    bench_parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        asyncio.run(_serve(args))
+        return 0
+    print(json.dumps(asyncio.run(bench(args.pairs, args.rounds, workers=args.workers)),
+                     indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,54 +1,302 @@
+import json
+import os
+
 from pyteal import *
 
+import teal
+from numeric import decimal
+
+
+BUDGETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "budgets.json")
+
+
+class CollectionLayout:
+    # byte offsets inside the packed per-collection record box:
+    # minted(8) | max supply(8) | first valid(8) | last valid(8) |
+    # gate type(1) | gate ID(32) | image URL(rest)
+    minted = Int(0)
+    max_supply = Int(8)
+    first_valid = Int(16)
+    last_valid = Int(24)
+    gate_type = Int(32)
+    gate_id = Int(33)
+    image_url = Int(65)
+
+
+class PoolLayout:
+    # pre-minted NFTs of a collection live in the box "pool"||collection box name:
+    # assigned(8) | stocked(8), then a ring of slots: asset ID(8) | Sha256(owner)(32).
+    # The counts only grow; NFT n sits in slot n % slots, its owner zero until an
+    # order assigns it, and a claim zeroes the whole slot so a later batch can reuse it
+    prefix = Bytes("pool")
+    assigned = Int(0)
+    stocked = Int(8)
+    slots = Int(16)
+    slot_size = Int(40)
+    owner = Int(8)
+    # NFTs a single phygital_preminted_optin call mints
+    batch = Int(8)
+
+    @classmethod
+    def slot(cls, index):
+        return cls.slots + index * cls.slot_size
+
+    @classmethod
+    def ring(cls, count, slots):
+        """the slot of the count-th NFT stocked in a pool of slots slots"""
+        return cls.slot(count % slots)
+
+
+class CatalogLayout:
+    # a merchant's committed catalog lives in the box "catalog"||merchant_pubkey:
+    # root(32) | version(8)
+    prefix = Bytes("catalog")
+    root = Int(0)
+    version = Int(32)
+    size = Int(40)
+
+
+class OracleCache:
+    # attested price roots live in a ring of round-keyed boxes,
+    # "oracle"||Itob(round % slots) -> round(8) | root(32), so a slot is
+    # reclaimed by the attestation slots rounds later instead of growing the MBR
+    prefix = Bytes("oracle")
+    slots = Int(8)
+    window = Int(4)
+    round = Int(0)
+    root = Int(8)
+    size = Int(40)
+
+
+class RatingLayout:
+    # a merchant's reviews add up in the box "rating"||Sha256(merchant ID||store address):
+    # count(8) | star sum(8) | reviews per star count, 0 to 5 stars (6 * 8)
+    prefix = Bytes("rating")
+    count = Int(0)
+    star_sum = Int(8)
+    histogram = Int(16)
+    max_stars = Int(5)
+    size = Int(64)
+
+
+class PaymentLayout:
+    # group indices of an order's merchant payment and POS fee payment.  The
+    # legacy checkout group is padded to 15 transactions with them at Gtxn[9]
+    # and Gtxn[14]; a compact group declares their offsets from the order call
+    # in a two byte layout arg instead, e.g. 0x0102 for call | merchant | POS fee
+    legacy_merchant = Int(9)
+    legacy_pos = Int(14)
+    order_new_arg = Int(12)
+    merchant = ScratchVar(TealType.uint64)
+    pos = ScratchVar(TealType.uint64)
+
+
+class OrderPayment:
+    # an order's payment as load_order_payment leaves it, whatever it was paid
+    # in: "L1" or Itob(asset) as the payment type and oracle messages name
+    # it, and the total of the merchant and POS fee payments
+    asset = ScratchVar(TealType.bytes)
+    total = ScratchVar(TealType.uint64)
+
+
+class CartLayout:
+    # order_cart application args; every arg from first_item on is one line item:
+    # gate asset index(1) | product id | price | collection type | collection name
+    # | product signature or catalog proof(rest), the middle four uint16 length prefixed
+    merchant_pubkey = 1
+    merchant_address = 2
+    oracle_round = 3
+    oracle_proof = 4
+    payment_type_signature = 5
+    payment_layout = 6
+    first_item = 7
+    # at most 16 args, or fewer items as budgets.json's order_cart max_items
+    # says fit the arg size and inner transaction limits (Budget.cart_max_items)
+    max_items = 16 - first_item
+
+
+class Budget:
+    # opcode budget each order branch asks for before it runs, as written to
+    # budgets.json by cost_report.py --budgets; without it the flat 10000 the
+    # order path always used to request
+    fallback = 10000
+
+    def __init__(self, path):
+        try:
+            with open(path) as f:
+                self.routes = json.load(f)["routes"]
+        except FileNotFoundError:
+            self.routes = {}
+
+    def order_new(self, collection_type):
+        return Int(self.routes.get("order_new/" + collection_type, {})
+                   .get("budget", self.fallback))
+
+    def order_cart(self):
+        """what a cart needs besides its items"""
+        return Int(self.routes.get("order_cart", {}).get("budget", self.fallback))
+
+    def cart_item(self):
+        return Int(self.routes.get("order_cart", {}).get("per_item", self.fallback))
+
+    def cart_max_items(self):
+        return Int(self.routes.get("order_cart", {}).get("max_items", CartLayout.max_items))
+
+    def catalog_commit(self):
+        return Int(self.routes.get("catalog_commit", {}).get("budget", self.fallback))
+
+    def oracle_attest(self):
+        return Int(self.routes.get("oracle_attest", {}).get("budget", self.fallback))
+
+    def premint(self):
+        """what a pre-mint batch needs besides its NFTs"""
+        return Int(self.routes.get("phygital_preminted_optin", {}).get("budget", self.fallback))
+
+    def premint_nft(self):
+        return Int(self.routes.get("phygital_preminted_optin", {})
+                   .get("per_item", self.fallback))
+
+
+class Schema:
+    # state the app is created with: posFees and oraclePubKey globally, and a
+    # buyer's gate pass locally
+    global_bytes = 2
+    global_ints = 0
+    local_bytes = 1
+    local_ints = 0
+
+
+class BoxCost:
+    # minimum balance a box adds to the app account: a flat part plus one per
+    # byte of its name and value
+    flat = Int(2500)
+    per_byte = Int(400)
+
+
+class GateType:
+    none = Int(0)
+    nft_membership = Int(1)
+    nft_membership_v2 = Int(2)
+    nft_ownership = Int(3)
+    token_ownership = Int(4)
+
+
+class GatePass:
+    # a buyer opted in to the app keeps one gate pass in local state,
+    # "gate" -> collection box name(32) | expiry round(8), written by the last
+    # full tokengate check.  An order sent without a gate asset is checked
+    # against the pass instead, until it expires
+    key = Bytes("gate")
+    collection = Int(0)
+    expiry = Int(32)
+    # rounds a passed check stays valid, about an hour
+    validity = Int(1200)
+
+
+@Subroutine(TealType.none)
+def optin_assets():
+    """opt the app account in to the foreign assets it doesn't hold yet, in one inner group"""
+    i = ScratchVar(TealType.uint64)
+    started = ScratchVar(TealType.uint64)
+    holding = AssetHolding.balance(Global.current_application_address(), Txn.assets[i.load()])
+
+    return Seq([
+        started.store(Int(0)),
+        For(i.store(Int(0)), i.load() < Txn.assets.length(), i.store(i.load() + Int(1))).Do(
+            holding,
+            If(Not(holding.hasValue())).Then(
+                If(started.load()).Then(
+                    InnerTxnBuilder.Next()
+                ).Else(
+                    InnerTxnBuilder.Begin()
+                ),
+                # optin txn
+                InnerTxnBuilder.SetFields({
+                    TxnField.type_enum: TxnType.AssetTransfer,
+                    TxnField.asset_amount: Int(0),
+                    TxnField.xfer_asset: Txn.assets[i.load()],
+                    TxnField.sender: Global.current_application_address(),
+                    TxnField.asset_receiver: Global.current_application_address(),
+                }),
+                started.store(Int(1)),
+            ),
+        ),
+        If(started.load()).Then(InnerTxnBuilder.Submit()),
+    ])
+
 
-class Constants:
-    admin_init = Bytes("admin_init")
-    order_new = Bytes("order_new")
-    order_new_phygital = Bytes("order_new_phygital")
-    order_review = Bytes("order_review")
-    collection_init = Bytes("collection_init")
-    phygital_product_withdraw = Bytes("phygital_product_widthdraw")
-    phygital_preminted_optin = Bytes("phygital_preminted_optin")
-    phygital_preminted_withdraw_owner = Bytes(
-        "phygital_preminted_withdraw_owner")
+@Subroutine(TealType.none)
+def sweep_fees():
+    """send the app account's balance of every foreign asset to Txn.accounts[1] in one inner group
+
+    with a reserve in ApplicationArgs[1], ALGO above the minimum balance plus
+    that reserve goes too.  Holdings stay opted in, NFTs the app minted stay
+    in their pools, and the call's fee pays for the transfers.
+    """
+    treasury = Txn.accounts[1]
+    app_address = Global.current_application_address()
+    i = ScratchVar(TealType.uint64)
+    started = ScratchVar(TealType.uint64)
+    keep = ScratchVar(TealType.uint64)
+    holding = AssetHolding.balance(app_address, Txn.assets[i.load()])
+    creator = AssetParam.creator(Txn.assets[i.load()])
+
+    def next_transfer():
+        return Seq(
+            If(started.load()).Then(
+                InnerTxnBuilder.Next()
+            ).Else(
+                InnerTxnBuilder.Begin()
+            ),
+            started.store(Int(1)),
+        )
+
+    return Seq([
+        started.store(Int(0)),
+        For(i.store(Int(0)), i.load() < Txn.assets.length(), i.store(i.load() + Int(1))).Do(
+            holding,
+            creator,
+            If(And(holding.hasValue(), holding.value() > Int(0),
+                   creator.value() != app_address)).Then(
+                next_transfer(),
+                InnerTxnBuilder.SetFields({
+                    TxnField.type_enum: TxnType.AssetTransfer,
+                    TxnField.xfer_asset: Txn.assets[i.load()],
+                    TxnField.asset_amount: holding.value(),
+                    TxnField.asset_receiver: treasury,
+                    TxnField.fee: Int(0),
+                }),
+            ),
+        ),
+        If(Txn.application_args.length() > Int(1)).Then(
+            keep.store(MinBalance(app_address) + Btoi(Txn.application_args[1])),
+            If(Balance(app_address) > keep.load()).Then(
+                next_transfer(),
+                InnerTxnBuilder.SetFields({
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.amount: Balance(app_address) - keep.load(),
+                    TxnField.receiver: treasury,
+                    TxnField.fee: Int(0),
+                }),
+            ),
+        ),
+        If(started.load()).Then(InnerTxnBuilder.Submit()),
+    ])
 
 
 @Subroutine(TealType.none)
 def init_app():
     pos_fees = Txn.application_args[1]
     oraclePubKey = Txn.application_args[2]
-    targetAssets = Txn.assets.length()
-    i = ScratchVar(TealType.uint64)
-
-    Assert(Txn.sender() == Global.creator_address())
 
     return Seq([
+        Assert(Txn.sender() == Global.creator_address()),
         App.globalPut(Bytes("posFees"), pos_fees),
         App.globalPut(Bytes("oraclePubKey"), oraclePubKey),
-        i.store(Int(0)),
-        While(i.load() < targetAssets).Do(
-            # optin txn
-            InnerTxnBuilder.Begin(),
-            InnerTxnBuilder.SetFields({
-                TxnField.type_enum: TxnType.AssetTransfer,
-                TxnField.asset_amount: Int(0),
-                TxnField.xfer_asset: Txn.assets[i.load()],
-                TxnField.sender: Global.current_application_address(),
-                TxnField.asset_receiver: Global.current_application_address(),
-
-            }),
-            InnerTxnBuilder.Submit(),
-            i.store(i.load() + Int(1))
-        )
+        optin_assets(),
     ])
 
 
-@Subroutine(TealType.bytes)
-def int_to_ascii(arg):
-    """int_to_ascii converts an integer to the ascii byte that represents it"""
-    return Extract(Bytes("0123456789"), arg, Int(1))
-
-
 @Subroutine(TealType.bytes)
 def getAssetCreator():
     """get the creator address of foreign asset[0]"""
@@ -60,19 +308,6 @@ def getAssetCreator():
     )
 
 
-@Subroutine(TealType.bytes)
-def itoa(i):
-    """itoa converts an integer to the ascii byte string it represents"""
-    return If(
-        i == Int(0),
-        Bytes("0"),
-        Concat(
-            If(i / Int(10) > Int(0), itoa(i / Int(10)), Bytes("")),
-            int_to_ascii(i % Int(10)),
-        ),
-    )
-
-
 @ Subroutine(TealType.none)
 def phygital_withdraw():
 
@@ -95,89 +330,250 @@ def phygital_withdraw():
     )
 
 
-@ Subroutine(TealType.none)
-def phygital_mint():
-    collection_name = Txn.application_args[11]
-    collection_type = Txn.application_args[10]
-    merchant_pubkey = Txn.application_args[1]
-    merchant_address_bytes = Txn.application_args[9]
+@ Subroutine(TealType.bytes)
+def collection_box_name(collection_name, merchant_pubkey, merchant_address_bytes, collection_type):
+    """collection_box_name derives the name of a collection's packed record box"""
+    return Sha256(Concat(collection_name, merchant_pubkey, merchant_address_bytes, collection_type))
 
-    baseBox = Sha256(
-        Concat(collection_name, merchant_pubkey, merchant_address_bytes, collection_type))
 
-    collectionMintedAmount = Concat(baseBox, Bytes("A"))
-    collectionMaxSupply = Concat(baseBox, Bytes("B"))
-    collectionFirstValid = Concat(baseBox, Bytes("C"))
-    collectionLastValid = Concat(baseBox, Bytes("D"))
-    collectionImageUrl = Concat(baseBox, Bytes("E"))
+def box_min_balance(name_length, size):
+    return Add(BoxCost.flat, Mul(BoxCost.per_byte, Add(name_length, size)))
 
-    Seq(
-        collection_box_check := App.box_length(collectionMintedAmount),
-        Assert(collection_box_check.hasValue()),
+
+@ Subroutine(TealType.none)
+def pay_for_box(amount):
+    """pay_for_box checks the payment right after the call covers a box it creates"""
+    fees_payment = Gtxn[Txn.group_index() + Int(1)]
+
+    return Seq(
+        Assert(fees_payment.type_enum() == TxnType.Payment),
+        Assert(fees_payment.receiver() == Global.current_application_address()),
+        Assert(fees_payment.amount() >= amount),
     )
 
-    minted = App.box_get(collectionMintedAmount)
-    max_supply = App.box_get(collectionMaxSupply)
-    last_valid = App.box_get(collectionLastValid)
-    first_valid = App.box_get(collectionFirstValid)
-    image_url = App.box_get(collectionImageUrl)
+
+@ Subroutine(TealType.uint64)
+def create_nft(collection_name, image_url, serial_number, metadata_hash, reserve):
+    """create_nft mints one NFT of a collection into the app account and returns its asset ID"""
+    serial = ScratchVar(TealType.bytes)
+
+    return Seq([
+        serial.store(decimal(serial_number)),
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.AssetConfig,
+            TxnField.config_asset_total: Int(1),
+            TxnField.config_asset_decimals: Int(0),
+            TxnField.config_asset_unit_name: Concat(Bytes("PHY"), serial.load()),
+            TxnField.config_asset_name: Concat(collection_name, Bytes(" #"), serial.load()),
+            TxnField.config_asset_url: image_url,
+            TxnField.config_asset_metadata_hash: metadata_hash,
+            TxnField.config_asset_reserve: reserve,
+        }),
+        InnerTxnBuilder.Submit(),
+        InnerTxn.created_asset_id(),
+    ])
+
+
+@ Subroutine(TealType.none)
+def phygital_mint(merchant_pubkey, merchant_address_bytes, collection_type, collection_name):
+
+    collectionBox = ScratchVar(TealType.bytes)
+    header = ScratchVar(TealType.bytes)
+    minted = ScratchVar(TealType.uint64)
+    max_supply = ScratchVar(TealType.uint64)
+    pool = ScratchVar(TealType.bytes)
+    pool_header = ScratchVar(TealType.bytes)
+    assigned = ScratchVar(TealType.uint64)
+    stocked = ScratchVar(TealType.uint64)
+
+    collection_box_check = App.box_length(collectionBox.load())
+    pool_check = App.box_length(pool.load())
+    image_url = App.box_extract(
+        collectionBox.load(), CollectionLayout.image_url,
+        Minus(collection_box_check.value(), CollectionLayout.image_url))
 
     return Seq([
-        minted,
-        max_supply,
-        last_valid,
-        first_valid,
-        image_url,
+        collectionBox.store(collection_box_name(
+            collection_name, merchant_pubkey, merchant_address_bytes, collection_type)),
+        collection_box_check,
+        Assert(collection_box_check.hasValue()),
+        header.store(App.box_extract(collectionBox.load(),
+                                     CollectionLayout.minted, CollectionLayout.gate_type)),
+        minted.store(ExtractUint64(header.load(), CollectionLayout.minted)),
+        max_supply.store(ExtractUint64(header.load(), CollectionLayout.max_supply)),
         # If(
-        #    Global.round() > Btoi(last_valid.value())
+        #    Global.round() > ExtractUint64(header.load(), CollectionLayout.last_valid)
         # ).Then(
         #    Reject()
         # ),
         # If(
-        #    Global.round() < Btoi(first_valid.value())
+        #    Global.round() < ExtractUint64(header.load(), CollectionLayout.first_valid)
         # ).Then(
         #    Reject()
         # ),
-        If(Btoi(max_supply.value()) == Int(000)).Then(
-            # only product tokenization for authenticity
-            InnerTxnBuilder.Begin(),
-            InnerTxnBuilder.SetFields({
-                TxnField.type_enum: TxnType.AssetConfig,
-                TxnField.config_asset_total: Int(1),
-                TxnField.config_asset_decimals: Int(0),
-                TxnField.config_asset_unit_name: Concat(Bytes("PHY"), itoa(Add(Btoi(minted.value())+Int(1)))),
-                TxnField.config_asset_name: Concat(collection_name, Bytes(" #"), itoa(Add(Btoi(minted.value())+Int(1)))),
-                TxnField.config_asset_url: image_url.value(),
-                TxnField.config_asset_metadata_hash: Sha256(Txn.sender()),
-                TxnField.config_asset_reserve: merchant_address_bytes,
-            }),
-            InnerTxnBuilder.Submit(),
-            App.box_put(collectionMintedAmount,
-                        Itob(Btoi(minted.value()) + Int(1))),
-        ).ElseIf(Btoi(minted.value()) < Btoi(max_supply.value())).Then(
-            # create NFT limited edition for the product
-            InnerTxnBuilder.Begin(),
-            InnerTxnBuilder.SetFields({
-                TxnField.type_enum: TxnType.AssetConfig,
-                TxnField.config_asset_total: Int(1),
-                TxnField.config_asset_decimals: Int(0),
-                TxnField.config_asset_unit_name: Concat(Bytes("PHY"), itoa(Add(Btoi(minted.value())+Int(1)))),
-                TxnField.config_asset_name: Concat(collection_name, Bytes(" #"), itoa(Add(Btoi(minted.value())+Int(1)))),
-                TxnField.config_asset_url: image_url.value(),
-                TxnField.config_asset_metadata_hash: Sha256(Txn.sender()),
-                TxnField.config_asset_reserve: merchant_address_bytes,
-            }),
-            InnerTxnBuilder.Submit(),
-
-            App.box_put(collectionMintedAmount,
-                        Itob(Btoi(minted.value()) + Int(1))),
-
+        pool.store(Concat(PoolLayout.prefix, collectionBox.load())),
+        pool_check,
+        assigned.store(Int(0)),
+        stocked.store(Int(0)),
+        If(pool_check.hasValue()).Then(
+            pool_header.store(App.box_extract(pool.load(), PoolLayout.assigned, PoolLayout.slots)),
+            assigned.store(ExtractUint64(pool_header.load(), PoolLayout.assigned)),
+            stocked.store(ExtractUint64(pool_header.load(), PoolLayout.stocked)),
+        ),
+        If(assigned.load() < stocked.load()).Then(
+            # the next pre-minted NFT goes to the buyer, who claims it with
+            # phygital_preminted_withdraw_owner
+            App.box_replace(pool.load(), PoolLayout.ring(
+                assigned.load(), (pool_check.value() - PoolLayout.slots) / PoolLayout.slot_size
+            ) + PoolLayout.owner, Sha256(Txn.sender())),
+            App.box_replace(pool.load(), PoolLayout.assigned, Itob(assigned.load() + Int(1))),
+        # a max supply of 0 only tokenizes the product for authenticity,
+        # otherwise the NFT is a limited edition of the product
+        ).ElseIf(Or(max_supply.load() == Int(0), minted.load() < max_supply.load())).Then(
+            Pop(create_nft(collection_name, image_url, minted.load() + Int(1),
+                           Sha256(Txn.sender()), merchant_address_bytes)),
+            App.box_replace(collectionBox.load(), CollectionLayout.minted,
+                            Itob(minted.load() + Int(1))),
         ).Else(
             Reject()
         )
     ])
 
 
+@ Subroutine(TealType.none)
+def phygital_preminted_optin(nft_budget, batch_budget):
+    """a merchant pre-mints a batch of a collection's NFTs into the app account's pool
+
+    nft_budget is requested before each NFT and batch_budget once after them.
+    """
+    collection_name = Txn.application_args[1]
+    merchant_pubkey = Txn.application_args[2]
+    collection_type = Txn.application_args[3]
+    count = Btoi(Txn.application_args[4])
+    # slots of a new pool; an existing pool keeps the size it was created with
+    capacity = Btoi(Txn.application_args[5])
+
+    collectionBox = ScratchVar(TealType.bytes)
+    header = ScratchVar(TealType.bytes)
+    minted = ScratchVar(TealType.uint64)
+    max_supply = ScratchVar(TealType.uint64)
+    pool = ScratchVar(TealType.bytes)
+    slots = ScratchVar(TealType.uint64)
+    stocked = ScratchVar(TealType.uint64)
+    slot = ScratchVar(TealType.uint64)
+    fees_calculator = ScratchVar(TealType.uint64)
+    i = ScratchVar(TealType.uint64)
+
+    collection_box_check = App.box_length(collectionBox.load())
+    pool_check = App.box_length(pool.load())
+    image_url = App.box_extract(
+        collectionBox.load(), CollectionLayout.image_url,
+        Minus(collection_box_check.value(), CollectionLayout.image_url))
+
+    fees_payment = Gtxn[Txn.group_index() + Int(1)]
+
+    return Seq([
+        # only the merchant account a collection is registered to can stock it
+        collectionBox.store(collection_box_name(
+            collection_name, merchant_pubkey, Txn.sender(), collection_type)),
+        collection_box_check,
+        Assert(collection_box_check.hasValue()),
+        Assert(count > Int(0)),
+        Assert(count <= PoolLayout.batch),
+        header.store(App.box_extract(collectionBox.load(),
+                                     CollectionLayout.minted, CollectionLayout.gate_type)),
+        minted.store(ExtractUint64(header.load(), CollectionLayout.minted)),
+        max_supply.store(ExtractUint64(header.load(), CollectionLayout.max_supply)),
+        Assert(Or(max_supply.load() == Int(0), minted.load() + count <= max_supply.load())),
+
+        # every NFT the app account holds raises its minimum balance, and the
+        # app account pays its creation fee unless the group's credit covers it
+        fees_calculator.store(Mul(Add(Global.min_balance(), Global.min_txn_fee()), count)),
+        pool.store(Concat(PoolLayout.prefix, collectionBox.load())),
+        pool_check,
+        If(pool_check.hasValue()).Then(
+            slots.store((pool_check.value() - PoolLayout.slots) / PoolLayout.slot_size),
+        ).Else(
+            slots.store(capacity),
+            Pop(App.box_create(pool.load(), PoolLayout.slot(slots.load()))),
+            fees_calculator.store(fees_calculator.load() + box_min_balance(
+                Len(pool.load()), PoolLayout.slot(slots.load()))),
+        ),
+        stocked.store(ExtractUint64(
+            App.box_extract(pool.load(), PoolLayout.stocked, Int(8)), Int(0))),
+
+        Assert(fees_payment.type_enum() == TxnType.Payment),
+        Assert(fees_payment.amount() >= fees_calculator.load()),
+        Assert(fees_payment.receiver() == Global.current_application_address()),
+
+        For(i.store(Int(0)), i.load() < count, i.store(i.load() + Int(1))).Do(
+            request_budget(nft_budget),
+            # the ring is full once it comes round to an NFT nobody has claimed yet
+            slot.store(PoolLayout.ring(stocked.load() + i.load(), slots.load())),
+            Assert(ExtractUint64(App.box_extract(pool.load(), slot.load(), Int(8)),
+                                 Int(0)) == Int(0)),
+            # owners live in the pool slots, not in the metadata hash
+            App.box_replace(pool.load(), slot.load(), Itob(
+                create_nft(collection_name, image_url, minted.load() + i.load() + Int(1),
+                           BytesZero(Int(32)), Txn.sender()))),
+        ),
+        request_budget(batch_budget),
+        App.box_replace(pool.load(), PoolLayout.stocked, Itob(stocked.load() + count)),
+        App.box_replace(collectionBox.load(), CollectionLayout.minted,
+                        Itob(minted.load() + count)),
+    ])
+
+
+@ Subroutine(TealType.none)
+def phygital_preminted_withdraw_owner():
+    """the buyer a pre-minted NFT was assigned to claims it, freeing its pool slot"""
+    collection_name = Txn.application_args[1]
+    merchant_pubkey = Txn.application_args[2]
+    merchant_address_bytes = Txn.application_args[3]
+    collection_type = Txn.application_args[4]
+    slot = Btoi(Txn.application_args[5])
+
+    pool = ScratchVar(TealType.bytes)
+    record = ScratchVar(TealType.bytes)
+    assetName = AssetParam.name(Txn.assets[0])
+
+    return Seq([
+        pool.store(Concat(PoolLayout.prefix, collection_box_name(
+            collection_name, merchant_pubkey, merchant_address_bytes, collection_type))),
+        record.store(App.box_extract(pool.load(), PoolLayout.slot(slot), PoolLayout.slot_size)),
+        Assert(ExtractUint64(record.load(), Int(0)) == Txn.assets[0]),
+        Assert(Extract(record.load(), PoolLayout.owner, Int(32)) == Sha256(Txn.sender())),
+        App.box_replace(pool.load(), PoolLayout.slot(slot), BytesZero(PoolLayout.slot_size)),
+        assetName,
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.AssetTransfer,
+            TxnField.xfer_asset: Txn.assets[0],
+            TxnField.asset_receiver: Txn.sender(),
+            TxnField.asset_amount: Int(1),
+            TxnField.note: Concat(Bytes("Withdraw:"), assetName.value())
+        }),
+        InnerTxnBuilder.Submit(),
+    ])
+
+
+@ Subroutine(TealType.uint64)
+def gate_type_code(requirement_type):
+    """gate_type_code maps a collection requirement type to its one byte code"""
+    return If(requirement_type == Bytes("NFT Membership")).Then(
+        GateType.nft_membership
+    ).ElseIf(requirement_type == Bytes("NFT Membership V2")).Then(
+        GateType.nft_membership_v2
+    ).ElseIf(requirement_type == Bytes("NFT Ownership")).Then(
+        GateType.nft_ownership
+    ).ElseIf(requirement_type == Bytes("Token Ownership")).Then(
+        GateType.token_ownership
+    ).Else(
+        GateType.none
+    )
+
+
 @ Subroutine(TealType.none)
 def collection_init():
     collection_name = Txn.application_args[1]
@@ -192,83 +588,330 @@ def collection_init():
     collection_type = Txn.application_args[9]
 
     fees_calculator = ScratchVar(TealType.uint64)
+    gate_type = ScratchVar(TealType.uint64)
+    gate_id = ScratchVar(TealType.bytes)
+    collectionBox = ScratchVar(TealType.bytes)
+    collectionRecord = ScratchVar(TealType.bytes)
+    i = ScratchVar(TealType.uint64)
 
-    baseBox = Sha256(Concat(collection_name, merchant_pubkey,
-                     Txn.sender(), collection_type))
-
-    fees_payment = Gtxn[1]
-
-    collectionMintedAmount = Concat(baseBox, Bytes("A"))
-    collectionMaxSupply = Concat(baseBox, Bytes("B"))
-    collectionFirstValid = Concat(baseBox, Bytes("C"))
-    collectionLastValid = Concat(baseBox, Bytes("D"))
-    collectionImageUrl = Concat(baseBox, Bytes("E"))
-    collectionrequirementTypeBoxName = Concat(baseBox, Bytes("F"))
-    collectionrequirementIDBoxName = Concat(baseBox, Bytes("G"))
+    # each call is paid by the transaction right after it
+    fees_payment = Gtxn[Txn.group_index() + Int(1)]
 
     return Seq([
-        fees_calculator.store(Mul(Int(2500), Int(7))),
-        fees_calculator.store(Mul(Int(400), Len(Concat(
-            collectionMintedAmount, collectionMaxSupply, collectionLastValid, collectionImageUrl)))),
+        # any other call to the app in the group is a collection_init with its
+        # own payment, so no other route can count this payment as well
+        For(i.store(Int(0)), i.load() < Global.group_size(), i.store(i.load() + Int(1))).Do(
+            If(And(Gtxn[i.load()].type_enum() == TxnType.ApplicationCall,
+                   Gtxn[i.load()].application_id() == Global.current_application_id())).Then(
+                Assert(Gtxn[i.load()].application_args[0] == Txn.application_args[0])
+            )
+        ),
+        collectionBox.store(collection_box_name(
+            collection_name, merchant_pubkey, Txn.sender(), collection_type)),
+        gate_type.store(gate_type_code(collection_requirement_type)),
+        If(gate_type.load() == GateType.none).Then(
+            gate_id.store(BytesZero(Int(32)))
+        ).ElseIf(gate_type.load() >= GateType.nft_ownership).Then(
+            # ownership gates hold an asset ID, left aligned in the 32 byte field
+            gate_id.store(Concat(Itob(Btoi(collection_requirement_ID)), BytesZero(Int(24))))
+        ).Else(
+            Assert(Len(collection_requirement_ID) == Int(32)),
+            gate_id.store(collection_requirement_ID)
+        ),
+        collectionRecord.store(Concat(
+            Itob(Int(0)),
+            Itob(Btoi(collection_max_supply)),
+            Itob(Btoi(collection_first_valid)),
+            Itob(Btoi(collection_last_valid)),
+            Extract(Itob(gate_type.load()), Int(7), Int(1)),
+            gate_id.load(),
+            collection_image_url,
+        )),
+
+        # only a new record box raises the minimum balance; initialising a
+        # collection again rewrites its record in place
+        fees_calculator.store(Int(0)),
+        If(App.box_create(collectionBox.load(), Len(collectionRecord.load()))).Then(
+            fees_calculator.store(box_min_balance(
+                Len(collectionBox.load()), Len(collectionRecord.load()))),
+        ),
 
-        Assert(fees_payment.amount() >= fees_calculator.load()),
+        Assert(fees_payment.type_enum() == TxnType.Payment),
         Assert(fees_payment.receiver() == Global.current_application_address()),
+        Assert(fees_payment.amount() >= fees_calculator.load()),
+        If(fees_payment.amount() > fees_calculator.load()).Then(
+            # refund the overpayment; the call's fee covers the refund, not the app
+            InnerTxnBuilder.Begin(),
+            InnerTxnBuilder.SetFields({
+                TxnField.type_enum: TxnType.Payment,
+                TxnField.receiver: fees_payment.sender(),
+                TxnField.amount: fees_payment.amount() - fees_calculator.load(),
+                TxnField.fee: Int(0),
+            }),
+            InnerTxnBuilder.Submit(),
+        ),
 
-        App.box_put(collectionMintedAmount, Itob(Int(0))),
-        App.box_put(collectionMaxSupply, collection_max_supply),
-        App.box_put(collectionFirstValid, collection_first_valid),
-        App.box_put(collectionLastValid, collection_last_valid),
-        App.box_put(collectionImageUrl, collection_image_url),
-        App.box_put(collectionrequirementTypeBoxName,
-                    collection_requirement_type),
-        App.box_put(collectionrequirementIDBoxName, collection_requirement_ID),
+        App.box_put(collectionBox.load(), collectionRecord.load()),
     ])
 
 
 @ Subroutine(TealType.none)
-def verify_tokengate():
-    collection_name = Txn.application_args[11]
-    collection_type = Txn.application_args[10]
-    merchant_pubkey = Txn.application_args[1]
-    merchant_address_bytes = Txn.application_args[9]
-
-    gateKey = Txn.assets[0]
-
-    baseBox = Sha256(
-        Concat(collection_name, merchant_pubkey, merchant_address_bytes, collection_type))
+def verify_tokengate(merchant_pubkey, merchant_address_bytes, collection_type, collection_name,
+                     gateKey):
 
-    requirementTypeBoxName = Concat(baseBox, Bytes("F"))
-    requirementIDBoxName = Concat(baseBox, Bytes("G"))
-
-    requirementType = App.box_get(requirementTypeBoxName)
-    requirementID = App.box_get(requirementIDBoxName)
+    collectionBox = ScratchVar(TealType.bytes)
+    gate = ScratchVar(TealType.bytes)
+    requirementType = GetByte(gate.load(), Int(0))
+    requirementID = Extract(gate.load(), Int(1), Int(32))
 
     customerHolding = AssetHolding.balance(Txn.sender(), gateKey)
     assetCreator = AssetParam.creator(gateKey)
     assetReserve = AssetParam.reserve(gateKey)
 
     return Seq([
-        requirementType,
-        requirementID,
+        collectionBox.store(collection_box_name(collection_name, merchant_pubkey,
+                                                merchant_address_bytes, collection_type)),
+        gate.store(App.box_extract(collectionBox.load(), CollectionLayout.gate_type, Int(33))),
         customerHolding,
         assetCreator,
         assetReserve,
-        If(requirementType.value() == Bytes("NFT Membership")).Then(
-            Assert(assetCreator.value() == requirementID.value()),
+        If(requirementType == GateType.nft_membership).Then(
+            Assert(assetCreator.value() == requirementID),
             Assert(customerHolding.value() == Int(1))
-        ).ElseIf(requirementType.value() == Bytes("NFT Membership V2")).Then(
-            Assert(assetReserve.value() == requirementID.value()),
+        ).ElseIf(requirementType == GateType.nft_membership_v2).Then(
+            Assert(assetReserve.value() == requirementID),
             Assert(customerHolding.value() == Int(1))
-        ).ElseIf(requirementType.value() == Bytes("NFT Ownership")).Then(
-            Assert(gateKey == Btoi(requirementID.value())),
+        ).ElseIf(requirementType == GateType.nft_ownership).Then(
+            Assert(gateKey == ExtractUint64(requirementID, Int(0))),
             Assert(customerHolding.value() == Int(1))
-        ).ElseIf(requirementType.value() == Bytes("Token Ownership")).Then(
-            Assert(gateKey == Btoi(requirementID.value())),
+        ).ElseIf(requirementType == GateType.token_ownership).Then(
+            Assert(gateKey == ExtractUint64(requirementID, Int(0))),
             Assert(customerHolding.value() >= Int(1))
-        )
+        ),
+        # a buyer opted in to the app gets a gate pass for the collection
+        If(App.optedIn(Txn.sender(), Global.current_application_id())).Then(
+            App.localPut(Txn.sender(), GatePass.key, Concat(
+                collectionBox.load(), Itob(Global.round() + GatePass.validity)))
+        ),
     ])
 
 
+@ Subroutine(TealType.none)
+def verify_gate_pass(merchant_pubkey, merchant_address_bytes, collection_type, collection_name):
+    """verify_gate_pass accepts the buyer's unexpired gate pass for a collection in place of a tokengate check"""
+    gate_pass = App.localGetEx(Txn.sender(), Global.current_application_id(), GatePass.key)
+
+    return Seq(
+        gate_pass,
+        Assert(gate_pass.hasValue()),
+        Assert(Extract(gate_pass.value(), GatePass.collection, Int(32)) == collection_box_name(
+            collection_name, merchant_pubkey, merchant_address_bytes, collection_type)),
+        Assert(Global.round() <= ExtractUint64(gate_pass.value(), GatePass.expiry)),
+    )
+
+
+def tokengate_order(merchant_pubkey, merchant_address_bytes, collection_type, collection_name):
+    """an order's tokengate check: against the gate asset it references, or its gate pass without one"""
+    return If(Txn.assets.length() == Int(0)).Then(
+        verify_gate_pass(merchant_pubkey, merchant_address_bytes,
+                         collection_type, collection_name)
+    ).Else(
+        verify_tokengate(merchant_pubkey, merchant_address_bytes,
+                         collection_type, collection_name, Txn.assets[0])
+    )
+
+
+@ Subroutine(TealType.none)
+def request_budget(required):
+    """request_budget tops the opcode budget up to required with OpUp calls paid from the group's fee credit"""
+    return OpUp(OpUpMode.OnCall).ensure_budget(required, OpUpFeeSource.GroupCredit)
+
+
+def order_budget(budget, collection_type):
+    """order_budget is the opcode budget of the order_new branch for a collection type"""
+    return If(collection_type == Bytes("phygital")).Then(
+        budget.order_new("phygital")
+    ).ElseIf(collection_type == Bytes("tokengate")).Then(
+        If(Txn.assets.length() == Int(0)).Then(budget.order_new("tokengate/pass"))
+        .Else(budget.order_new("tokengate"))
+    ).ElseIf(collection_type == Bytes("tokengatephygital")).Then(
+        If(Txn.assets.length() == Int(0)).Then(budget.order_new("tokengatephygital/pass"))
+        .Else(budget.order_new("tokengatephygital"))
+    ).Else(
+        budget.order_new("false")
+    )
+
+
+@ Subroutine(TealType.none)
+def load_payment_layout(layout):
+    """load_payment_layout resolves the group indices of an order's two payments"""
+    return Seq(
+        Assert(Len(layout) == Int(2)),
+        Assert(GetByte(layout, Int(0)) > Int(0)),
+        Assert(GetByte(layout, Int(1)) > Int(0)),
+        Assert(GetByte(layout, Int(0)) != GetByte(layout, Int(1))),
+        PaymentLayout.merchant.store(Txn.group_index() + GetByte(layout, Int(0))),
+        PaymentLayout.pos.store(Txn.group_index() + GetByte(layout, Int(1))),
+    )
+
+
+@ Subroutine(TealType.none)
+def own_payments():
+    """own_payments makes sure no other call of the group can count the order's payments
+
+    payments follow the call that counts them, a box payment right after its
+    call, so the order takes the transactions up to its last payment: none
+    of them may be another call to this app, in particular another order
+    pointing at the same payments.
+    """
+    i = ScratchVar(TealType.uint64)
+    last = ScratchVar(TealType.uint64)
+    call = Gtxn[i.load()]
+
+    return Seq(
+        last.store(If(PaymentLayout.merchant.load() > PaymentLayout.pos.load())
+                   .Then(PaymentLayout.merchant.load()).Else(PaymentLayout.pos.load())),
+        For(i.store(Txn.group_index() + Int(1)), i.load() < last.load(),
+            i.store(i.load() + Int(1))).Do(
+            Assert(Or(call.type_enum() != TxnType.ApplicationCall,
+                      call.application_id() != Global.current_application_id()))
+        ),
+    )
+
+
+@ Subroutine(TealType.bytes)
+def merkle_root(leaf, proof):
+    """merkle_root folds Itob(leaf index)||sibling hashes up to the root they commit to"""
+    node = ScratchVar(TealType.bytes)
+    index = ScratchVar(TealType.uint64)
+    i = ScratchVar(TealType.uint64)
+
+    return Seq(
+        Assert(Len(proof) >= Int(8)),
+        Assert((Len(proof) - Int(8)) % Int(32) == Int(0)),
+        index.store(ExtractUint64(proof, Int(0))),
+        node.store(leaf),
+        For(i.store(Int(8)), i.load() < Len(proof), i.store(i.load() + Int(32))).Do(
+            If(index.load() & Int(1)).Then(
+                node.store(Sha256(Concat(Bytes("base16", "01"),
+                                         Extract(proof, i.load(), Int(32)), node.load())))
+            ).Else(
+                node.store(Sha256(Concat(Bytes("base16", "01"),
+                                         node.load(), Extract(proof, i.load(), Int(32)))))
+            ),
+            index.store(index.load() >> Int(1)),
+        ),
+        # the index must not address leaves beyond the depth of the proof
+        Assert(index.load() == Int(0)),
+        node.load()
+    )
+
+
+@ Subroutine(TealType.none)
+def verify_product(merchant_pubkey, product_data, product_proof):
+    """verify_product checks product data against a merchant signature or committed catalog"""
+    return If(Len(product_proof) == Int(64)).Then(
+        Assert(Ed25519Verify_Bare(product_data, product_proof, merchant_pubkey))
+    ).Else(
+        Assert(merkle_root(Sha256(Concat(Bytes("base16", "00"), product_data)), product_proof)
+               == App.box_extract(Concat(CatalogLayout.prefix, merchant_pubkey),
+                                  CatalogLayout.root, Int(32)))
+    )
+
+
+@ Subroutine(TealType.none)
+def catalog_commit():
+    merchant_pubkey = Txn.application_args[1]
+    catalog_root = Txn.application_args[2]
+    catalog_version = Txn.application_args[3]
+    catalog_signature = Txn.application_args[4]
+
+    name = ScratchVar(TealType.bytes)
+    catalog = App.box_get(name.load())
+
+    return Seq(
+        Assert(Len(merchant_pubkey) == Int(32)),
+        Assert(Len(catalog_root) == Int(32)),
+        Assert(Len(catalog_version) == Int(8)),
+        Assert(Ed25519Verify_Bare(Concat(Bytes("catalog"), catalog_root, catalog_version),
+                                  catalog_signature, merchant_pubkey)),
+        name.store(Concat(CatalogLayout.prefix, merchant_pubkey)),
+        catalog,
+        If(catalog.hasValue()).Then(
+            # a newer version is required so an old root cannot be replayed
+            Assert(Btoi(catalog_version)
+                   > ExtractUint64(catalog.value(), CatalogLayout.version))
+        ).Else(
+            pay_for_box(box_min_balance(Len(name.load()), CatalogLayout.size)),
+        ),
+        App.box_put(name.load(), Concat(catalog_root, catalog_version)),
+    )
+
+
+@ Subroutine(TealType.bytes)
+def oracle_cache_box(oracle_round):
+    """oracle_cache_box is the ring slot holding the attestation of a round"""
+    return Concat(OracleCache.prefix, Itob(oracle_round % OracleCache.slots))
+
+
+@ Subroutine(TealType.none)
+def oracle_attest():
+    oracle_round = Txn.application_args[1]
+    price_root = Txn.application_args[2]  # merkle root of price||asset||amount||round tuples
+    root_signature = Txn.application_args[3]
+
+    name = ScratchVar(TealType.bytes)
+    oraclePubKey = App.globalGetEx(
+        Global.current_application_id(), Bytes("oraclePubKey"))
+    cached = App.box_get(name.load())
+
+    return Seq(
+        Assert(Len(oracle_round) == Int(8)),
+        Assert(Len(price_root) == Int(32)),
+        Assert(Btoi(oracle_round) <= Global.round()),
+        Assert(Btoi(oracle_round) + OracleCache.window >= Global.round()),
+        oraclePubKey,
+        Assert(oraclePubKey.hasValue()),
+        Assert(Ed25519Verify_Bare(Concat(Bytes("oracle"), price_root, oracle_round),
+                                  root_signature, oraclePubKey.value())),
+        name.store(oracle_cache_box(Btoi(oracle_round))),
+        cached,
+        If(cached.hasValue()).Then(
+            # only a newer round may take over a slot, the first root of a round stays
+            Assert(Btoi(oracle_round) > ExtractUint64(cached.value(), OracleCache.round))
+        ).Else(
+            pay_for_box(box_min_balance(Len(name.load()), OracleCache.size)),
+        ),
+        App.box_put(name.load(), Concat(oracle_round, price_root)),
+    )
+
+
+@ Subroutine(TealType.none)
+def verify_oracle_price(oracle_data, oracle_round, oracle_proof):
+    """verify_oracle_price checks a price tuple against an oracle signature or the round's attested root"""
+    oraclePubKey = App.globalGetEx(
+        Global.current_application_id(), Bytes("oraclePubKey"))
+    cached = App.box_get(oracle_cache_box(Btoi(oracle_round)))
+
+    return Seq(
+        # a price is good from the oracle's round until the window has passed
+        Assert(Btoi(oracle_round) <= Global.round()),
+        Assert(Btoi(oracle_round) + OracleCache.window >= Global.round()),
+        If(Len(oracle_proof) == Int(64)).Then(
+            oraclePubKey,
+            Assert(oraclePubKey.hasValue()),
+            Assert(Ed25519Verify_Bare(oracle_data, oracle_proof, oraclePubKey.value()))
+        ).Else(
+            cached,
+            Assert(cached.hasValue()),
+            # the slot may already hold a later round
+            Assert(ExtractUint64(cached.value(), OracleCache.round) == Btoi(oracle_round)),
+            Assert(merkle_root(Sha256(Concat(Bytes("base16", "00"), oracle_data)), oracle_proof)
+                   == Extract(cached.value(), OracleCache.root, Int(32)))
+        ),
+    )
+
+
 @ Subroutine(TealType.none)
 def verify_OraclesCommittee():
     proofData = Txn.application_args[1]
@@ -284,178 +927,195 @@ def verify_OraclesCommittee():
 @ Subroutine(TealType.none)
 def customer_new_orderV2():
 
-    opup = OpUp(OpUpMode.OnCall)
-    opup.maximize_budget(Int(10000))
-
-    current_round = Global.round()
-
     merchant_pubkey = Txn.application_args[1]  # public key of merchant
 
     product_id = Txn.application_args[2]  # product id
     product_id_price = Txn.application_args[3]
-    product_id_signature = Txn.application_args[4]  # product id signature
+    product_id_signature = Txn.application_args[4]  # product id signature or catalog proof
 
     merchant_address = Txn.application_args[5]  # oracle data
 
     oracle_round = Txn.application_args[6]  # oracle round data
-    oracle_data_signature = Txn.application_args[7]  # oracle data signature
-
-    oraclePubKey = App.globalGetEx(
-        Global.current_application_id(), Bytes("oraclePubKey"))
-
-    oracle_data_verify = ScratchVar(TealType.bytes)
-    product_id_data_verify = ScratchVar(TealType.bytes)
-    payment_type_data_verify = ScratchVar(TealType.bytes)
+    oracle_data_signature = Txn.application_args[7]  # oracle data signature or attested price proof
 
     payment_type_signature = Txn.application_args[8]  # payment amount
     merchant_address_bytes = Txn.application_args[9]
     collection_type = Txn.application_args[10]
     collection_name = Txn.application_args[11]
 
-    merchant_payment_txn = Gtxn[9]
-    merchant_paymentType = merchant_payment_txn.type_enum()
-    pos_payment_txn = Gtxn[14]
-
-    Assert(
-        And(
-            Btoi(oracle_round) >= Minus(current_round, Int(4)),
-            Btoi(oracle_round) <= current_round
-        )
-    )
-
     return Seq([
-        oraclePubKey,
-        Assert(oraclePubKey.hasValue()),
-        product_id_data_verify.store(
-            Concat(product_id, product_id_price, collection_type, collection_name)),  # collection_type could be null if the product is not connected to a collection
-        If(merchant_paymentType == TxnType.Payment).Then(
-
-            payment_type_data_verify.store(
-                Concat(Bytes("L1"), merchant_address)),
-
-            oracle_data_verify.store(
-                Concat(
-                    product_id_price,
-                    Bytes("L1"),
-                    Itob(Add(merchant_payment_txn.amount(),
-                         pos_payment_txn.amount())),
-                    oracle_round,
-                )),
-
-            Assert(Ed25519Verify_Bare(payment_type_data_verify.load(),
-                                      payment_type_signature, merchant_pubkey)),
-
-            Assert(Ed25519Verify_Bare(oracle_data_verify.load(),
-                                      oracle_data_signature, oraclePubKey.value())),
-
-            Assert(Ed25519Verify_Bare(
-                product_id_data_verify.load(), product_id_signature, merchant_pubkey)),
-
-            If(collection_type == Bytes("phygital")).Then(
-                phygital_mint(),
-                verify_payments()
-            ).ElseIf(collection_type == Bytes("tokengate")).Then(
-                verify_tokengate(),
-                verify_payments()
-            ).ElseIf(collection_type == Bytes("tokengatephygital")).Then(
-                phygital_mint(),
-                verify_tokengate(),
-                verify_payments()
-            ).ElseIf(collection_type == Bytes("false")).Then(
-                verify_payments()
-            )
-
-        ).ElseIf(merchant_paymentType == TxnType.AssetTransfer).Then(
-
-            payment_type_data_verify.store(
-                Concat(Itob(merchant_payment_txn.xfer_asset()), merchant_address)),
-
-            oracle_data_verify.store(
-                Concat(
-                    product_id_price,
-                    Itob(merchant_payment_txn.xfer_asset()),
-                    Itob(Add(merchant_payment_txn.asset_amount(),
-                         pos_payment_txn.asset_amount())),
-                    oracle_round,
-                )),
-
-            Assert(Ed25519Verify_Bare(payment_type_data_verify.load(),
-                                      payment_type_signature, merchant_pubkey)),
-
-            Assert(Ed25519Verify_Bare(oracle_data_verify.load(),
-                                      oracle_data_signature, oraclePubKey.value())),
-
-            Assert(Ed25519Verify_Bare(
-                product_id_data_verify.load(), product_id_signature, merchant_pubkey)),
-
-
-            If(collection_type == Bytes("phygital")).Then(
-                phygital_mint(),
-                verify_payments()
-            ).ElseIf(collection_type == Bytes("tokengate")).Then(
-                verify_tokengate(),
-                verify_payments()
-            ).ElseIf(collection_type == Bytes("tokengatephygital")).Then(
-                phygital_mint(),
-                verify_tokengate(),
-                verify_payments()
-            ).ElseIf(collection_type == Bytes("false")).Then(
-                verify_payments()
-            )
-
+        If(Txn.application_args.length() > PaymentLayout.order_new_arg).Then(
+            load_payment_layout(Txn.application_args[PaymentLayout.order_new_arg])
+        ).Else(
+            PaymentLayout.merchant.store(PaymentLayout.legacy_merchant),
+            PaymentLayout.pos.store(PaymentLayout.legacy_pos),
+        ),
+        load_order_payment(merchant_address_bytes),
+
+        Assert(Ed25519Verify_Bare(Concat(OrderPayment.asset.load(), merchant_address),
+                                  payment_type_signature, merchant_pubkey)),
+
+        verify_oracle_price(
+            Concat(product_id_price, OrderPayment.asset.load(),
+                   Itob(OrderPayment.total.load()), oracle_round),
+            oracle_round, oracle_data_signature),
+
+        # collection_type could be "false" if the product is not connected to a collection
+        verify_product(merchant_pubkey,
+                       Concat(product_id, product_id_price, collection_type, collection_name),
+                       product_id_signature),
+
+        If(collection_type == Bytes("phygital")).Then(
+            phygital_mint(merchant_pubkey, merchant_address_bytes,
+                          collection_type, collection_name)
+        ).ElseIf(collection_type == Bytes("tokengate")).Then(
+            tokengate_order(merchant_pubkey, merchant_address_bytes,
+                            collection_type, collection_name)
+        ).ElseIf(collection_type == Bytes("tokengatephygital")).Then(
+            phygital_mint(merchant_pubkey, merchant_address_bytes,
+                          collection_type, collection_name),
+            tokengate_order(merchant_pubkey, merchant_address_bytes,
+                            collection_type, collection_name)
+        ).Else(
+            Assert(collection_type == Bytes("false"))
         ),
     ])
 
 
 @ Subroutine(TealType.none)
-def verify_payments():
-
-    merchant_address_bytes = Txn.application_args[9]
-    merchant_payment_txn = Gtxn[9]
-    pos_payment_txn = Gtxn[14]
-    pos_paymentType = pos_payment_txn.type_enum()
+def load_order_payment(merchant_address_bytes):
+    """load_order_payment checks an order's two payments and its POS fee split and stores them in OrderPayment"""
+    merchant_payment_txn = Gtxn[PaymentLayout.merchant.load()]
+    pos_payment_txn = Gtxn[PaymentLayout.pos.load()]
     merchant_paymentType = merchant_payment_txn.type_enum()
 
-    fullAmount = ScratchVar(TealType.uint64)
-    serviceFee = ScratchVar(TealType.uint64)
+    merchant_receiver = ScratchVar(TealType.bytes)
+    pos_receiver = ScratchVar(TealType.bytes)
     merchantPayment = ScratchVar(TealType.uint64)
+    serviceFee = ScratchVar(TealType.uint64)
 
     posFee = App.globalGetEx(Global.current_application_id(), Bytes("posFees"))
 
     return Seq(
+        own_payments(),
+        Assert(merchant_payment_txn.sender() == Txn.sender()),
+        Assert(merchant_paymentType == pos_payment_txn.type_enum()),
+        If(merchant_paymentType == TxnType.Payment).Then(
+            OrderPayment.asset.store(Bytes("L1")),
+            merchant_receiver.store(merchant_payment_txn.receiver()),
+            pos_receiver.store(pos_payment_txn.receiver()),
+            merchantPayment.store(merchant_payment_txn.amount()),
+            serviceFee.store(pos_payment_txn.amount()),
+        ).ElseIf(merchant_paymentType == TxnType.AssetTransfer).Then(
+            Assert(pos_payment_txn.xfer_asset() == merchant_payment_txn.xfer_asset()),
+            OrderPayment.asset.store(Itob(merchant_payment_txn.xfer_asset())),
+            merchant_receiver.store(merchant_payment_txn.asset_receiver()),
+            pos_receiver.store(pos_payment_txn.asset_receiver()),
+            merchantPayment.store(merchant_payment_txn.asset_amount()),
+            serviceFee.store(pos_payment_txn.asset_amount()),
+        ).Else(
+            Reject()
+        ),
+        Assert(merchant_receiver.load() == merchant_address_bytes),
+        Assert(pos_receiver.load() == Global.current_application_address()),
+        OrderPayment.total.store(Add(merchantPayment.load(), serviceFee.load())),
+
+        # the POS fee is posFees percent of the total, rounded down, and the
+        # merchant gets the rest
         posFee,
         Assert(posFee.hasValue()),
-        Assert(merchant_payment_txn.sender() == Gtxn[0].sender()),
-        Assert(merchant_paymentType == pos_paymentType),
-
-        If(
-            merchant_paymentType == TxnType.Payment).Then(
-            Assert(merchant_payment_txn.receiver() == merchant_address_bytes),
-            Assert(pos_payment_txn.receiver() ==
-                   Global.current_application_address()),
-                fullAmount.store(
-                    Add(merchant_payment_txn.amount(), pos_payment_txn.amount())),
-                serviceFee.store(
-                    Mul(fullAmount.load(), Btoi(posFee.value())) / Int(100)),
-                merchantPayment.store(
-                    Minus(fullAmount.load(), serviceFee.load())),
-                Assert(merchantPayment.load() ==
-                       merchant_payment_txn.amount()),
-                Assert(serviceFee.load() == pos_payment_txn.amount())
-        ).ElseIf(merchant_paymentType == TxnType.AssetTransfer).Then(
-            Assert(merchant_payment_txn.asset_receiver()
-                   == merchant_address_bytes),
-            Assert(pos_payment_txn.asset_receiver() ==
-                   Global.current_application_address()),
-            fullAmount.store(
-                Add(merchant_payment_txn.asset_amount(), pos_payment_txn.asset_amount())),
-            serviceFee.store(
-                Mul(fullAmount.load(), Btoi(posFee.value())) / Int(100)),
-            merchantPayment.store(Minus(fullAmount.load(), serviceFee.load())),
-            # Assert(merchantPayment.load() ==
-            #       merchant_payment_txn.asset_amount()),
-            #    Assert(serviceFee.load() == pos_payment_txn.asset_amount())
-        )
+        Assert(serviceFee.load() ==
+               Mul(OrderPayment.total.load(), Btoi(posFee.value())) / Int(100)),
+    )
+
+
+@ Subroutine(TealType.bytes)
+def length_prefixed(data, offset):
+    """length_prefixed reads the uint16 length prefixed field at offset"""
+    return Extract(data, offset + Int(2), ExtractUint16(data, offset))
+
+
+@ Subroutine(TealType.bytes)
+def cart_item(item):
+    """cart_item verifies one line item and returns its length prefixed price"""
+    merchant_pubkey = Txn.application_args[CartLayout.merchant_pubkey]
+    merchant_address_bytes = Txn.application_args[CartLayout.merchant_address]
+
+    offset = ScratchVar(TealType.uint64)
+    price_offset = ScratchVar(TealType.uint64)
+    product_id = ScratchVar(TealType.bytes)
+    price = ScratchVar(TealType.bytes)
+    collection_type = ScratchVar(TealType.bytes)
+    collection_name = ScratchVar(TealType.bytes)
+    gate_asset = Txn.assets[GetByte(item, Int(0))]
+
+    return Seq(
+        product_id.store(length_prefixed(item, Int(1))),
+        price_offset.store(Int(3) + Len(product_id.load())),
+        price.store(length_prefixed(item, price_offset.load())),
+        offset.store(price_offset.load() + Int(2) + Len(price.load())),
+        collection_type.store(length_prefixed(item, offset.load())),
+        offset.store(offset.load() + Int(2) + Len(collection_type.load())),
+        collection_name.store(length_prefixed(item, offset.load())),
+        offset.store(offset.load() + Int(2) + Len(collection_name.load())),
+
+        verify_product(merchant_pubkey,
+                       Concat(product_id.load(), price.load(),
+                              collection_type.load(), collection_name.load()),
+                       Suffix(item, offset.load())),
+
+        If(collection_type.load() == Bytes("phygital")).Then(
+            phygital_mint(merchant_pubkey, merchant_address_bytes,
+                          collection_type.load(), collection_name.load())
+        ).ElseIf(collection_type.load() == Bytes("tokengate")).Then(
+            verify_tokengate(merchant_pubkey, merchant_address_bytes,
+                             collection_type.load(), collection_name.load(), gate_asset)
+        ).ElseIf(collection_type.load() == Bytes("tokengatephygital")).Then(
+            phygital_mint(merchant_pubkey, merchant_address_bytes,
+                          collection_type.load(), collection_name.load()),
+            verify_tokengate(merchant_pubkey, merchant_address_bytes,
+                             collection_type.load(), collection_name.load(), gate_asset)
+        ).Else(
+            Assert(collection_type.load() == Bytes("false"))
+        ),
+
+        Extract(item, price_offset.load(), Int(2) + Len(price.load())),
+    )
+
+
+@ Subroutine(TealType.none)
+def customer_order_cart(item_budget, cart_budget, max_items):
+    merchant_pubkey = Txn.application_args[CartLayout.merchant_pubkey]
+    merchant_address_bytes = Txn.application_args[CartLayout.merchant_address]
+    oracle_round = Txn.application_args[CartLayout.oracle_round]
+    oracle_proof = Txn.application_args[CartLayout.oracle_proof]
+    payment_type_signature = Txn.application_args[CartLayout.payment_type_signature]
+
+    prices = ScratchVar(TealType.bytes)
+    i = ScratchVar(TealType.uint64)
+
+    return Seq(
+        Assert(Txn.application_args.length() > Int(CartLayout.first_item)),
+        Assert(Txn.application_args.length() <= Int(CartLayout.first_item) + max_items),
+        load_payment_layout(Txn.application_args[CartLayout.payment_layout]),
+        prices.store(Bytes("")),
+        For(i.store(Int(CartLayout.first_item)), i.load() < Txn.application_args.length(),
+            i.store(i.load() + Int(1))).Do(
+            # the budget is raised item by item so a short cart pays for no more
+            request_budget(item_budget),
+            prices.store(Concat(prices.load(), cart_item(Txn.application_args[i.load()])))
+        ),
+        request_budget(cart_budget),
+
+        # one payment type signature and one oracle price for the whole cart:
+        # "cart"||length prefixed item prices||asset||total||round
+        load_order_payment(merchant_address_bytes),
+        Assert(Ed25519Verify_Bare(Concat(OrderPayment.asset.load(), merchant_address_bytes),
+                                  payment_type_signature, merchant_pubkey)),
+        verify_oracle_price(
+            Concat(Bytes("cart"), prices.load(), OrderPayment.asset.load(),
+                   Itob(OrderPayment.total.load()), oracle_round),
+            oracle_round, oracle_proof),
     )
 
 
@@ -473,18 +1133,92 @@ def customer_review_order():
     order_review_ID = Concat(Bytes("review_customer_order"),
                              Bytes("_"), business_name)
 
+    rating = ScratchVar(TealType.bytes)
+    header = ScratchVar(TealType.bytes)
+    stars = ScratchVar(TealType.uint64)
+    bucket = ScratchVar(TealType.uint64)
+    ordered = ScratchVar(TealType.uint64)
+    i = ScratchVar(TealType.uint64)
+
+    call = Gtxn[i.load()]
+
     return Seq(
-        # check that merchant store exists
-        merchant_store_check := App.box_length(business_name),
-        Assert(merchant_store_check.hasValue()),
         Assert(Len(order_review_text) > Int(1)),
-        Assert(Int(0) <= Len(order_review_stars) <= Int(5)),
+        stars.store(Len(order_review_stars)),
+        Assert(stars.load() <= RatingLayout.max_stars),
         Assert(Gtxn[0].note() == order_review_ID),
+
+        # a review rides along with the reviewer's own order of the merchant,
+        # one review per order: the order call checks its payments, so every
+        # review added to the rating has been paid for
+        ordered.store(Int(0)),
+        For(i.store(Int(0)), i.load() < Global.group_size(), i.store(i.load() + Int(1))).Do(
+            If(And(call.type_enum() == TxnType.ApplicationCall,
+                   call.application_id() == Global.current_application_id(),
+                   call.application_args.length() > Int(0),
+                   i.load() != Txn.group_index())).Then(
+                Assert(call.application_args[0] != Txn.application_args[0]),
+                If(call.sender() == Txn.sender()).Then(
+                    If(call.application_args[0] == Bytes(selector("order_new"))).Then(
+                        ordered.store(Or(ordered.load(), And(
+                            call.application_args[1] == merchant_ID,
+                            call.application_args[9] == merchant_store_address)))
+                    ).ElseIf(call.application_args[0] == Bytes(selector("order_cart"))).Then(
+                        ordered.store(Or(ordered.load(), And(
+                            call.application_args[CartLayout.merchant_pubkey] == merchant_ID,
+                            call.application_args[CartLayout.merchant_address]
+                            == merchant_store_address)))
+                    )
+                )
+            )
+        ),
+        Assert(ordered.load()),
+
+        # the first review of a merchant pays for its rating box
+        rating.store(Concat(RatingLayout.prefix, Sha256(business_name))),
+        If(App.box_create(rating.load(), RatingLayout.size)).Then(
+            pay_for_box(box_min_balance(Len(rating.load()), RatingLayout.size)),
+        ),
+        header.store(App.box_extract(rating.load(), RatingLayout.count, RatingLayout.histogram)),
+        App.box_replace(rating.load(), RatingLayout.count, Concat(
+            Itob(ExtractUint64(header.load(), RatingLayout.count) + Int(1)),
+            Itob(ExtractUint64(header.load(), RatingLayout.star_sum) + stars.load()),
+        )),
+        bucket.store(RatingLayout.histogram + stars.load() * Int(8)),
+        App.box_replace(rating.load(), bucket.load(), Itob(Btoi(
+            App.box_extract(rating.load(), bucket.load(), Int(8))) + Int(1))),
         Approve()
     )
 
 
-def approval_program():
+def selector(name):
+    """the 4 byte selector a route is called with, sha512_256(name)[:4] like an ABI method"""
+    return teal.method_selector(name)
+
+
+def dispatch(routes):
+    """jump table over the route selector in ApplicationArgs[0]
+
+    Btoi(selector) % modulus gives every route its own slot, and the If chain
+    over slots compiles to one switch (teal.lower_switches), so every route
+    costs the same to reach.  A slot checks the whole selector; anything
+    else is rejected.
+    """
+    selectors = {selector(name): body for name, body in routes.items()}
+    modulus = len(selectors)
+    while len({int.from_bytes(s, "big") % modulus for s in selectors}) < len(selectors):
+        modulus += 1
+    slot = Btoi(Txn.application_args[0]) % Int(modulus)
+
+    chain = None
+    for key, body in sorted(selectors.items(), key=lambda s: int.from_bytes(s[0], "big") % modulus):
+        case = slot == Int(int.from_bytes(key, "big") % modulus)
+        then = Seq(Assert(Txn.application_args[0] == Bytes(key)), body)
+        chain = If(case).Then(then) if chain is None else chain.ElseIf(case).Then(then)
+    return chain.Else(Reject())
+
+
+def approval_program(budget):
 
     initialize = Seq([
         Assert(Txn.type_enum() == TxnType.ApplicationCall),
@@ -495,10 +1229,18 @@ def approval_program():
     new_order = Seq(
         Assert(Txn.close_remainder_to() == Global.zero_address()),
         Assert(Txn.rekey_to() == Global.zero_address()),
+        request_budget(order_budget(budget, Txn.application_args[10])),
         customer_new_orderV2(),
         Approve()
     )
 
+    cart_order = Seq(
+        Assert(Txn.close_remainder_to() == Global.zero_address()),
+        Assert(Txn.rekey_to() == Global.zero_address()),
+        customer_order_cart(budget.cart_item(), budget.order_cart(), budget.cart_max_items()),
+        Approve()
+    )
+
     review_order = Seq(
         Assert(Txn.close_remainder_to() == Global.zero_address()),
         Assert(Txn.rekey_to() == Global.zero_address()),
@@ -513,6 +1255,36 @@ def approval_program():
         Approve()
     )
 
+    commit_catalog = Seq(
+        Assert(Txn.close_remainder_to() == Global.zero_address()),
+        Assert(Txn.rekey_to() == Global.zero_address()),
+        request_budget(budget.catalog_commit()),
+        catalog_commit(),
+        Approve()
+    )
+
+    attest_oracle = Seq(
+        Assert(Txn.close_remainder_to() == Global.zero_address()),
+        Assert(Txn.rekey_to() == Global.zero_address()),
+        request_budget(budget.oracle_attest()),
+        oracle_attest(),
+        Approve()
+    )
+
+    premint_phygital = Seq(
+        Assert(Txn.close_remainder_to() == Global.zero_address()),
+        Assert(Txn.rekey_to() == Global.zero_address()),
+        phygital_preminted_optin(budget.premint_nft(), budget.premint()),
+        Approve()
+    )
+
+    withdraw_preminted_phygital = Seq(
+        Assert(Txn.close_remainder_to() == Global.zero_address()),
+        Assert(Txn.rekey_to() == Global.zero_address()),
+        phygital_preminted_withdraw_owner(),
+        Approve()
+    )
+
     withdraw_phygital_product = Seq(
         Assert(Txn.close_remainder_to() == Global.zero_address()),
         Assert(Txn.rekey_to() == Global.zero_address()),
@@ -527,20 +1299,41 @@ def approval_program():
         Approve()
     )
 
-    onCall = If(Txn.application_args[0] == Constants.order_new).Then(new_order)  \
-        .ElseIf(Txn.application_args[0] == Constants.order_review).Then(review_order)  \
-        .ElseIf(Txn.application_args[0] == Constants.collection_init).Then(init_collection)  \
-        .ElseIf(Txn.application_args[0] == Constants.phygital_product_withdraw).Then(withdraw_phygital_product)  \
-        .ElseIf(Txn.application_args[0] == Constants.admin_init).Then(app_init)  \
-        .Else(Approve())
+    app_optin_assets = Seq(
+        Assert(Txn.close_remainder_to() == Global.zero_address()),
+        Assert(Txn.rekey_to() == Global.zero_address()),
+        Assert(Txn.sender() == Global.creator_address()),
+        optin_assets(),
+        Approve()
+    )
 
+    app_sweep_fees = Seq(
+        Assert(Txn.close_remainder_to() == Global.zero_address()),
+        Assert(Txn.rekey_to() == Global.zero_address()),
+        Assert(Txn.sender() == Global.creator_address()),
+        sweep_fees(),
+        Approve()
+    )
+
+    onCall = dispatch({
+        "order_new": new_order,
+        "order_cart": cart_order,
+        "order_review": review_order,
+        "collection_init": init_collection,
+        "phygital_product_widthdraw": withdraw_phygital_product,
+        "admin_init": app_init,
+        "admin_optin_assets": app_optin_assets,
+        "admin_sweep_fees": app_sweep_fees,
+        "catalog_commit": commit_catalog,
+        "oracle_attest": attest_oracle,
+        "phygital_preminted_optin": premint_phygital,
+        "phygital_preminted_withdraw_owner": withdraw_preminted_phygital,
+    })
+
+    # CloseOut, ClearState, UpdateApplication and DeleteApplication are rejected
     return If(Txn.application_id() == Int(0)).Then(initialize)                  \
-        .ElseIf(Txn.on_completion() == OnComplete.CloseOut).Then(Reject()) \
-        .ElseIf(Txn.on_completion() == OnComplete.UpdateApplication).Then(Reject()) \
-        .ElseIf(Txn.on_completion() == OnComplete.DeleteApplication).Then(Reject()) \
-        .ElseIf(Txn.on_completion() == OnComplete.ClearState).Then(Reject()) \
+        .ElseIf(Txn.on_completion() == OnComplete.NoOp).Then(onCall)         \
         .ElseIf(Txn.on_completion() == OnComplete.OptIn).Then(Approve())    \
-        .ElseIf(Txn.on_completion() == Int(0)).Then(onCall)                 \
         .Else(Reject())
 
 
@@ -548,13 +1341,23 @@ def clear_program():
     return Approve()
 
 
+def compile_approval(version=8, assembleConstants=False, budgets=BUDGETS):
+    """approval_program() as TEAL, its dispatch chains lowered to switch jump tables
+
+    budgets names the budget table to compile the order branches with.
+    """
+    return teal.lower_switches(compileTeal(
+        approval_program(Budget(budgets)), mode=Mode.Application, version=version,
+        assembleConstants=assembleConstants))
+
+
+def compile_clear(version=8):
+    return compileTeal(clear_program(), mode=Mode.Application, version=version)
+
+
 if __name__ == "__main__":
     with open("approval.teal", "w+") as f:
-        compiled = compileTeal(
-            approval_program(), mode=Mode.Application, version=8)
-        f.write(compiled)
+        f.write(compile_approval())
 
     with open("clear.teal", "w+") as f:
-        compiled = compileTeal(
-            clear_program(), mode=Mode.Application, version=8)
-        f.write(compiled)
+        f.write(compile_clear())
@@ -0,0 +1,263 @@
+"""Batch signer for merchant product and payment type signatures.
+
+customer_new_orderV2 checks a merchant's ed25519 signature over each product
+message, product_id||price||collection_type||collection_name, and over the
+payment type it is paid in, "L1"||merchant address or Itob(asset)||merchant
+address.  This tool signs a catalog CSV (the columns catalog.py reads) and a
+list of payment assets with the merchant key, spreading the signatures over a
+process pool, and writes them to a signature file storefront servers map into
+memory:
+
+    magic(8) | products(8) | payment types(8) | merchant pubkey(32) | merchant address(32)
+    product records sorted by key:   Sha256(product_id)[:16] | Sha256(message)[:16] | signature(64)
+    payment records sorted by asset: asset(8) | signature(64)
+
+Given the previous file, rows whose product message is unchanged keep their
+signature and only new or repriced rows are signed again:
+
+    python signer.py sign products.csv --signing-key <hex seed> \\
+        --merchant-address <hex> --assets 0 31566704 --previous sigs.bin --output sigs.bin
+    python signer.py lookup sigs.bin --product sku-1 --asset 0
+"""
+
+import argparse
+import bisect
+import concurrent.futures
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import catalog
+
+
+MAGIC = b"P3SIGS01"
+HEADER = struct.Struct(">8sQQ32s32s")
+PRODUCT_RECORD = struct.Struct(">16s16s64s")
+PAYMENT_RECORD = struct.Struct(">Q64s")
+# messages a worker signs per task
+CHUNK = 4096
+
+_key = None
+
+
+def product_key(product_id):
+    return hashlib.sha256(product_id).digest()[:16]
+
+
+def message_digest(message):
+    return hashlib.sha256(message).digest()[:16]
+
+
+def read_rows(path):
+    """(product_id, product message) of every row of a catalog CSV"""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            product_id = row["product_id"].encode()
+            yield product_id, catalog.product_message(
+                product_id, row["price"].encode(),
+                (row.get("collection_type") or "false").encode(),
+                (row.get("collection_name") or "").encode())
+
+
+def _init_worker(seed):
+    global _key
+    from nacl.signing import SigningKey
+    _key = SigningKey(seed)
+
+
+def _sign_chunk(messages):
+    return [_key.sign(m).signature for m in messages]
+
+
+def sign_messages(seed, messages, workers=None, chunk=CHUNK):
+    """ed25519 signatures of messages, in order, signed across a process pool"""
+    if len(messages) <= chunk or workers == 1:
+        _init_worker(seed)
+        return _sign_chunk(messages)
+    chunks = [messages[i:i + chunk] for i in range(0, len(messages), chunk)]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(seed,)) as pool:
+        return [s for signatures in pool.map(_sign_chunk, chunks) for s in signatures]
+
+
+class SignatureFile:
+    """memory-mapped reader for files written by write_signatures"""
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.count, self.payment_count, self.merchant_pubkey,
+         self.merchant_address) = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError("%s is not a signature file" % path)
+        self._payments = HEADER.size + self.count * PRODUCT_RECORD.size
+        self._keys = _Keys(self._map, HEADER.size, PRODUCT_RECORD.size, self.count)
+
+    def _product(self, index):
+        return PRODUCT_RECORD.unpack_from(self._map, HEADER.size + index * PRODUCT_RECORD.size)
+
+    def records(self):
+        """(product key, message digest, signature) of every product, by key"""
+        for index in range(self.count):
+            yield self._product(index)
+
+    def product_signature(self, product_id):
+        """the signature of a product's current message, None if it isn't signed"""
+        key = product_key(product_id)
+        index = bisect.bisect_left(self._keys, key)
+        if index < self.count and self._keys[index] == key:
+            return self._product(index)[2]
+        return None
+
+    def payment_types(self):
+        for index in range(self.payment_count):
+            yield PAYMENT_RECORD.unpack_from(self._map,
+                                             self._payments + index * PAYMENT_RECORD.size)
+
+    def payment_type_signature(self, asset):
+        """the signature accepting payment in asset (0 for the L1 token), None if absent"""
+        for record_asset, signature in self.payment_types():
+            if record_asset == asset:
+                return signature
+        return None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Keys:
+    """the sorted product keys of a mapped file, as a sequence bisect can search"""
+
+    def __init__(self, buffer, start, stride, count):
+        self.buffer, self.start, self.stride, self.count = buffer, start, stride, count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        offset = self.start + index * self.stride
+        return bytes(self.buffer[offset:offset + 16])
+
+
+def write_signatures(path, merchant_pubkey, merchant_address, products, payments):
+    """write sorted product and payment records, replacing path atomically
+
+    servers that still map the old file keep reading it until they reopen.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(products), len(payments), merchant_pubkey,
+                            merchant_address))
+        for record in sorted(products):
+            f.write(PRODUCT_RECORD.pack(*record))
+        for record in sorted(payments):
+            f.write(PAYMENT_RECORD.pack(*record))
+    os.replace(tmp, path)
+
+
+def sign_catalog(seed, merchant_address, rows, assets, previous=None, workers=None):
+    """(merchant pubkey, product records, payment records, stats) of a catalog
+
+    records of the previous SignatureFile are reused when the merchant key,
+    address and product message are unchanged.
+    """
+    from nacl.signing import SigningKey
+    pubkey = bytes(SigningKey(seed).verify_key)
+    reusable = {}
+    if (previous is not None and previous.merchant_pubkey == pubkey
+            and previous.merchant_address == merchant_address):
+        reusable = {key: (digest, signature) for key, digest, signature in previous.records()}
+
+    records = []
+    pending = []
+    seen = set()
+    for product_id, message in rows:
+        key = product_key(product_id)
+        if key in seen:
+            raise ValueError("product %r is listed twice" % product_id)
+        seen.add(key)
+        digest = message_digest(message)
+        kept = reusable.get(key)
+        if kept is not None and kept[0] == digest:
+            records.append((key, digest, kept[1]))
+        else:
+            pending.append((key, digest, message))
+
+    signatures = sign_messages(seed, [m for _, _, m in pending], workers)
+    records += [(key, digest, signature)
+                for (key, digest, _), signature in zip(pending, signatures)]
+    payments = list(zip(assets, sign_messages(
+        seed, [catalog.payment_type_message(a, merchant_address) for a in assets], 1)))
+    stats = {
+        "products": len(records),
+        "signed": len(pending),
+        "reused": len(records) - len(pending),
+        "removed": len(set(reusable) - seen),
+        "payment_types": len(payments),
+    }
+    return pubkey, records, payments, stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sign = sub.add_parser("sign", help="sign a catalog CSV and payment types")
+    sign.add_argument("products")
+    sign.add_argument("--signing-key", required=True, help="hex ed25519 seed of the merchant key")
+    sign.add_argument("--merchant-address", required=True,
+                      help="hex of the 32 byte merchant address orders pay")
+    sign.add_argument("--assets", nargs="*", type=int, default=[0],
+                      help="payment assets to accept, 0 for the L1 token")
+    sign.add_argument("--previous", help="signature file to reuse unchanged rows from")
+    sign.add_argument("--output", required=True)
+    sign.add_argument("--workers", type=int, help="signing processes (default: CPU count)")
+    lookup = sub.add_parser("lookup", help="print signatures from a signature file")
+    lookup.add_argument("signatures")
+    lookup.add_argument("--product", action="append", default=[])
+    lookup.add_argument("--asset", type=int, action="append", default=[])
+    args = parser.parse_args(argv)
+
+    if args.command == "lookup":
+        with SignatureFile(args.signatures) as f:
+            out = {"merchant_pubkey": f.merchant_pubkey.hex(), "products": {}, "assets": {}}
+            for product_id in args.product:
+                signature = f.product_signature(product_id.encode())
+                out["products"][product_id] = signature and signature.hex()
+            for asset in args.asset:
+                signature = f.payment_type_signature(asset)
+                out["assets"][asset] = signature and signature.hex()
+        print(json.dumps(out, indent=2))
+        return 0
+
+    started = time.perf_counter()
+    merchant_address = bytes.fromhex(args.merchant_address)
+    previous = None
+    if args.previous and os.path.exists(args.previous):
+        previous = SignatureFile(args.previous)
+    try:
+        pubkey, records, payments, stats = sign_catalog(
+            bytes.fromhex(args.signing_key), merchant_address, read_rows(args.products),
+            args.assets, previous, args.workers)
+    finally:
+        if previous is not None:
+            previous.close()
+    write_signatures(args.output, pubkey, merchant_address, records, payments)
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
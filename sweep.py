@@ -0,0 +1,123 @@
+"""Off-chain planner for the admin_sweep_fees route of p3-contract.py.
+
+POS fees collect in the app account, in ALGO and in every payment ASA it is
+opted in to.  admin_sweep_fees sends the app's whole balance of each foreign
+asset of the call to the treasury in Txn.accounts[1], and with a reserve in
+ApplicationArgs[1] the ALGO above its minimum balance plus the reserve, all
+as one inner group.  Holdings stay opted in and the NFTs the app minted are
+never swept.
+
+plan() takes the app account's holdings, as algod reports them, and drops
+empty holdings, the app's own NFTs and, given the treasury's holdings, the
+assets the treasury can't receive.  The rest is cut into calls of 7 assets,
+with ALGO in the first call, and groups of 16 calls; each call pays its own
+fee plus one per transfer so the app account never pays for them:
+
+    python sweep.py --account app-account.json --treasury-account treasury.json --reserve 1000000
+    python sweep.py --holding 31566704=125000 --holding 312769=0 --algo 4200000
+"""
+
+import argparse
+import json
+import sys
+
+from optin import MAX_GROUP_SIZE, MIN_TXN_FEE
+
+
+# a call references at most 8 accounts, assets, apps and boxes together, and
+# the treasury in Txn.accounts[1] takes one of them
+MAX_SWEEP_ASSETS = 7
+
+
+def account_holdings(info):
+    """(asset -> amount, assets it created, ALGO above its minimum balance) of an algod account"""
+    holdings = {a["asset-id"]: a["amount"] for a in info.get("assets", [])}
+    created = [a["index"] for a in info.get("created-assets", [])]
+    return holdings, created, info.get("amount", 0) - info.get("min-balance", 0)
+
+
+def sweepable(holdings, created=(), treasury_assets=None):
+    """the assets a sweep moves, by asset ID, and those the treasury isn't opted in to"""
+    created = set(created)
+    todo = sorted(a for a, amount in holdings.items() if amount > 0 and a not in created)
+    if treasury_assets is None:
+        return todo, []
+    treasury_assets = set(treasury_assets)
+    return ([a for a in todo if a in treasury_assets],
+            [a for a in todo if a not in treasury_assets])
+
+
+def plan(holdings, created=(), algo=0, reserve=0, treasury_assets=None,
+         per_call=MAX_SWEEP_ASSETS, group_size=MAX_GROUP_SIZE, min_fee=MIN_TXN_FEE):
+    """groups of admin_sweep_fees calls, with the assets, fee and ALGO of each call
+
+    algo is the app account's ALGO above its minimum balance; what exceeds
+    reserve is swept by the first call.
+    """
+    assets, skipped = sweepable(holdings, created, treasury_assets)
+    sweep_algo = max(0, algo - reserve)
+    pages = [assets[i:i + per_call] for i in range(0, len(assets), per_call)]
+    if sweep_algo and not pages:
+        pages = [[]]
+    calls = []
+    for n, page in enumerate(pages):
+        with_algo = n == 0 and sweep_algo > 0
+        calls.append({
+            "assets": page,
+            "reserve": reserve if with_algo else None,
+            "fee": (1 + len(page) + with_algo) * min_fee,
+        })
+    groups = [calls[i:i + group_size] for i in range(0, len(calls), group_size)]
+    return {
+        "calls": len(calls),
+        "transfers": len(assets) + (sweep_algo > 0),
+        "fees": sum(call["fee"] for call in calls),
+        "algo": sweep_algo,
+        "amounts": {a: holdings[a] for a in assets},
+        "skipped": skipped,
+        "groups": groups,
+    }
+
+
+def _holding(text):
+    asset, amount = text.split("=")
+    return int(asset), int(amount)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--account", help="algod account JSON of the app account")
+    parser.add_argument("--holding", type=_holding, action="append", default=[],
+                        help="asset=amount the app account holds (repeatable)")
+    parser.add_argument("--created", nargs="*", type=int, default=[],
+                        help="asset IDs the app account created")
+    parser.add_argument("--algo", type=int, default=0,
+                        help="ALGO above the app account's minimum balance, in microAlgos")
+    parser.add_argument("--reserve", type=int, default=0,
+                        help="microAlgos to leave above the minimum balance")
+    parser.add_argument("--treasury-account",
+                        help="algod account JSON of the treasury, to skip assets it can't receive")
+    parser.add_argument("--output", help="write the JSON plan here instead of stdout")
+    args = parser.parse_args(argv)
+
+    holdings, created, algo = dict(args.holding), list(args.created), args.algo
+    if args.account:
+        with open(args.account) as f:
+            account, account_created, algo = account_holdings(json.load(f))
+        holdings.update(account)
+        created += account_created
+    treasury_assets = None
+    if args.treasury_account:
+        with open(args.treasury_account) as f:
+            treasury_assets = account_holdings(json.load(f))[0]
+    out = json.dumps(plan(holdings, created, algo, args.reserve, treasury_assets), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,668 @@
+"""Parsing, opcode metadata and assembly for the TEAL emitted by p3-contract.py.
+
+Only the subset of the AVM that PyTeal emits for version 8 programs is
+covered, which is enough to size, cost and execute the contract offline.
+"""
+
+import base64
+import re
+from collections import namedtuple
+
+
+Op = namedtuple("Op", ["name", "code", "cost", "immediates"])
+
+# bytes of a program page; an app's two programs get one plus ExtraProgramPages
+PAGE_SIZE = 2048
+MAX_EXTRA_PAGES = 3
+
+
+TXN_FIELDS = [
+    "Sender", "Fee", "FirstValid", "FirstValidTime", "LastValid", "Note",
+    "Lease", "Receiver", "Amount", "CloseRemainderTo", "VotePK",
+    "SelectionPK", "VoteFirst", "VoteLast", "VoteKeyDilution", "Type",
+    "TypeEnum", "XferAsset", "AssetAmount", "AssetSender", "AssetReceiver",
+    "AssetCloseTo", "GroupIndex", "TxID", "ApplicationID", "OnCompletion",
+    "ApplicationArgs", "NumAppArgs", "Accounts", "NumAccounts",
+    "ApprovalProgram", "ClearStateProgram", "RekeyTo", "ConfigAsset",
+    "ConfigAssetTotal", "ConfigAssetDecimals", "ConfigAssetDefaultFrozen",
+    "ConfigAssetUnitName", "ConfigAssetName", "ConfigAssetURL",
+    "ConfigAssetMetadataHash", "ConfigAssetManager", "ConfigAssetReserve",
+    "ConfigAssetFreeze", "ConfigAssetClawback", "FreezeAsset",
+    "FreezeAssetAccount", "FreezeAssetFrozen", "Assets", "NumAssets",
+    "Applications", "NumApplications", "GlobalNumUint", "GlobalNumByteSlice",
+    "LocalNumUint", "LocalNumByteSlice", "ExtraProgramPages",
+    "Nonparticipation", "Logs", "NumLogs", "CreatedAssetID",
+    "CreatedApplicationID", "LastLog", "StateProofPK", "ApprovalProgramPages",
+    "NumApprovalProgramPages", "ClearStateProgramPages",
+    "NumClearStateProgramPages",
+]
+
+GLOBAL_FIELDS = [
+    "MinTxnFee", "MinBalance", "MaxTxnLife", "ZeroAddress", "GroupSize",
+    "LogicSigVersion", "Round", "LatestTimestamp", "CurrentApplicationID",
+    "CreatorAddress", "CurrentApplicationAddress", "GroupID", "OpcodeBudget",
+    "CallerApplicationID", "CallerApplicationAddress",
+]
+
+ASSET_HOLDING_FIELDS = ["AssetBalance", "AssetFrozen"]
+
+ASSET_PARAMS_FIELDS = [
+    "AssetTotal", "AssetDecimals", "AssetDefaultFrozen", "AssetUnitName",
+    "AssetName", "AssetURL", "AssetMetadataHash", "AssetManager",
+    "AssetReserve", "AssetFreeze", "AssetClawback", "AssetCreator",
+]
+
+APP_PARAMS_FIELDS = [
+    "AppApprovalProgram", "AppClearStateProgram", "AppGlobalNumUint",
+    "AppGlobalNumByteSlice", "AppLocalNumUint", "AppLocalNumByteSlice",
+    "AppExtraProgramPages", "AppCreator", "AppAddress",
+]
+
+ACCT_PARAMS_FIELDS = [
+    "AcctBalance", "AcctMinBalance", "AcctAuthAddr", "AcctTotalNumUint",
+    "AcctTotalNumByteSlice", "AcctTotalExtraAppPages", "AcctTotalAppsCreated",
+    "AcctTotalAppsOptedIn", "AcctTotalAssetsCreated", "AcctTotalAssets",
+    "AcctTotalBoxes", "AcctTotalBoxBytes",
+]
+
+NAMED_INTS = {
+    "unknown": 0, "pay": 1, "keyreg": 2, "acfg": 3, "axfer": 4, "afrz": 5,
+    "appl": 6, "NoOp": 0, "OptIn": 1, "CloseOut": 2, "ClearState": 3,
+    "UpdateApplication": 4, "DeleteApplication": 5,
+}
+
+# immediate kinds: "u8" one byte, "i8" signed byte, "label" int16 offset,
+# "labels" switch/match table, "varuint" / "bytes" inline constants,
+# "varuints" / "bytess" counted constant lists, "field:<table>" enum byte
+_OPS = [
+    ("err", 0x00, 1, ()),
+    ("sha256", 0x01, 35, ()),
+    ("keccak256", 0x02, 130, ()),
+    ("sha512_256", 0x03, 45, ()),
+    ("ed25519verify", 0x04, 1900, ()),
+    ("+", 0x08, 1, ()),
+    ("-", 0x09, 1, ()),
+    ("/", 0x0a, 1, ()),
+    ("*", 0x0b, 1, ()),
+    ("<", 0x0c, 1, ()),
+    (">", 0x0d, 1, ()),
+    ("<=", 0x0e, 1, ()),
+    (">=", 0x0f, 1, ()),
+    ("&&", 0x10, 1, ()),
+    ("||", 0x11, 1, ()),
+    ("==", 0x12, 1, ()),
+    ("!=", 0x13, 1, ()),
+    ("!", 0x14, 1, ()),
+    ("len", 0x15, 1, ()),
+    ("itob", 0x16, 1, ()),
+    ("btoi", 0x17, 1, ()),
+    ("%", 0x18, 1, ()),
+    ("|", 0x19, 1, ()),
+    ("&", 0x1a, 1, ()),
+    ("^", 0x1b, 1, ()),
+    ("~", 0x1c, 1, ()),
+    ("mulw", 0x1d, 1, ()),
+    ("addw", 0x1e, 1, ()),
+    ("divmodw", 0x1f, 20, ()),
+    ("intcblock", 0x20, 1, ("varuints",)),
+    ("intc", 0x21, 1, ("u8",)),
+    ("intc_0", 0x22, 1, ()),
+    ("intc_1", 0x23, 1, ()),
+    ("intc_2", 0x24, 1, ()),
+    ("intc_3", 0x25, 1, ()),
+    ("bytecblock", 0x26, 1, ("bytess",)),
+    ("bytec", 0x27, 1, ("u8",)),
+    ("bytec_0", 0x28, 1, ()),
+    ("bytec_1", 0x29, 1, ()),
+    ("bytec_2", 0x2a, 1, ()),
+    ("bytec_3", 0x2b, 1, ()),
+    ("txn", 0x31, 1, ("field:txn",)),
+    ("global", 0x32, 1, ("field:global",)),
+    ("gtxn", 0x33, 1, ("u8", "field:txn")),
+    ("load", 0x34, 1, ("u8",)),
+    ("store", 0x35, 1, ("u8",)),
+    ("txna", 0x36, 1, ("field:txn", "u8")),
+    ("gtxna", 0x37, 1, ("u8", "field:txn", "u8")),
+    ("gtxns", 0x38, 1, ("field:txn",)),
+    ("gtxnsa", 0x39, 1, ("field:txn", "u8")),
+    ("gload", 0x3a, 1, ("u8", "u8")),
+    ("gloads", 0x3b, 1, ("u8",)),
+    ("gaid", 0x3c, 1, ("u8",)),
+    ("gaids", 0x3d, 1, ()),
+    ("loads", 0x3e, 1, ()),
+    ("stores", 0x3f, 1, ()),
+    ("bnz", 0x40, 1, ("label",)),
+    ("bz", 0x41, 1, ("label",)),
+    ("b", 0x42, 1, ("label",)),
+    ("return", 0x43, 1, ()),
+    ("assert", 0x44, 1, ()),
+    ("bury", 0x45, 1, ("u8",)),
+    ("popn", 0x46, 1, ("u8",)),
+    ("dupn", 0x47, 1, ("u8",)),
+    ("pop", 0x48, 1, ()),
+    ("dup", 0x49, 1, ()),
+    ("dup2", 0x4a, 1, ()),
+    ("dig", 0x4b, 1, ("u8",)),
+    ("swap", 0x4c, 1, ()),
+    ("select", 0x4d, 1, ()),
+    ("cover", 0x4e, 1, ("u8",)),
+    ("uncover", 0x4f, 1, ("u8",)),
+    ("concat", 0x50, 1, ()),
+    ("substring", 0x51, 1, ("u8", "u8")),
+    ("substring3", 0x52, 1, ()),
+    ("getbit", 0x53, 1, ()),
+    ("setbit", 0x54, 1, ()),
+    ("getbyte", 0x55, 1, ()),
+    ("setbyte", 0x56, 1, ()),
+    ("extract", 0x57, 1, ("u8", "u8")),
+    ("extract3", 0x58, 1, ()),
+    ("extract_uint16", 0x59, 1, ()),
+    ("extract_uint32", 0x5a, 1, ()),
+    ("extract_uint64", 0x5b, 1, ()),
+    ("replace2", 0x5c, 1, ("u8",)),
+    ("replace3", 0x5d, 1, ()),
+    ("balance", 0x60, 1, ()),
+    ("app_opted_in", 0x61, 1, ()),
+    ("app_local_get", 0x62, 1, ()),
+    ("app_local_get_ex", 0x63, 1, ()),
+    ("app_global_get", 0x64, 1, ()),
+    ("app_global_get_ex", 0x65, 1, ()),
+    ("app_local_put", 0x66, 1, ()),
+    ("app_global_put", 0x67, 1, ()),
+    ("app_local_del", 0x68, 1, ()),
+    ("app_global_del", 0x69, 1, ()),
+    ("asset_holding_get", 0x70, 1, ("field:asset_holding",)),
+    ("asset_params_get", 0x71, 1, ("field:asset_params",)),
+    ("app_params_get", 0x72, 1, ("field:app_params",)),
+    ("acct_params_get", 0x73, 1, ("field:acct_params",)),
+    ("min_balance", 0x78, 1, ()),
+    ("pushbytes", 0x80, 1, ("bytes",)),
+    ("pushint", 0x81, 1, ("varuint",)),
+    ("pushbytess", 0x82, 1, ("bytess",)),
+    ("pushints", 0x83, 1, ("varuints",)),
+    ("ed25519verify_bare", 0x84, 1900, ()),
+    ("callsub", 0x88, 1, ("label",)),
+    ("retsub", 0x89, 1, ()),
+    ("proto", 0x8a, 1, ("u8", "u8")),
+    ("frame_dig", 0x8b, 1, ("i8",)),
+    ("frame_bury", 0x8c, 1, ("i8",)),
+    ("switch", 0x8d, 1, ("labels",)),
+    ("match", 0x8e, 1, ("labels",)),
+    ("shl", 0x90, 1, ()),
+    ("shr", 0x91, 1, ()),
+    ("sqrt", 0x92, 4, ()),
+    ("bitlen", 0x93, 1, ()),
+    ("exp", 0x94, 1, ()),
+    ("expw", 0x95, 10, ()),
+    ("bsqrt", 0x96, 40, ()),
+    ("divw", 0x97, 1, ()),
+    ("sha3_256", 0x98, 130, ()),
+    ("b+", 0xa0, 10, ()),
+    ("b-", 0xa1, 10, ()),
+    ("b/", 0xa2, 20, ()),
+    ("b*", 0xa3, 20, ()),
+    ("b<", 0xa4, 1, ()),
+    ("b>", 0xa5, 1, ()),
+    ("b<=", 0xa6, 1, ()),
+    ("b>=", 0xa7, 1, ()),
+    ("b==", 0xa8, 1, ()),
+    ("b!=", 0xa9, 1, ()),
+    ("b%", 0xaa, 20, ()),
+    ("b|", 0xab, 6, ()),
+    ("b&", 0xac, 6, ()),
+    ("b^", 0xad, 6, ()),
+    ("b~", 0xae, 4, ()),
+    ("bzero", 0xaf, 1, ()),
+    ("log", 0xb0, 1, ()),
+    ("itxn_begin", 0xb1, 1, ()),
+    ("itxn_field", 0xb2, 1, ("field:txn",)),
+    ("itxn_submit", 0xb3, 1, ()),
+    ("itxn", 0xb4, 1, ("field:txn",)),
+    ("itxna", 0xb5, 1, ("field:txn", "u8")),
+    ("itxn_next", 0xb6, 1, ()),
+    ("gitxn", 0xb7, 1, ("u8", "field:txn")),
+    ("gitxna", 0xb8, 1, ("u8", "field:txn", "u8")),
+    ("box_create", 0xb9, 1, ()),
+    ("box_extract", 0xba, 1, ()),
+    ("box_replace", 0xbb, 1, ()),
+    ("box_del", 0xbc, 1, ()),
+    ("box_len", 0xbd, 1, ()),
+    ("box_get", 0xbe, 1, ()),
+    ("box_put", 0xbf, 1, ()),
+    ("txnas", 0xc0, 1, ("field:txn",)),
+    ("gtxnas", 0xc1, 1, ("u8", "field:txn")),
+    ("gtxnsas", 0xc2, 1, ("field:txn",)),
+    ("itxnas", 0xc5, 1, ("field:txn",)),
+    ("gitxnas", 0xc6, 1, ("u8", "field:txn")),
+    ("vrf_verify", 0xd0, 5700, ("u8",)),
+]
+
+OPS = {name: Op(name, code, cost, imm) for name, code, cost, imm in _OPS}
+
+FIELD_TABLES = {
+    "txn": TXN_FIELDS,
+    "global": GLOBAL_FIELDS,
+    "asset_holding": ASSET_HOLDING_FIELDS,
+    "asset_params": ASSET_PARAMS_FIELDS,
+    "app_params": APP_PARAMS_FIELDS,
+    "acct_params": ACCT_PARAMS_FIELDS,
+}
+
+BRANCHES = ("bnz", "bz", "b", "callsub", "switch", "match")
+TERMINATORS = ("b", "return", "retsub", "err", "switch", "match")
+
+_LABEL = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*):$")
+
+
+class TealError(Exception):
+    pass
+
+
+class Instruction:
+    """a single TEAL instruction together with where it came from"""
+
+    def __init__(self, op, args, line, label):
+        self.op = op
+        self.args = args
+        self.line = line
+        self.label = label
+        self.pc = None
+        self.size = None
+
+    @property
+    def cost(self):
+        return OPS[self.op].cost if self.op in OPS else 1
+
+    def __repr__(self):
+        return "Instruction(%r, %r, line=%d)" % (self.op, self.args, self.line)
+
+
+class Program:
+    """a parsed TEAL program with its constant blocks and label table"""
+
+    def __init__(self, version, instructions, labels):
+        self.version = version
+        self.instructions = instructions
+        self.labels = labels
+        self.intc = []
+        self.bytec = []
+        for ins in instructions:
+            if ins.op == "intcblock":
+                self.intc = [parse_int(a) for a in ins.args]
+            elif ins.op == "bytecblock":
+                self.bytec = [parse_bytes(a) for a in ins.args]
+
+    def target(self, label):
+        """index of the instruction a label points at"""
+        if label not in self.labels:
+            raise TealError("unknown label %s" % label)
+        return self.labels[label]
+
+
+def _tokenize(line):
+    tokens = []
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c.isspace():
+            i += 1
+        elif c == '"':
+            j = i + 1
+            while j < len(line) and line[j] != '"':
+                j += 2 if line[j] == "\\" else 1
+            tokens.append(line[i:j + 1])
+            i = j + 1
+        else:
+            j = i
+            while j < len(line) and not line[j].isspace():
+                j += 1
+            token = line[i:j]
+            if token.startswith("//"):
+                break
+            tokens.append(token)
+            i = j
+    return tokens
+
+
+def parse(source):
+    """parse TEAL source into a Program"""
+    version = 1
+    instructions = []
+    labels = {}
+    current = "main"
+    for number, raw in enumerate(source.splitlines(), start=1):
+        tokens = _tokenize(raw)
+        if not tokens:
+            continue
+        if tokens[0] == "#pragma":
+            if tokens[1] == "version":
+                version = int(tokens[2])
+            continue
+        match = _LABEL.match(tokens[0])
+        if match and len(tokens) == 1:
+            current = match.group(1)
+            labels[current] = len(instructions)
+            continue
+        instructions.append(Instruction(tokens[0], tokens[1:], number, current))
+    return Program(version, instructions, labels)
+
+
+def parse_int(token):
+    if token in NAMED_INTS:
+        return NAMED_INTS[token]
+    return int(token, 0)
+
+
+def parse_bytes(token, *rest):
+    """decode a TEAL byte constant in any of its literal forms"""
+    if token.startswith('"'):
+        return _unquote(token)
+    if token.startswith("0x"):
+        return bytes.fromhex(token[2:])
+    if token in ("base64", "b64"):
+        return base64.b64decode(rest[0])
+    if token.startswith("base64(") or token.startswith("b64("):
+        return base64.b64decode(token[token.index("(") + 1:-1])
+    if token in ("base32", "b32"):
+        return base64.b32decode(rest[0] + "=" * (-len(rest[0]) % 8))
+    raise TealError("unsupported byte constant %s" % token)
+
+
+def _unquote(token):
+    out = bytearray()
+    body = token[1:-1]
+    i = 0
+    escapes = {"n": 10, "r": 13, "t": 9, '"': 34, "\\": 92}
+    while i < len(body):
+        if body[i] == "\\":
+            nxt = body[i + 1]
+            if nxt == "x":
+                out.append(int(body[i + 2:i + 4], 16))
+                i += 4
+                continue
+            out.append(escapes[nxt])
+            i += 2
+        else:
+            out.extend(body[i].encode())
+            i += 1
+    return bytes(out)
+
+
+def field_index(table, name):
+    fields = FIELD_TABLES[table]
+    if name in fields:
+        return fields.index(name)
+    return int(name)
+
+
+def _varuint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _constant_args(ins):
+    """split pseudo-op arguments into (constant, rest) for byte literals"""
+    if ins.args and ins.args[0] in ("base64", "b64", "base32", "b32"):
+        return parse_bytes(*ins.args[:2]), ins.args[2:]
+    return parse_bytes(ins.args[0]), ins.args[1:]
+
+
+def _encode_static(ins):
+    """encode every immediate that does not depend on label positions"""
+    if ins.op == "int":
+        return bytes([OPS["pushint"].code]) + _varuint(parse_int(ins.args[0]))
+    if ins.op in ("byte", "addr", "method"):
+        if ins.op == "byte":
+            value, _ = _constant_args(ins)
+        elif ins.op == "addr":
+            value = decode_address(ins.args[0])
+        else:
+            value = method_selector(_unquote(ins.args[0]).decode())
+        return bytes([OPS["pushbytes"].code]) + _varuint(len(value)) + value
+    if ins.op not in OPS:
+        raise TealError("unsupported opcode %s on line %d" % (ins.op, ins.line))
+    op = OPS[ins.op]
+    out = bytearray([op.code])
+    args = list(ins.args)
+    for kind in op.immediates:
+        if kind == "u8":
+            out.append(parse_int(args.pop(0)) & 0xFF)
+        elif kind == "i8":
+            out.append(parse_int(args.pop(0)) & 0xFF)
+        elif kind.startswith("field:"):
+            out.append(field_index(kind[6:], args.pop(0)))
+        elif kind == "varuint":
+            out.extend(_varuint(parse_int(args.pop(0))))
+        elif kind == "bytes":
+            value = parse_bytes(*args)
+            out.extend(_varuint(len(value)) + value)
+            args = []
+        elif kind == "varuints":
+            out.extend(_varuint(len(args)))
+            for a in args:
+                out.extend(_varuint(parse_int(a)))
+            args = []
+        elif kind == "bytess":
+            out.extend(_varuint(len(args)))
+            for a in args:
+                value = parse_bytes(a)
+                out.extend(_varuint(len(value)) + value)
+            args = []
+        elif kind == "label":
+            out.extend(b"\x00\x00")
+            args.pop(0)
+        elif kind == "labels":
+            out.append(len(args))
+            out.extend(b"\x00\x00" * len(args))
+            args = []
+    return bytes(out)
+
+
+def assemble(program):
+    """assemble a Program to AVM bytecode, recording pc and size per instruction"""
+    encoded = []
+    pc = 1
+    for ins in program.instructions:
+        raw = _encode_static(ins)
+        ins.pc = pc
+        ins.size = len(raw)
+        encoded.append(bytearray(raw))
+        pc += len(raw)
+    for ins, raw in zip(program.instructions, encoded):
+        if ins.op not in BRANCHES:
+            continue
+        after = ins.pc + ins.size
+        offsets = []
+        for label in ins.args:
+            index = program.target(label)
+            dest = (program.instructions[index].pc
+                    if index < len(program.instructions) else pc)
+            offset = dest - after
+            if not -0x8000 <= offset <= 0x7FFF:
+                raise TealError("branch to %s out of range" % label)
+            offsets.append(offset.to_bytes(2, "big", signed=True))
+        start = 2 if ins.op in ("switch", "match") else 1
+        raw[start:] = b"".join(offsets)
+    return bytes([program.version]) + b"".join(bytes(r) for r in encoded)
+
+
+def extra_pages(approval, clear=b""):
+    """the ExtraProgramPages an app of these two bytecodes has to be created with
+
+    together they may take one page of PAGE_SIZE bytes plus up to
+    MAX_EXTRA_PAGES extra ones; anything larger can't be deployed.
+    """
+    pages = max(0, -(-(len(approval) + len(clear)) // PAGE_SIZE) - 1)
+    if pages > MAX_EXTRA_PAGES:
+        raise TealError("programs of %d bytes need %d extra pages, more than %d"
+                        % (len(approval) + len(clear), pages, MAX_EXTRA_PAGES))
+    return pages
+
+
+def decode_address(address):
+    raw = base64.b32decode(address + "=" * (-len(address) % 8))
+    return raw[:32]
+
+
+def method_selector(signature):
+    import hashlib
+    return hashlib.new("sha512_256", signature.encode()).digest()[:4]
+
+
+Block = namedtuple("Block", ["index", "start", "end", "label", "successors"])
+
+
+def successors(program, i):
+    """indices of the instructions that may execute after instruction i"""
+    ins = program.instructions[i]
+    if ins.op in ("return", "retsub", "err"):
+        return []
+    if ins.op == "b":
+        return [program.target(ins.args[0])]
+    if ins.op in ("bnz", "bz"):
+        return [i + 1, program.target(ins.args[0])]
+    if ins.op in ("switch", "match"):
+        return [i + 1] + [program.target(a) for a in ins.args]
+    return [i + 1]
+
+
+def basic_blocks(program):
+    """split a program into basic blocks; callsub does not end a block"""
+    n = len(program.instructions)
+    leaders = {0}
+    leaders.update(program.labels.values())
+    for i, ins in enumerate(program.instructions):
+        if ins.op in BRANCHES and ins.op != "callsub" or ins.op in TERMINATORS:
+            leaders.add(i + 1)
+    starts = sorted(x for x in leaders if x < n)
+    index_of = {start: k for k, start in enumerate(starts)}
+    names = {}
+    for label, target in program.labels.items():
+        names.setdefault(target, label)
+    blocks = []
+    for k, start in enumerate(starts):
+        end = starts[k + 1] if k + 1 < len(starts) else n
+        succ = [index_of[s] for s in successors(program, end - 1) if s < n]
+        label = names.get(start, program.instructions[start].label)
+        blocks.append(Block(k, start, end, label, sorted(set(succ))))
+    return blocks
+
+
+# instructions that may be repeated or dropped without changing what a
+# program does, so an If chain recomputing its subject from them can be
+# turned into a switch that computes it once
+PURE_OPS = {
+    "txn", "txna", "gtxn", "gtxns", "global", "load", "frame_dig", "int",
+    "pushint", "intc", "intc_0", "intc_1", "intc_2", "intc_3", "byte",
+    "pushbytes", "bytec", "bytec_0", "bytec_1", "bytec_2", "bytec_3", "btoi",
+    "len", "%", "&", "|", "shr", "extract", "extract_uint16", "extract_uint32",
+    "extract_uint64",
+}
+INT_CONSTANTS = ("int", "pushint", "intc", "intc_0", "intc_1", "intc_2", "intc_3")
+# the largest jump table lower_switches builds
+MAX_SWITCH_LABELS = 64
+
+
+def _int_constant(ins, intc):
+    if ins.op in ("int", "pushint"):
+        return parse_int(ins.args[0])
+    if ins.op == "intc":
+        return intc[parse_int(ins.args[0])]
+    return intc[int(ins.op[5:])]
+
+
+def _switch_chains(program):
+    """runs of `<subject> int k == bnz L` sharing one pure subject
+
+    yields (start, last, subject length, {k: label}) with the instruction
+    indices of the first subject instruction and of the last bnz.
+    """
+    ins = program.instructions
+    targets = set(program.labels.values())
+
+    def case(p):
+        """(k, label) when instruction p is the bnz of `int k == bnz L`"""
+        if (2 <= p < len(ins) and ins[p].op == "bnz" and ins[p - 1].op == "=="
+                and ins[p - 2].op in INT_CONSTANTS):
+            return _int_constant(ins[p - 2], program.intc), ins[p].args[0]
+        return None
+
+    def repeats(subject, at):
+        """the subject is recomputed at index at, which nothing jumps into"""
+        n = len(subject)
+        return (at >= 0 and at + n <= len(ins)
+                and all(a.op == b.op and a.args == b.args
+                        for a, b in zip(ins[at:at + n], subject))
+                and not any(t in targets for t in range(at + 1, at + n + 3)))
+
+    p = 0
+    while p < len(ins):
+        first = case(p)
+        if first is None:
+            p += 1
+            continue
+        # the subject is whatever pure code recomputes it before the next case
+        q = p + 1
+        while q < len(ins) and ins[q].op in PURE_OPS:
+            q += 1
+        subject = ins[p + 1:q - 1]
+        start = p - 2 - len(subject)
+        if not subject or case(q + 1) is None or not repeats(subject, start):
+            p += 1
+            continue
+        cases = {first[0]: first[1]}
+        last = p
+        while True:
+            nxt = last + len(subject) + 3
+            found = case(nxt)
+            if found is None or found[0] in cases or not repeats(subject, last + 1):
+                break
+            cases[found[0]] = found[1]
+            last = nxt
+        if len(cases) >= 2 and max(cases) < MAX_SWITCH_LABELS:
+            yield start, last, len(subject), cases
+        p = last + 1
+
+
+def lower_switches(source):
+    """rewrite If chains over one integer subject into switch jump tables
+
+    PyTeal has no switch, so `If(x == Int(0)).Then(a).ElseIf(x == Int(1))...`
+    compiles to a comparison per case.  Each run of `<x> int k == bnz L` is
+    replaced by `<x> switch ...`, with the code after the chain as the target
+    of every missing k, so every case costs the same to reach.
+    """
+    program = parse(source)
+    chains = list(_switch_chains(program))
+    if not chains:
+        return source
+    lines = source.splitlines()
+    ins = program.instructions
+    used = set(program.labels)
+    out = []
+    cursor = 0
+    for start, last, subject, cases in chains:
+        out.extend(lines[cursor:ins[start + subject - 1].line])
+        table = [cases.get(k) for k in range(max(cases) + 1)]
+        default = None
+        if None in table:
+            owner = "main" if ins[last].label.startswith("main") \
+                else re.sub(r"_l\d+$", "", ins[last].label)
+            n = 0
+            while "%s_l%d" % (owner, n) in used:
+                n += 1
+            default = "%s_l%d" % (owner, n)
+            used.add(default)
+        out.append("switch " + " ".join(label or default for label in table))
+        if default:
+            out.append(default + ":")
+        cursor = ins[last].line
+    out.extend(lines[cursor:])
+    return "\n".join(out) + ("\n" if source.endswith("\n") else "")